@@ -0,0 +1,159 @@
+import argparse
+import gzip
+import json
+import os
+import uuid
+from datetime import date, datetime, timezone
+from dotenv import load_dotenv
+
+from database import SessionLocal
+from models import ArchivedReceipts, Receipts
+from page_cache import page_cache
+from partitions import add_months, month_start
+
+
+load_dotenv()
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_RETENTION_MONTHS = int(os.getenv("ARCHIVE_RETENTION_MONTHS", 13))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 1000))
+
+
+class ArchiveVerificationError(Exception):
+    pass
+
+
+def retention_cutoff(today: date = None,
+                     retention_months: int = ARCHIVE_RETENTION_MONTHS):
+    cutoff = add_months(month_start(today or date.today()), -retention_months)
+    return datetime(cutoff.year, cutoff.month, cutoff.day,
+                    tzinfo=timezone.utc)
+
+
+def utc_isoformat(value: datetime) -> str:
+    # The same "Z" suffix the API renders UTC times with
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def receipt_to_dict(receipt) -> dict:
+    return {
+        "id": str(receipt.id),
+        "products": receipt.products,
+        "payment": receipt.payment,
+        "total": float(receipt.total),
+        "rest": float(receipt.rest),
+        "created_at": utc_isoformat(receipt.created_at),
+        "owner_id": receipt.owner_id,
+    }
+
+
+def write_archive_file(receipts, month: date, archive_dir: str = ARCHIVE_DIR):
+    relative_path = os.path.join(
+        f"year={month:%Y}", f"month={month:%m}",
+        f"receipts-{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        ".ndjson.gz")
+    path = os.path.join(archive_dir, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with gzip.open(path, "wt", encoding="utf-8") as archive_file:
+        for receipt in receipts:
+            archive_file.write(json.dumps(receipt_to_dict(receipt)) + "\n")
+
+    with gzip.open(path, "rt", encoding="utf-8") as archive_file:
+        written = sum(1 for _ in archive_file)
+
+    if written != len(receipts):
+        raise ArchiveVerificationError(
+            f"{path}: expected {len(receipts)} rows, found {written}")
+
+    return relative_path
+
+
+def archive_batch(db, cutoff: datetime, batch_size: int, archive_dir: str):
+    receipts = db.query(Receipts).filter(Receipts.created_at < cutoff)\
+        .order_by(Receipts.created_at, Receipts.id).limit(batch_size).all()
+
+    by_month = {}
+    for receipt in receipts:
+        by_month.setdefault(month_start(receipt.created_at), []).append(receipt)
+
+    for month, month_receipts in by_month.items():
+        relative_path = write_archive_file(month_receipts, month, archive_dir)
+        db.add_all(ArchivedReceipts(
+            id=receipt.id,
+            owner_id=receipt.owner_id,
+            created_at=receipt.created_at,
+            path=relative_path,
+            line=line,
+        ) for line, receipt in enumerate(month_receipts))
+
+    # Files are verified before the rows are removed, and the index and the
+    # delete are committed together.
+    db.query(Receipts).filter(Receipts.created_at < cutoff)\
+        .filter(Receipts.id.in_([receipt.id for receipt in receipts]))\
+        .delete(synchronize_session=False)
+    db.commit()
+
+    return len(receipts)
+
+
+def archive_receipts(cutoff: datetime = None,
+                     batch_size: int = ARCHIVE_BATCH_SIZE,
+                     archive_dir: str = ARCHIVE_DIR,
+                     session_factory=SessionLocal):
+    cutoff = cutoff or retention_cutoff()
+    archived = 0
+
+    while True:
+        db = session_factory()
+        try:
+            count = archive_batch(db, cutoff, batch_size, archive_dir)
+        finally:
+            db.close()
+
+        archived += count
+        if count < batch_size:
+            # archived receipts are no longer listed
+            if archived:
+                page_cache.invalidate_all()
+            return archived
+
+
+def load_archived_receipt(db, receipt_id: str, owner_id: int = None,
+                          archive_dir: str = None):
+    query = db.query(ArchivedReceipts).filter(
+        ArchivedReceipts.id == receipt_id)
+    if owner_id is not None:
+        query = query.filter(ArchivedReceipts.owner_id == owner_id)
+    archived_receipt = query.first()
+
+    if not archived_receipt:
+        return None
+
+    path = os.path.join(archive_dir or ARCHIVE_DIR, archived_receipt.path)
+    with gzip.open(path, "rt", encoding="utf-8") as archive_file:
+        for line, content in enumerate(archive_file):
+            if line == archived_receipt.line:
+                return json.loads(content)
+
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Move receipts older than the retention window "
+                    "to compressed archive files")
+    parser.add_argument("--retention-months", type=int,
+                        default=ARCHIVE_RETENTION_MONTHS)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    archived = archive_receipts(
+        cutoff=retention_cutoff(retention_months=args.retention_months),
+        batch_size=args.batch_size,
+        archive_dir=args.archive_dir,
+    )
+    print(f"Archived {archived} receipts")
@@ -0,0 +1,61 @@
+"""Bulk render throughput across process pool sizes.
+
+Renders the same receipts through render_chunks with 1 up to cpu_count
+workers, so the speedup of each pool size over a single worker shows how
+rendering scales with cores. Run from the project root:
+
+    python -m benchmarks.bench_bulk_render
+    python -m benchmarks.bench_bulk_render --receipts 100000 --format escpos
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.bench_rendering import build_receipt
+from bulk_render import RENDER_BATCH_SIZE, render_chunks
+from rendering import FORMATS, render_batch
+
+
+async def measure(pool, batches, output_format: str, width: int, workers: int):
+    start = time.perf_counter()
+    async for _ in render_chunks(batches, output_format, width, pool,
+                                 max_pending=workers * 2):
+        pass
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--receipts", type=int, default=20000)
+    parser.add_argument("--products", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=RENDER_BATCH_SIZE)
+    parser.add_argument("--format", choices=FORMATS, default="text")
+    parser.add_argument("--width", type=int, default=50)
+    args = parser.parse_args()
+
+    receipts = [build_receipt(args.products) for _ in range(args.receipts)]
+    batches = [receipts[start:start + args.batch_size]
+               for start in range(0, len(receipts), args.batch_size)]
+
+    print(f"{'workers':>8} {'receipts/s':>12} {'speedup':>8}")
+    baseline = None
+    for workers in range(1, (os.cpu_count() or 1) + 1):
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn")) as pool:
+            # start the workers and compile their layouts before timing
+            list(pool.map(render_batch, [batches[0][:1]] * workers,
+                          [args.format] * workers, [args.width] * workers))
+            elapsed = asyncio.run(measure(pool, batches, args.format,
+                                          args.width, workers))
+        throughput = args.receipts / elapsed
+        baseline = baseline or throughput
+        print(f"{workers:>8} {throughput:>12,.0f} "
+              f"{throughput / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
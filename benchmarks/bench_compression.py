@@ -0,0 +1,82 @@
+"""CPU cost versus bytes on the wire for compressed receipt listing pages.
+
+Run from the project root:
+
+    python -m benchmarks.bench_compression
+"""
+import json
+import time
+import uuid
+from datetime import datetime
+
+from compression import BrotliEncoder, GzipEncoder, brotli
+
+
+PAGE_SIZES = [10, 50, 200, 1000, 5000]
+LINK_SPEED_BYTES = 1_000_000 / 8  # 1 Mbit/s mobile link
+REPEATS = 5
+
+
+def build_page(size: int) -> bytes:
+    results = [
+        {
+            "id": str(uuid.uuid4()),
+            "products": [
+                {"name": "Bar of chocolate", "price": 10.38,
+                 "quantity": 2.0, "total": 20.76},
+                {"name": "Bottle of sparkling water", "price": 5.65,
+                 "quantity": 3.0, "total": 16.95},
+            ],
+            "payment": {"type": "cash", "amount": 40.0},
+            "total": 37.71,
+            "rest": 2.29,
+            "created_at": datetime.utcnow().isoformat(),
+            "owner_id": 1,
+        }
+        for _ in range(size)
+    ]
+    page = {"total_results": size, "page": 1, "pages": 1,
+            "size": size, "results": results}
+    return json.dumps(page, separators=(",", ":")).encode()
+
+
+def measure(create_encoder, body: bytes):
+    timings = []
+    for _ in range(REPEATS):
+        encoder = create_encoder()
+        start = time.perf_counter()
+        compressed = encoder.compress(body) + encoder.finish()
+        timings.append(time.perf_counter() - start)
+    return min(timings), len(compressed)
+
+
+def main():
+    encoders = [
+        ("identity", None),
+        ("gzip-1", lambda: GzipEncoder(1)),
+        ("gzip-6", lambda: GzipEncoder(6)),
+        ("gzip-9", lambda: GzipEncoder(9)),
+    ]
+    if brotli is not None:
+        encoders += [
+            ("br-4", lambda: BrotliEncoder(4)),
+            ("br-11", lambda: BrotliEncoder(11)),
+        ]
+
+    print(f"{'size':>6} {'encoding':>9} {'bytes':>10} {'ratio':>7} "
+          f"{'cpu ms':>8} {'wire ms':>9} {'total ms':>9}")
+    for size in PAGE_SIZES:
+        body = build_page(size)
+        for name, create_encoder in encoders:
+            if create_encoder is None:
+                cpu, length = 0.0, len(body)
+            else:
+                cpu, length = measure(create_encoder, body)
+            wire = length / LINK_SPEED_BYTES
+            print(f"{size:>6} {name:>9} {length:>10} "
+                  f"{len(body) / length:>7.1f} {cpu * 1000:>8.2f} "
+                  f"{wire * 1000:>9.1f} {(cpu + wire) * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
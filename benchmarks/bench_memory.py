@@ -0,0 +1,112 @@
+"""Peak memory of serializing receipt listing pages, built versus streamed.
+
+A built page is what the cached receipt listings return: the rows of the
+page, a list of their models and the JSON document all exist at once. A
+streamed page, like `/admin/receipts`, serializes rows as they come from the
+cursor. Peak allocations are measured with tracemalloc for both views and
+several page sizes; rows come from a generator standing in for the cursor,
+so no database is needed.
+
+Run from the project root:
+
+    python -m benchmarks.bench_memory
+"""
+import itertools
+import tracemalloc
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from models import Receipts
+from pagination import (
+    STREAM_BATCH_SIZE,
+    PagedResponseSchema,
+    PagedStreamingResponse,
+)
+from routers.receipts import ReceiptSchema, ReceiptSummarySchema
+
+
+PAGE_SIZES = [10, 100, 1000, 5000, 20000]
+
+
+def full_row(number: int):
+    return Receipts(
+        id=uuid.uuid4(),
+        products=[
+            {"name": "Bar of chocolate", "price": 10.38,
+             "quantity": 2.0, "total": 20.76},
+            {"name": f"Bottle of sparkling water {number}", "price": 5.65,
+             "quantity": 3.0, "total": 16.95},
+        ],
+        payment={"type": "cash", "amount": 40.0},
+        total=37.71,
+        rest=2.29,
+        created_at=datetime.now(timezone.utc),
+        owner_id=1,
+    )
+
+
+def summary_row(number: int):
+    return SimpleNamespace(id=uuid.uuid4(), total=37.71 + number,
+                           created_at=datetime.now(timezone.utc),
+                           payment_type="cash", items_count=2, owner_id=1)
+
+
+VIEWS = {
+    "full": (full_row, ReceiptSchema),
+    "summary": (summary_row, ReceiptSummarySchema),
+}
+
+
+def cursor(create_row, size: int):
+    # like Query.yield_per(), rows are fetched STREAM_BATCH_SIZE at a time
+    numbers = iter(range(size))
+    while batch := [create_row(number) for number in
+                    itertools.islice(numbers, STREAM_BATCH_SIZE)]:
+        yield from batch
+
+
+def built_page(create_row, ResponseSchema, size: int) -> int:
+    rows = list(cursor(create_row, size))
+    page = PagedResponseSchema(
+        total_results=size, page=1, pages=1, size=size,
+        results=[ResponseSchema.model_validate(row) for row in rows])
+    return len(page.model_dump_json())
+
+
+def streamed_page(create_row, ResponseSchema, size: int) -> int:
+    response = PagedStreamingResponse(
+        total_results=size, page=1, pages=1, size=size,
+        results=cursor(create_row, size), ResponseSchema=ResponseSchema)
+    # chunks are dropped as they are sent
+    return sum(len(chunk) for chunk in response.chunks)
+
+
+def peak_allocated(serialize_page, *args):
+    tracemalloc.start()
+    try:
+        length = serialize_page(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, length
+
+
+def main():
+    print(f"{'view':>8} {'size':>6} {'bytes':>10} {'built KiB':>10} "
+          f"{'streamed KiB':>13} {'ratio':>7}")
+    for view, (create_row, ResponseSchema) in VIEWS.items():
+        # one-off allocations of the first rows shouldn't count for any size
+        built_page(create_row, ResponseSchema, 1)
+        streamed_page(create_row, ResponseSchema, 1)
+        for size in PAGE_SIZES:
+            built, length = peak_allocated(
+                built_page, create_row, ResponseSchema, size)
+            streamed, _ = peak_allocated(
+                streamed_page, create_row, ResponseSchema, size)
+            print(f"{view:>8} {size:>6} {length:>10} {built / 1024:>10.0f} "
+                  f"{streamed / 1024:>13.0f} {built / streamed:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Exact decimal receipt totals versus the previous float loop.
+
+Run from the project root:
+
+    python -m benchmarks.bench_money
+"""
+import random
+import time
+from decimal import Decimal
+
+from money import receipt_totals
+
+
+RECEIPT_SIZES = [10, 100, 1000, 10000]
+REPEATS = 5
+
+
+def float_totals(products, payment_amount):
+    total_per_receipt = 0
+    totals = []
+    for product in products:
+        total_per_product = round(product["price"] * product["quantity"], 2)
+        total_per_receipt += total_per_product
+        totals.append(total_per_product)
+    return totals, round(total_per_receipt, 2), \
+        round(payment_amount - total_per_receipt, 2)
+
+
+def build_products(size: int):
+    return [{"name": f"Product {i}",
+             "price": round(random.uniform(0.01, 500), 2),
+             "quantity": random.choice([1, 2, 3, 0.5, 1.25, 2.75])}
+            for i in range(size)]
+
+
+def measure(function, products):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = function(products, 10 ** 9)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    random.seed(0)
+    print(f"{'items':>6} {'float ms':>9} {'decimal ms':>11} {'slowdown':>9} "
+          f"{'line drift':>11} {'total drift':>12}")
+    for size in RECEIPT_SIZES:
+        products = build_products(size)
+        float_time, (float_lines, float_total, _) = measure(
+            float_totals, products)
+        decimal_time, (decimal_lines, decimal_total, _) = measure(
+            receipt_totals, products)
+
+        line_drift = sum(1 for a, b in zip(float_lines, decimal_lines)
+                         if Decimal(str(a)) != b)
+        total_drift = abs(Decimal(str(float_total)) - decimal_total)
+        print(f"{size:>6} {float_time * 1000:>9.3f} "
+              f"{decimal_time * 1000:>11.3f} "
+              f"{decimal_time / float_time:>8.1f}x {line_drift:>11} "
+              f"{total_drift:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Per-receipt render cost of each output format.
+
+"cold" compiles the layout for every receipt, "warm" reuses the cached
+layout the endpoint uses. Run from the project root:
+
+    python -m benchmarks.bench_rendering
+"""
+import random
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from rendering import FORMATS, LAYOUTS, get_layout
+
+
+PRODUCT_COUNTS = [1, 10, 100]
+WIDTHS = [32, 50]
+RECEIPTS = 2000
+
+
+def build_receipt(product_count: int) -> dict:
+    products = [{"name": f"Product {i} " + "family pack " * random.randint(0, 4),
+                 "price": round(random.uniform(0.01, 500), 2),
+                 "quantity": random.choice([1, 2, 3, 0.5, 1.25])}
+                for i in range(product_count)]
+    return {
+        "issuer": "ФОП ТЕСТ КОРИСТУВАЧ",
+        "products": products,
+        "payment": {"type": "cash", "amount": 100000.00},
+        "total": Decimal("1234.56"),
+        "rest": Decimal("12.34"),
+        "created_at": datetime.now(timezone.utc),
+    }
+
+
+def measure(render, receipts):
+    start = time.perf_counter()
+    for receipt in receipts:
+        render(receipt)
+    return (time.perf_counter() - start) / len(receipts)
+
+
+def main():
+    print(f"{'format':>7} {'width':>6} {'items':>6} {'cold us':>9} "
+          f"{'warm us':>9}")
+    for product_count in PRODUCT_COUNTS:
+        receipts = [build_receipt(product_count) for _ in range(RECEIPTS)]
+        for output_format in FORMATS:
+            for width in WIDTHS:
+                layout_class = LAYOUTS[output_format]
+                cold = measure(
+                    lambda receipt: layout_class(width).render(receipt),
+                    receipts)
+                warm = measure(get_layout(output_format, width).render,
+                               receipts)
+                print(f"{output_format:>7} {width:>6} {product_count:>6} "
+                      f"{cold * 10 ** 6:>9.1f} {warm * 10 ** 6:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
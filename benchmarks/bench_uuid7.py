@@ -0,0 +1,78 @@
+"""Primary key insert throughput with random UUIDv4 versus time-ordered UUIDv7.
+
+Inserts into a scratch table with a UUID primary key on the database from
+the DB_* settings, then reports rows per second and the size of the primary
+key index. Run from the project root:
+
+    python -m benchmarks.bench_uuid7
+    python -m benchmarks.bench_uuid7 --rows 2000000 --batch-size 5000
+"""
+import argparse
+import time
+import uuid
+
+from sqlalchemy import text
+
+from database import engine
+from ids import uuid7
+
+
+TABLE = "bench_uuid_keys"
+
+
+def measure_generation(generate, count: int):
+    start = time.perf_counter()
+    for _ in range(count):
+        generate()
+    return time.perf_counter() - start
+
+
+def measure_inserts(connection, generate, rows: int, batch_size: int):
+    connection.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+    connection.execute(text(
+        f"CREATE TABLE {TABLE} (id UUID PRIMARY KEY, payload TEXT)"))
+    connection.commit()
+
+    start = time.perf_counter()
+    for offset in range(0, rows, batch_size):
+        batch = [{"id": generate(), "payload": "receipt"}
+                 for _ in range(min(batch_size, rows - offset))]
+        connection.execute(text(
+            f"INSERT INTO {TABLE} (id, payload) VALUES (:id, :payload)"),
+            batch)
+        connection.commit()
+    elapsed = time.perf_counter() - start
+
+    index_size = connection.execute(text(
+        f"SELECT pg_relation_size('{TABLE}_pkey')")).scalar()
+    connection.execute(text(f"DROP TABLE {TABLE}"))
+    connection.commit()
+
+    return elapsed, index_size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=500000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    generators = [("uuid4", uuid.uuid4), ("uuid7", uuid7)]
+
+    print(f"{'generator':>10} {'generate/s':>12}")
+    for name, generate in generators:
+        elapsed = measure_generation(generate, args.rows)
+        print(f"{name:>10} {args.rows / elapsed:>12,.0f}")
+
+    print()
+    print(f"{'generator':>10} {'rows':>10} {'rows/s':>10} {'pkey size':>12}")
+    with engine.connect() as connection:
+        for name, generate in generators:
+            elapsed, index_size = measure_inserts(
+                connection, generate, args.rows, args.batch_size)
+            print(f"{name:>10} {args.rows:>10} {args.rows / elapsed:>10,.0f} "
+                  f"{index_size / 2 ** 20:>9,.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import asyncio
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+
+from models import Receipts, Users
+from rendering import issuer_name, render_batch
+
+
+load_dotenv()
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", os.cpu_count() or 1))
+RENDER_BATCH_SIZE = int(os.getenv("RENDER_BATCH_SIZE", 200))
+
+render_pool = None
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    global render_pool
+    if render_pool is None:
+        # Spawned workers only import the rendering module, not the
+        # application with its threads and database connections.
+        render_pool = ProcessPoolExecutor(
+            max_workers=RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"))
+    return render_pool
+
+
+def shutdown_render_pool():
+    global render_pool
+    if render_pool is not None:
+        render_pool.shutdown(cancel_futures=True)
+        render_pool = None
+
+
+def receipt_batches(db, criteria, batch_size: int = RENDER_BATCH_SIZE):
+    query = select(
+        Receipts.products,
+        Receipts.payment,
+        Receipts.total,
+        Receipts.rest,
+        Receipts.created_at,
+        Users.first_name,
+        Users.last_name,
+    ).join(Users, Users.id == Receipts.owner_id).where(*criteria)\
+        .order_by(Receipts.created_at, Receipts.id)\
+        .execution_options(yield_per=batch_size)
+
+    try:
+        for rows in db.execute(query).partitions():
+            yield [{
+                "issuer": issuer_name(row.first_name, row.last_name),
+                "products": row.products,
+                "payment": row.payment,
+                "total": row.total,
+                "rest": row.rest,
+                "created_at": row.created_at,
+            } for row in rows]
+    finally:
+        db.close()
+
+
+async def render_chunks(batches, output_format: str, width: int,
+                        pool: ProcessPoolExecutor = None,
+                        max_pending: int = RENDER_WORKERS * 2):
+    pool = pool or get_render_pool()
+    batches = iter(batches)
+    pending = deque()
+    exhausted = False
+
+    # Batches are read while earlier ones render, and the number of batches
+    # in flight is bounded so a slow client doesn't pile up rendered output.
+    try:
+        while True:
+            while not exhausted and len(pending) < max_pending:
+                batch = await run_in_threadpool(next, batches, None)
+                if batch is None:
+                    exhausted = True
+                    break
+                pending.append(asyncio.wrap_future(
+                    pool.submit(render_batch, batch, output_format, width)))
+
+            if not pending:
+                return
+
+            # chunks are yielded in the order of the batches
+            yield await pending.popleft()
+    finally:
+        for future in pending:
+            future.cancel()
+        if hasattr(batches, "close"):
+            batches.close()
+
+
+def render_in_pool(batches, output_format: str, width: int,
+                   pool: ProcessPoolExecutor = None,
+                   max_pending: int = RENDER_WORKERS * 2):
+    # The blocking counterpart of render_chunks for export jobs, which run
+    # in threads of their own. Chunks come with their number of receipts.
+    pool = pool or get_render_pool()
+    pending = deque()
+    try:
+        for batch in batches:
+            pending.append((len(batch), pool.submit(
+                render_batch, batch, output_format, width)))
+            if len(pending) >= max_pending:
+                count, future = pending.popleft()
+                yield count, future.result()
+
+        while pending:
+            count, future = pending.popleft()
+            yield count, future.result()
+    finally:
+        for _, future in pending:
+            future.cancel()
+        if hasattr(batches, "close"):
+            batches.close()
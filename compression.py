@@ -0,0 +1,184 @@
+import os
+import zlib
+from dotenv import load_dotenv
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+load_dotenv()
+
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", 1024))
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", 4))
+
+# compressing these again gains nothing
+COMPRESSED_MEDIA_TYPES = ("application/gzip", "application/zip")
+# Sent as they are, headers first, since a client waits for the headers of
+# an event stream before any event, and events can be seconds apart.
+STREAMED_MEDIA_TYPES = ("text/event-stream",)
+
+
+class GzipEncoder:
+    encoding = "gzip"
+
+    def __init__(self, level: int = COMPRESSION_LEVEL):
+        # wbits=31 writes a gzip header and trailer around the deflate stream
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder:
+    encoding = "br"
+
+    def __init__(self, quality: int = BROTLI_QUALITY):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush()
+
+    def finish(self) -> bytes:
+        return self.compressor.finish()
+
+
+def select_encoding(accept_encoding: str):
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp,
+                 minimum_size: int = COMPRESSION_MINIMUM_SIZE,
+                 compresslevel: int = COMPRESSION_LEVEL,
+                 brotli_quality: int = BROTLI_QUALITY):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+        self.brotli_quality = brotli_quality
+
+    def create_encoder(self, encoding: str):
+        if encoding == "br":
+            return BrotliEncoder(self.brotli_quality)
+        return GzipEncoder(self.compresslevel)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http":
+            headers = Headers(scope=scope)
+            encoding = select_encoding(headers.get("Accept-Encoding", ""))
+            if encoding:
+                responder = CompressionResponder(
+                    self.app, self.create_encoder(encoding), self.minimum_size)
+                await responder(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, encoder, minimum_size: int):
+        self.app = app
+        self.encoder = encoder
+        self.minimum_size = minimum_size
+        self.send = None
+        self.initial_message: Message = {}
+        self.started = False
+        self.passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.send = send
+        await self.app(scope, receive, self.send_with_compression)
+
+    def set_encoding_headers(self):
+        headers = MutableHeaders(raw=self.initial_message["headers"])
+        headers["Content-Encoding"] = self.encoder.encoding
+        headers.add_vary_header("Accept-Encoding")
+        return headers
+
+    async def send_with_compression(self, message: Message):
+        message_type = message["type"]
+
+        if message_type == "http.response.start":
+            # Headers are held back until the first body chunk tells us
+            # whether the response is worth compressing.
+            self.initial_message = message
+            headers = Headers(raw=message["headers"])
+            # Byte ranges refer to the body as it is, so partial responses
+            # are never encoded.
+            content_type = headers.get("content-type", "")
+            self.passthrough = "content-encoding" in headers or \
+                "content-range" in headers or \
+                content_type.startswith(COMPRESSED_MEDIA_TYPES)
+            if content_type.startswith(STREAMED_MEDIA_TYPES):
+                self.passthrough = self.started = True
+                await self.send(message)
+        elif message_type == "http.response.body" and self.passthrough:
+            if not self.started:
+                self.started = True
+                await self.send(self.initial_message)
+            await self.send(message)
+        elif message_type == "http.response.body" and not self.started:
+            self.started = True
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if len(body) < self.minimum_size and not more_body:
+                await self.send(self.initial_message)
+                await self.send(message)
+            elif not more_body:
+                body = self.encoder.compress(body) + self.encoder.finish()
+                headers = self.set_encoding_headers()
+                headers["Content-Length"] = str(len(body))
+                message["body"] = body
+
+                await self.send(self.initial_message)
+                await self.send(message)
+            else:
+                # Streaming responses are flushed chunk by chunk so that
+                # clients still receive rows as soon as they are produced.
+                headers = self.set_encoding_headers()
+                del headers["Content-Length"]
+                message["body"] = self.encoder.compress(body) + self.encoder.flush()
+
+                await self.send(self.initial_message)
+                await self.send(message)
+        elif message_type == "http.response.body":
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if more_body:
+                message["body"] = self.encoder.compress(body) + self.encoder.flush()
+            else:
+                message["body"] = self.encoder.compress(body) + self.encoder.finish()
+
+            await self.send(message)
+        else:
+            await self.send(message)
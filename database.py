@@ -1,4 +1,5 @@
 
+import itertools
 import os
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
@@ -12,11 +13,39 @@ DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
+DB_REPLICA_URLS = [url.strip() for url in
+                   os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()]
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", 5))
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# Sessions work in UTC, so timestamps come back as UTC aware datetimes and
+# naive datetimes in filters are read as UTC
+DB_CONNECT_ARGS = {"options": "-c timezone=UTC"}
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=DB_CONNECT_ARGS)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+replica_engines = [create_engine(url, connect_args=DB_CONNECT_ARGS)
+                   for url in DB_REPLICA_URLS]
+
+ReplicaSessionLocals = [
+    sessionmaker(autocommit=False, autoflush=False, bind=replica_engine,
+                 info={"replica": True})
+    for replica_engine in replica_engines
+]
+
 Base = declarative_base()
+
+replica_counter = itertools.count()
+
+
+def get_read_session(recently_written: bool = False):
+    # Clients that wrote recently keep reading from the primary until the
+    # replicas have had time to catch up with their own writes.
+    if not ReplicaSessionLocals or recently_written:
+        return SessionLocal()
+
+    replica_index = next(replica_counter) % len(ReplicaSessionLocals)
+    return ReplicaSessionLocals[replica_index]()
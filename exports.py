@@ -0,0 +1,294 @@
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from sqlalchemy import String, and_, or_, tuple_
+from starlette.concurrency import run_in_threadpool
+
+from archive import receipt_to_dict, utc_isoformat
+from bulk_render import receipt_batches as render_batches, render_in_pool
+from models import ExportJobs, Receipts
+
+
+load_dotenv()
+
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", 2))
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+EXPORT_LEASE_SECONDS = int(os.getenv("EXPORT_LEASE_SECONDS", 300))
+EXPORT_RETENTION_HOURS = int(os.getenv("EXPORT_RETENTION_HOURS", 24))
+EXPORT_EXPIRY_INTERVAL = int(os.getenv("EXPORT_EXPIRY_INTERVAL", 60 * 60))
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+EXPORT_FORMATS = ("ndjson", "csv")
+# rendered for reprinting by /admin/receipts/render with "output": "file"
+RENDER_FORMATS = ("text", "escpos", "html")
+# the columns read by import_receipts.py, followed by the computed ones
+CSV_COLUMNS = ["id", "created_at", "payment_type", "payment_amount",
+               "products", "total", "rest", "owner_id"]
+
+export_pool = None
+
+logger = logging.getLogger(__name__)
+
+
+class RangeNotSatisfiableError(Exception):
+    pass
+
+
+def export_criteria(filters: dict):
+    criteria = []
+    if filters.get("ids") is not None:
+        criteria.append(Receipts.id.in_(
+            [uuid.UUID(receipt_id) for receipt_id in filters["ids"]]))
+    if filters.get("owner_id") is not None:
+        criteria.append(Receipts.owner_id == filters["owner_id"])
+    if filters.get("payment_type") is not None:
+        criteria.append(Receipts.payment.op("->>")("type").cast(String)
+                        == filters["payment_type"])
+    if filters.get("created_from") is not None:
+        criteria.append(Receipts.created_at >= filters["created_from"])
+    if filters.get("created_before") is not None:
+        criteria.append(Receipts.created_at < filters["created_before"])
+    return criteria
+
+
+def export_path(job_id, output_format: str, export_dir: str = EXPORT_DIR):
+    return os.path.join(export_dir, f"receipts-{job_id}.{output_format}.gz")
+
+
+def receipt_to_csv_row(receipt) -> list:
+    return [receipt.id, utc_isoformat(receipt.created_at),
+            receipt.payment["type"], receipt.payment["amount"],
+            json.dumps(receipt.products), receipt.total, receipt.rest,
+            receipt.owner_id]
+
+
+def open_export_file(path: str, output_format: str):
+    if output_format == "escpos":
+        return gzip.open(path, "wb")
+    return gzip.open(path, "wt", encoding="utf-8", newline="")
+
+
+def receipt_batches(db, criteria, batch_size: int):
+    # Keyset batches are separate queries, so progress can be committed in
+    # between without a cursor held open for the whole export.
+    last_key = None
+    while True:
+        query = db.query(Receipts).filter(*criteria)
+        if last_key is not None:
+            query = query.filter(
+                tuple_(Receipts.created_at, Receipts.id) > last_key)
+        receipts = query.order_by(Receipts.created_at, Receipts.id)\
+            .limit(batch_size).all()
+        if not receipts:
+            return
+
+        last_key = (receipts[-1].created_at, receipts[-1].id)
+        yield receipts
+
+
+def write_export(export_file, job, db, session_factory, criteria,
+                 batch_size: int):
+    # Yields the number of receipts written after every batch
+    if job.format in RENDER_FORMATS:
+        # The rendered batches come from a server side cursor, which a
+        # commit would close, so they are read in a session of their own.
+        batches = render_batches(session_factory(), criteria, batch_size)
+        for count, chunk in render_in_pool(batches, job.format, job.width):
+            export_file.write(chunk)
+            yield count
+        return
+
+    writer = csv.writer(export_file)
+    if job.format == "csv":
+        writer.writerow(CSV_COLUMNS)
+
+    for receipts in receipt_batches(db, criteria, batch_size):
+        if job.format == "csv":
+            writer.writerows(map(receipt_to_csv_row, receipts))
+        else:
+            export_file.writelines(
+                json.dumps(receipt_to_dict(receipt)) + "\n"
+                for receipt in receipts)
+        yield len(receipts)
+
+
+def claimable_exports(lease_seconds: int = EXPORT_LEASE_SECONDS):
+    # A running job whose heartbeat stopped was cut short by a crash or by
+    # shutdown_export_pool() and is taken over.
+    stale = datetime.utcnow() - timedelta(seconds=lease_seconds)
+    return or_(ExportJobs.status == "pending",
+               and_(ExportJobs.status == "running",
+                    or_(ExportJobs.heartbeat_at.is_(None),
+                        ExportJobs.heartbeat_at < stale)))
+
+
+def run_export(job_id, session_factory, export_dir: str = EXPORT_DIR,
+               batch_size: int = EXPORT_BATCH_SIZE,
+               lease_seconds: int = EXPORT_LEASE_SECONDS):
+    db = session_factory()
+    partial_path = None
+    try:
+        # Claiming the job first keeps two processes from running it both
+        now = datetime.utcnow()
+        claimed = db.query(ExportJobs).filter(
+            ExportJobs.id == job_id, claimable_exports(lease_seconds))\
+            .update({"status": "running", "started_at": now,
+                     "heartbeat_at": now, "rows_written": 0},
+                    synchronize_session=False)
+        db.commit()
+        if not claimed:
+            return
+
+        job = db.get(ExportJobs, job_id)
+        criteria = export_criteria(job.filters)
+        job.rows_total = db.query(Receipts).filter(*criteria).count()
+        db.commit()
+
+        path = export_path(job.id, job.format, export_dir)
+        partial_path = f"{path}.part"
+        os.makedirs(export_dir, exist_ok=True)
+
+        # a .part file left by an interrupted run is written over
+        with open_export_file(partial_path, job.format) as export_file:
+            for count in write_export(export_file, job, db, session_factory,
+                                      criteria, batch_size):
+                job.rows_written += count
+                job.heartbeat_at = datetime.utcnow()
+                db.commit()
+
+        # the file only appears under its final name once it is complete
+        os.replace(partial_path, path)
+        job.path = path
+        job.size = os.path.getsize(path)
+        job.status = "completed"
+        job.finished_at = datetime.utcnow()
+        db.commit()
+    except Exception as error:
+        db.rollback()
+        if partial_path is not None and os.path.exists(partial_path):
+            os.remove(partial_path)
+        db.query(ExportJobs).filter(ExportJobs.id == job_id).update({
+            "status": "failed",
+            "error": str(error),
+            "finished_at": datetime.utcnow(),
+        })
+        db.commit()
+        raise
+    finally:
+        db.close()
+
+
+def get_export_pool() -> ThreadPoolExecutor:
+    global export_pool
+    if export_pool is None:
+        export_pool = ThreadPoolExecutor(max_workers=EXPORT_WORKERS,
+                                         thread_name_prefix="export")
+    return export_pool
+
+
+def shutdown_export_pool():
+    global export_pool
+    if export_pool is not None:
+        export_pool.shutdown(wait=False, cancel_futures=True)
+        export_pool = None
+
+
+def submit_export(job_id, session_factory):
+    return get_export_pool().submit(run_export, job_id, session_factory)
+
+
+def requeue_exports(session_factory,
+                    lease_seconds: int = EXPORT_LEASE_SECONDS):
+    # Jobs still queued or cut short when a process stopped are picked up
+    # again
+    db = session_factory()
+    try:
+        job_ids = [job_id for job_id, in db.query(ExportJobs.id).filter(
+            claimable_exports(lease_seconds))]
+    finally:
+        db.close()
+
+    for job_id in job_ids:
+        submit_export(job_id, session_factory)
+    return job_ids
+
+
+def expire_exports(session_factory,
+                   retention_hours: int = EXPORT_RETENTION_HOURS):
+    # Files of completed exports are deleted once they are older than the
+    # retention, the job itself is kept as "expired".
+    cutoff = datetime.utcnow() - timedelta(hours=retention_hours)
+    db = session_factory()
+    try:
+        jobs = db.query(ExportJobs).filter(
+            ExportJobs.status == "completed",
+            ExportJobs.finished_at < cutoff).all()
+        for job in jobs:
+            if job.path is not None and os.path.exists(job.path):
+                os.remove(job.path)
+            job.status = "expired"
+            job.path = None
+        job_ids = [job.id for job in jobs]
+        db.commit()
+        return job_ids
+    finally:
+        db.close()
+
+
+async def maintain_exports(session_factory,
+                           interval: int = EXPORT_EXPIRY_INTERVAL):
+    while True:
+        try:
+            await run_in_threadpool(expire_exports, session_factory)
+        except Exception:
+            logger.exception("Expiring exports failed")
+        await asyncio.sleep(interval)
+
+
+def parse_range(range_header: str, size: int):
+    # Only a single "bytes=start-end" range is served, anything else gets
+    # the whole file.
+    unit, _, byte_range = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in byte_range:
+        return None
+
+    start, dash, end = byte_range.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if not start:
+            # a suffix range, the last `end` bytes
+            length = int(end)
+            if length <= 0:
+                raise RangeNotSatisfiableError()
+            return max(size - length, 0), size - 1
+
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+
+    if start >= size or end < start:
+        raise RangeNotSatisfiableError()
+    return start, min(end, size - 1)
+
+
+def read_file_range(path: str, start: int, end: int,
+                    chunk_size: int = EXPORT_CHUNK_SIZE):
+    with open(path, "rb") as export_file:
+        export_file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = export_file.read(min(chunk_size, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
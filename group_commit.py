@@ -0,0 +1,113 @@
+import asyncio
+import os
+from collections import deque
+from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+
+
+load_dotenv()
+
+GROUP_COMMIT_ENABLED = os.getenv(
+    "GROUP_COMMIT_ENABLED", "false").lower() == "true"
+GROUP_COMMIT_MAX_ROWS = int(os.getenv("GROUP_COMMIT_MAX_ROWS", 500))
+GROUP_COMMIT_MAX_DELAY_MS = int(os.getenv("GROUP_COMMIT_MAX_DELAY_MS", 5))
+
+
+class GroupCommitBuffer:
+    def __init__(self, write_rows, session_factory,
+                 max_rows: int = GROUP_COMMIT_MAX_ROWS,
+                 max_delay_ms: int = GROUP_COMMIT_MAX_DELAY_MS):
+        self.write_rows = write_rows
+        self.session_factory = session_factory
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000
+        # Rows wait here for the whole life of the buffer, a flusher that
+        # stopped is started again and carries on with whatever is left.
+        self.queue = deque()
+        self.loop = None
+        self.wakeup = None
+        self.flusher = None
+        self.closing = False
+
+    async def submit(self, row: dict):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop or self.flusher.done():
+            self.loop = loop
+            self.wakeup = asyncio.Event()
+            self.closing = False
+            self.flusher = loop.create_task(self.run())
+
+        # The caller only returns once the batch holding its row is committed
+        future = loop.create_future()
+        self.queue.append((row, future))
+        self.wakeup.set()
+        return await future
+
+    async def wait_for_rows(self, timeout: float = None) -> bool:
+        self.wakeup.clear()
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def run(self):
+        while True:
+            if not self.queue:
+                if self.closing:
+                    return
+                await self.wait_for_rows()
+                continue
+
+            deadline = self.loop.time() + self.max_delay
+            while len(self.queue) < self.max_rows and not self.closing:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0 or not await self.wait_for_rows(timeout):
+                    break
+
+            batch = [self.queue.popleft()
+                     for _ in range(min(len(self.queue), self.max_rows))]
+            await self.flush(batch)
+
+    async def flush(self, batch):
+        # A caller that went away (a disconnect or a timeout) has a cancelled
+        # future, its row is written all the same but nobody gets the result.
+        try:
+            results = await run_in_threadpool(
+                self.write, [row for row, _ in batch])
+        except Exception:
+            # One bad row must not fail the whole batch, so the rows are
+            # retried one by one and only the failing callers get the error.
+            for row, future in batch:
+                try:
+                    result, = await run_in_threadpool(self.write, [row])
+                except Exception as error:
+                    if not future.done():
+                        future.set_exception(error)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def write(self, rows):
+        db = self.session_factory()
+        try:
+            # write_rows returns one result per row, handed back to submit()
+            results = self.write_rows(db, rows)
+            db.commit()
+            return results
+        finally:
+            db.close()
+
+    async def close(self):
+        if self.flusher is None or self.loop is not asyncio.get_running_loop():
+            return
+
+        # Rows queued before shutdown are still written before the flusher
+        # stops.
+        self.closing = True
+        self.wakeup.set()
+        await self.flusher
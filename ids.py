@@ -0,0 +1,42 @@
+import os
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Only meaningful once the receipts being listed have time-ordered ids,
+# receipts created before UUIDv7 ids were introduced sort randomly by id.
+ORDER_RECEIPTS_BY_ID = os.getenv(
+    "ORDER_RECEIPTS_BY_ID", "false").lower() == "true"
+
+last_timestamp = 0
+timestamp_lock = threading.Lock()
+
+
+def uuid7(timestamp_ns: int = None) -> uuid.UUID:
+    # 48 bits of unix milliseconds, then 12 bits of the sub-millisecond
+    # fraction in place of rand_a (RFC 9562, method 3), so ids generated by
+    # this process are strictly increasing even within one millisecond.
+    # Ids for a given time, e.g. of imported receipts, are left out of that.
+    global last_timestamp
+
+    milliseconds, nanoseconds = divmod(
+        time.time_ns() if timestamp_ns is None else timestamp_ns, 1_000_000)
+    timestamp = milliseconds << 12 | nanoseconds * 4096 // 1_000_000
+
+    if timestamp_ns is None:
+        with timestamp_lock:
+            if timestamp <= last_timestamp:
+                timestamp = last_timestamp + 1
+            last_timestamp = timestamp
+
+    rand_b = int.from_bytes(os.urandom(8), "big") & ((1 << 62) - 1)
+
+    return uuid.UUID(int=(timestamp >> 12) << 80
+                     | 0x7 << 76
+                     | (timestamp & 0xFFF) << 64
+                     | 0b10 << 62
+                     | rand_b)
@@ -0,0 +1,274 @@
+import argparse
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from database import engine
+from ids import uuid7
+from models import ReceiptImports, Receipts, Users
+from money import compute_receipt
+from outbox import receipt_event
+from page_cache import page_cache
+from partitions import create_partition, month_start
+from routers.receipts import ReceiptRequest
+
+
+load_dotenv()
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 5000))
+# receipts.total and receipts.rest are NUMERIC(12, 2)
+MAX_AMOUNT = 10 ** 10
+
+RECEIPT_COLUMNS = ["id", "products", "payment", "total", "rest", "created_at",
+                   "owner_id"]
+EVENT_COLUMNS = ["event_type", "receipt_id", "owner_id", "payload"]
+
+
+class ReceiptImportError(Exception):
+    pass
+
+
+def read_records(path: str, input_format: str):
+    with open(path, newline="", encoding="utf-8") as input_file:
+        if input_format == "csv":
+            yield from csv.DictReader(input_file)
+        else:
+            for line in input_file:
+                if line.strip():
+                    yield line.rstrip("\r\n")
+
+
+def parse_record(record, input_format: str) -> dict:
+    if input_format != "csv":
+        return json.loads(record)
+
+    return {
+        "id": record.get("id"),
+        "created_at": record.get("created_at"),
+        "products": json.loads(record.get("products") or "null"),
+        "payment": {"type": record.get("payment_type"),
+                    "amount": float(record.get("payment_amount"))},
+    }
+
+
+def parse_created_at(value) -> datetime:
+    if not value:
+        raise ValueError("created_at is required")
+
+    created_at = datetime.fromisoformat(value)
+    # historical exports without an offset are taken as UTC
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    # partitions are per UTC month
+    return created_at.astimezone(timezone.utc)
+
+
+def receipt_from_record(record: dict, owner_id: int) -> dict:
+    # The same validation and totals as POST /receipt
+    receipt_request = ReceiptRequest.model_validate(
+        {"products": record.get("products"), "payment": record.get("payment")})
+    receipt = compute_receipt(receipt_request.model_dump())
+    # one value COPY can't store would fail the whole chunk
+    if not abs(receipt["total"]) < MAX_AMOUNT or \
+            not abs(receipt["rest"]) < MAX_AMOUNT:
+        raise ValueError("total or rest out of range")
+
+    created_at = parse_created_at(record.get("created_at"))
+    if record.get("id"):
+        receipt_id = uuid.UUID(str(record["id"]))
+    else:
+        receipt_id = uuid7(int(created_at.timestamp()) * 10 ** 9
+                           + created_at.microsecond * 1000)
+
+    receipt.update({"id": receipt_id, "created_at": created_at,
+                    "owner_id": owner_id})
+    return receipt
+
+
+def copy_rows(cursor, table: str, columns, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        buffer)
+
+
+def create_chunk_partitions(bind, receipts, months: set):
+    # Rows for a month without a partition would land in the default one.
+    # The partitions are created in a short transaction of their own, so
+    # the lock their DDL takes on receipts isn't held while a chunk is
+    # copied.
+    missing = {month_start(receipt["created_at"])
+               for receipt in receipts} - months
+    if not missing:
+        return
+
+    with bind.begin() as connection:
+        for month in sorted(missing):
+            create_partition(connection, month)
+    months.update(missing)
+
+
+def write_chunk(connection, receipts, with_events: bool):
+    cursor = connection.connection.cursor()
+    copy_rows(cursor, "receipts", RECEIPT_COLUMNS, (
+        [receipt["id"], json.dumps(receipt["products"]),
+         json.dumps(receipt["payment"]), receipt["total"], receipt["rest"],
+         receipt["created_at"].isoformat(), receipt["owner_id"]]
+        for receipt in receipts))
+
+    if with_events:
+        events = (receipt_event("created", receipt) for receipt in receipts)
+        copy_rows(cursor, "receipt_events", EVENT_COLUMNS, (
+            [event["event_type"], event["receipt_id"], event["owner_id"],
+             json.dumps(event["payload"])] for event in events))
+
+
+def import_name(path: str) -> str:
+    # Another file with the same name, or the same path after the file was
+    # replaced, must not resume at this file's position.
+    stat = os.stat(path)
+    identity = f"{os.path.realpath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    digest = hashlib.sha256(identity.encode()).hexdigest()[:16]
+    return f"{os.path.basename(path)[:200]}-{digest}"
+
+
+def existing_ids(connection, receipt_ids) -> set:
+    if not receipt_ids:
+        return set()
+    return set(connection.execute(select(Receipts.id).where(
+        Receipts.id.in_(receipt_ids))).scalars())
+
+
+def save_checkpoint(connection, name: str, owner_id: int, position: int,
+                    imported: int, rejected: int):
+    values = {"position": position, "imported": imported,
+              "rejected": rejected, "updated_at": datetime.utcnow()}
+    connection.execute(
+        insert(ReceiptImports).values(name=name, owner_id=owner_id, **values)
+        .on_conflict_do_update(index_elements=[ReceiptImports.name],
+                               set_=values))
+
+
+def import_receipts(path: str, owner_id: int, input_format: str = None,
+                    name: str = None, errors_path: str = None,
+                    chunk_size: int = IMPORT_CHUNK_SIZE,
+                    with_events: bool = True, bind=engine):
+    input_format = input_format or \
+        ("csv" if path.lower().endswith(".csv") else "ndjson")
+    name = name or import_name(path)
+    errors_path = errors_path or f"{path}.errors.ndjson"
+
+    with bind.connect() as connection:
+        if connection.execute(select(Users.id).where(
+                Users.id == owner_id)).first() is None:
+            raise ReceiptImportError(f"User {owner_id} not found")
+        checkpoint = connection.execute(select(ReceiptImports).where(
+            ReceiptImports.name == name)).first()
+
+    if checkpoint and checkpoint.owner_id != owner_id:
+        raise ReceiptImportError(
+            f"Import {name} belongs to user {checkpoint.owner_id}")
+
+    position = checkpoint.position if checkpoint else 0
+    imported = checkpoint.imported if checkpoint else 0
+    rejected = checkpoint.rejected if checkpoint else 0
+    months = set()
+
+    # Only one chunk is held in memory at a time, and records before the
+    # checkpoint are read past without being parsed.
+    records = itertools.islice(read_records(path, input_format),
+                               position, None)
+    with open(errors_path, "a" if checkpoint else "w",
+              encoding="utf-8") as errors_file:
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if not chunk:
+                break
+
+            parsed, errors = [], []
+            for row, record in enumerate(chunk, start=position + 1):
+                try:
+                    parsed.append((row, record, receipt_from_record(
+                        parse_record(record, input_format), owner_id)))
+                except (ValueError, TypeError, KeyError, AttributeError,
+                        ArithmeticError) as error:
+                    errors.append({"row": row, "error": str(error),
+                                   "record": record})
+
+            create_chunk_partitions(
+                bind, [receipt for _, _, receipt in parsed], months)
+
+            # The rows and the checkpoint are committed together, so a
+            # resumed import neither skips nor repeats a chunk.
+            with bind.begin() as connection:
+                # The primary key is (id, created_at), so an id already
+                # imported with another created_at wouldn't be caught by it.
+                seen = existing_ids(connection, [
+                    receipt["id"] for _, _, receipt in parsed])
+                receipts = []
+                for row, record, receipt in parsed:
+                    if receipt["id"] in seen:
+                        errors.append({
+                            "row": row,
+                            "error": f"Receipt {receipt['id']} already exists",
+                            "record": record})
+                    else:
+                        seen.add(receipt["id"])
+                        receipts.append(receipt)
+                errors.sort(key=lambda error: error["row"])
+
+                position += len(chunk)
+                imported += len(receipts)
+                rejected += len(errors)
+                if receipts:
+                    write_chunk(connection, receipts, with_events)
+                save_checkpoint(connection, name, owner_id, position,
+                                imported, rejected)
+
+            for error in errors:
+                errors_file.write(json.dumps(error, default=str) + "\n")
+            errors_file.flush()
+
+    page_cache.invalidate(owner_id)
+
+    return imported, rejected
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load historical receipts of a user from a CSV or "
+                    "NDJSON file with COPY")
+    parser.add_argument("path")
+    parser.add_argument("--owner-id", type=int, required=True)
+    parser.add_argument("--format", choices=["csv", "ndjson"])
+    parser.add_argument("--name",
+                        help="checkpoint name, defaults to the file name "
+                             "with a hash of its path, size and mtime")
+    parser.add_argument("--errors",
+                        help="rejected rows report, defaults to "
+                             "<path>.errors.ndjson")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument("--no-events", action="store_true",
+                        help="don't write receipt events for the outbox")
+    args = parser.parse_args()
+
+    imported, rejected = import_receipts(
+        args.path,
+        args.owner_id,
+        input_format=args.format,
+        name=args.name,
+        errors_path=args.errors,
+        chunk_size=args.chunk_size,
+        with_events=not args.no_events,
+    )
+    print(f"Imported {imported} receipts, rejected {rejected}")
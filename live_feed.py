@@ -0,0 +1,89 @@
+import asyncio
+import json
+import os
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+LIVE_FEED_QUEUE_SIZE = int(os.getenv("LIVE_FEED_QUEUE_SIZE", 100))
+LIVE_FEED_KEEPALIVE_SECONDS = float(
+    os.getenv("LIVE_FEED_KEEPALIVE_SECONDS", 15))
+LIVE_FEED_REPLAY_BATCH_SIZE = int(os.getenv("LIVE_FEED_REPLAY_BATCH_SIZE", 500))
+
+
+class ReceiptFeed:
+    def __init__(self, queue_size: int = LIVE_FEED_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers = {}
+
+    def subscribe(self, owner_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(self.queue_size)
+        self.subscribers.setdefault(owner_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, owner_id: int, queue: asyncio.Queue):
+        queues = self.subscribers.get(owner_id)
+        if queues is None:
+            return
+
+        queues.discard(queue)
+        if not queues:
+            del self.subscribers[owner_id]
+
+    def publish(self, owner_id: int, seq: int, data: dict):
+        for queue in list(self.subscribers.get(owner_id, ())):
+            try:
+                queue.put_nowait((seq, data))
+            except asyncio.QueueFull:
+                # A subscriber that can't keep up is disconnected instead of
+                # buffering without bound, it resumes from its last event id.
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+                self.unsubscribe(owner_id, queue)
+
+
+def format_event(seq: int, data: dict) -> str:
+    return f"id: {seq}\nevent: receipt\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_events(feed: ReceiptFeed, owner_id: int, last_seq: int = None,
+                        load_events=None,
+                        keepalive: float = LIVE_FEED_KEEPALIVE_SECONDS):
+    # Subscribing before the first read means nothing committed in between
+    # is lost. With load_events a published event only wakes the stream up
+    # and is read back in outbox order, so every id sent is a safe point to
+    # resume from. Events not readable yet are sent after a later wake up,
+    # at the latest with the next keepalive.
+    queue = feed.subscribe(owner_id)
+    try:
+        while True:
+            if last_seq is not None and load_events is not None:
+                events = await load_events(last_seq)
+                for seq, data in events:
+                    yield format_event(seq, data)
+                    last_seq = seq
+                if events:
+                    continue
+
+            try:
+                event = await asyncio.wait_for(queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+
+            if event is None:
+                return
+
+            if load_events is None:
+                seq, data = event
+                yield format_event(seq, data)
+                continue
+
+            # events published together are read with one query
+            while not queue.empty():
+                if queue.get_nowait() is None:
+                    return
+    finally:
+        feed.unsubscribe(owner_id, queue)
@@ -1,17 +1,62 @@
+import asyncio
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI, status
+from starlette.concurrency import run_in_threadpool
 
-from database import engine
+from bulk_render import shutdown_render_pool
+from compression import CompressionMiddleware
+from database import SessionLocal, engine
+from exports import maintain_exports, requeue_exports, shutdown_export_pool
 from models import Base
+from partitions import maintain_partitions
+from profiling import (
+    PROFILING_ENABLED,
+    ProfilingMiddleware,
+    profile_aggregate,
+)
+from rate_limit import RateLimitMiddleware, loop_lag
 from routers import admin, auth, receipts, users
 
 
 load_dotenv()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    partition_maintenance = asyncio.create_task(maintain_partitions())
+    loop_lag_monitoring = asyncio.create_task(loop_lag.run())
+    requeue_exports(SessionLocal)
+    export_expiry = asyncio.create_task(maintain_exports(SessionLocal))
+    user_deletions = asyncio.create_task(
+        run_in_threadpool(users.resume_user_deletions, SessionLocal))
+    delete_jobs = asyncio.create_task(
+        run_in_threadpool(admin.resume_delete_jobs, SessionLocal))
+    yield
+    partition_maintenance.cancel()
+    loop_lag_monitoring.cancel()
+    user_deletions.cancel()
+    delete_jobs.cancel()
+    export_expiry.cancel()
+    await receipts.receipt_buffer.close()
+    shutdown_render_pool()
+    shutdown_export_pool()
+    if PROFILING_ENABLED:
+        # samples added since the last periodic flush
+        profile_aggregate.flush()
+
+
+app = FastAPI(lifespan=lifespan)
 
 Base.metadata.create_all(bind=engine)
 
+app.add_middleware(CompressionMiddleware)
+# not installed at all unless enabled, so it costs nothing otherwise
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+# added last so it runs first and sheds load before any other work
+app.add_middleware(RateLimitMiddleware)
+
 
 @app.get("/healthy", status_code=status.HTTP_200_OK)
 def health_check():
@@ -0,0 +1,195 @@
+from sqlalchemy import text
+
+from database import engine
+from models import (
+    Base,
+    Receipts,
+)
+from partitions import PARTITIONED_TABLE, create_partition
+from search import create_search_index
+
+
+def table_kind(connection, table_name: str):
+    return connection.execute(text(
+        "SELECT relkind FROM pg_class "
+        "WHERE relname = :table_name AND relnamespace = 'public'::regnamespace"
+    ), {"table_name": table_name}).scalar()
+
+
+def column_type(connection, table_name: str, column_name: str):
+    return connection.execute(text(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_schema = 'public' AND table_name = :table_name "
+        "AND column_name = :column_name"
+    ), {"table_name": table_name, "column_name": column_name}).scalar()
+
+
+def partition_receipts(connection):
+    # "r" is a plain table, a partitioned table reports "p"
+    if table_kind(connection, PARTITIONED_TABLE) != "r":
+        return
+
+    legacy_table = f"{PARTITIONED_TABLE}_unpartitioned"
+    connection.execute(text(
+        f"ALTER TABLE {PARTITIONED_TABLE} RENAME TO {legacy_table}"))
+    connection.execute(text(
+        f"ALTER TABLE {legacy_table} "
+        f"RENAME CONSTRAINT {PARTITIONED_TABLE}_pkey TO {legacy_table}_pkey"))
+
+    Receipts.__table__.create(connection)
+
+    months = connection.execute(text(
+        "SELECT DISTINCT date_trunc('month', created_at)::date "
+        f"FROM {legacy_table} WHERE created_at IS NOT NULL"
+    )).scalars().all()
+    for month in months:
+        create_partition(connection, month)
+
+    connection.execute(text(
+        f"INSERT INTO {PARTITIONED_TABLE} "
+        "(id, products, payment, total, rest, created_at, owner_id) "
+        "SELECT id, products, payment, total, rest, "
+        "coalesce(created_at, now()), owner_id "
+        f"FROM {legacy_table}"
+    ))
+    connection.execute(text(f"DROP TABLE {legacy_table}"))
+
+
+def add_users_deleted_at(connection):
+    connection.execute(text(
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP"))
+
+
+def add_user_deletions_heartbeat(connection):
+    if table_kind(connection, "user_deletions") is not None:
+        connection.execute(text(
+            "ALTER TABLE user_deletions "
+            "ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP"))
+
+
+def add_export_jobs_heartbeat(connection):
+    if table_kind(connection, "export_jobs") is not None:
+        connection.execute(text(
+            "ALTER TABLE export_jobs "
+            "ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP"))
+
+
+def add_export_jobs_width(connection):
+    if table_kind(connection, "export_jobs") is not None:
+        connection.execute(text(
+            "ALTER TABLE export_jobs ADD COLUMN IF NOT EXISTS width INTEGER"))
+
+
+def use_numeric_receipt_amounts(connection):
+    for column in ("total", "rest"):
+        # altering the type rewrites the whole table, so it only runs once
+        if column_type(connection, PARTITIONED_TABLE, column) in \
+                (None, "numeric"):
+            continue
+        connection.execute(text(
+            f"ALTER TABLE {PARTITIONED_TABLE} ALTER COLUMN {column} "
+            f"TYPE NUMERIC(12, 2) USING round({column}::numeric, 2)"))
+
+
+def index_receipt_events_by_owner(connection):
+    if table_kind(connection, "receipt_events") is None:
+        return
+
+    connection.execute(text("DROP INDEX IF EXISTS ix_receipt_events_owner_id"))
+
+
+def order_receipt_events_by_transaction(connection):
+    if table_kind(connection, "receipt_events") is None:
+        return
+
+    # events no longer take their sequence numbers one transaction at a time
+    connection.execute(text(
+        "DROP TRIGGER IF EXISTS lock_event_sequence ON receipt_events"))
+    connection.execute(text(
+        "DROP FUNCTION IF EXISTS lock_receipt_event_sequence()"))
+
+    # Existing events all get the txid of this migration, so they keep
+    # their seq order and come before the events written after it.
+    connection.execute(text(
+        "ALTER TABLE receipt_events ADD COLUMN IF NOT EXISTS "
+        "txid BIGINT NOT NULL DEFAULT txid_current()"))
+    connection.execute(text(
+        "DROP INDEX IF EXISTS ix_receipt_events_owner_id_seq"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_receipt_events_txid_seq "
+        "ON receipt_events (txid, seq)"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_receipt_events_owner_id_txid_seq "
+        "ON receipt_events (owner_id, txid, seq)"))
+
+
+def add_receipt_search_index(connection):
+    if table_kind(connection, PARTITIONED_TABLE) is not None:
+        create_search_index(Receipts.__table__, connection)
+
+
+def index_receipts_by_owner_and_id(connection):
+    if table_kind(connection, PARTITIONED_TABLE) is not None:
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_receipts_owner_id_id "
+            f"ON {PARTITIONED_TABLE} (owner_id, id)"))
+
+
+def use_timestamptz_created_at(connection):
+    if column_type(connection, PARTITIONED_TABLE, "created_at") != \
+            "timestamp without time zone":
+        return
+
+    # The type of a partition key can't be altered, so the rows are copied
+    # aside and the table is created again with the timestamptz column.
+    # Stored values were written as UTC by the application.
+    copy_table = f"{PARTITIONED_TABLE}_naive_created_at"
+    connection.execute(text(
+        f"CREATE TEMPORARY TABLE {copy_table} ON COMMIT DROP AS "
+        f"SELECT * FROM {PARTITIONED_TABLE}"))
+    connection.execute(text(f"DROP TABLE {PARTITIONED_TABLE}"))
+
+    Receipts.__table__.create(connection)
+
+    months = connection.execute(text(
+        "SELECT DISTINCT date_trunc('month', created_at)::date "
+        f"FROM {copy_table}"
+    )).scalars().all()
+    for month in months:
+        create_partition(connection, month)
+
+    connection.execute(text(
+        f"INSERT INTO {PARTITIONED_TABLE} "
+        "(id, products, payment, total, rest, created_at, owner_id) "
+        "SELECT id, products, payment, total, rest, "
+        "created_at AT TIME ZONE 'UTC', owner_id "
+        f"FROM {copy_table}"
+    ))
+
+
+MIGRATIONS = [
+    partition_receipts,
+    add_users_deleted_at,
+    use_numeric_receipt_amounts,
+    index_receipt_events_by_owner,
+    add_receipt_search_index,
+    index_receipts_by_owner_and_id,
+    use_timestamptz_created_at,
+    order_receipt_events_by_transaction,
+    add_user_deletions_heartbeat,
+    add_export_jobs_heartbeat,
+    add_export_jobs_width,
+]
+
+
+def run_migrations(bind=engine):
+    # Every migration checks the current schema first, so running the
+    # whole list again is a no-op on an up to date database.
+    with bind.begin() as connection:
+        for migration in MIGRATIONS:
+            migration(connection)
+        Base.metadata.create_all(bind=connection)
+
+
+if __name__ == "__main__":
+    run_migrations()
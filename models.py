@@ -1,18 +1,24 @@
-import uuid
-from datetime import datetime
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     Column,
     DateTime,
     Integer,
-    FLOAT,
     ForeignKey,
+    Index,
     JSON,
+    Numeric,
     String,
     UUID,
+    event,
+    func,
+    text,
 )
 
 from database import Base
+from ids import uuid7
+from partitions import create_initial_partitions
+from search import create_search_index
 
 
 class Users(Base):
@@ -25,15 +31,120 @@ class Users(Base):
     last_name = Column(String(50))
     hashed_password = Column(String)
     is_admin = Column(Boolean)
+    deleted_at = Column(DateTime, nullable=True)
+
+
+class UserDeletions(Base):
+    __tablename__ = "user_deletions"
+
+    user_id = Column(Integer, primary_key=True)
+    status = Column(String(20))
+    receipts_deleted = Column(Integer, default=0)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+
+
+class DeleteJobs(Base):
+    __tablename__ = "delete_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
+    status = Column(String(20))
+    filters = Column(JSON)
+    receipts_deleted = Column(BigInteger, default=0)
+    created_by = Column(Integer)
+    created_at = Column(DateTime)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
 
 
 class Receipts(Base):
     __tablename__ = "receipts"
+    __table_args__ = (
+        Index("ix_receipts_owner_id_created_at", "owner_id", "created_at"),
+        Index("ix_receipts_owner_id_id", "owner_id", "id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     products = Column(JSON)
     payment = Column(JSON)
-    total = Column(FLOAT)
-    rest = Column(FLOAT)
-    created_at = Column(DateTime, default=datetime.utcnow())
+    total = Column(Numeric(12, 2))
+    rest = Column(Numeric(12, 2))
+    created_at = Column(DateTime(timezone=True), primary_key=True,
+                        server_default=func.now(), index=True)
     owner_id = Column(Integer, ForeignKey("users.id"))
+
+
+event.listen(Receipts.__table__, "after_create", create_initial_partitions)
+event.listen(Receipts.__table__, "after_create", create_search_index)
+
+
+class ArchivedReceipts(Base):
+    __tablename__ = "archived_receipts"
+
+    id = Column(UUID(as_uuid=True), primary_key=True)
+    owner_id = Column(Integer, index=True)
+    created_at = Column(DateTime)
+    path = Column(String)
+    line = Column(Integer)
+
+
+class ReceiptEvents(Base):
+    __tablename__ = "receipt_events"
+    __table_args__ = (
+        Index("ix_receipt_events_txid_seq", "txid", "seq"),
+        Index("ix_receipt_events_owner_id_txid_seq", "owner_id", "txid", "seq"),
+    )
+
+    seq = Column(BigInteger, primary_key=True)
+    # the transaction that wrote the event, consumers read in its order
+    txid = Column(BigInteger, nullable=False,
+                  server_default=text("txid_current()"))
+    event_type = Column(String(20))
+    receipt_id = Column(UUID(as_uuid=True))
+    owner_id = Column(Integer)
+    payload = Column(JSON)
+    created_at = Column(DateTime, server_default=func.now())
+
+
+
+class EventConsumers(Base):
+    __tablename__ = "event_consumers"
+
+    name = Column(String(100), primary_key=True)
+    last_seq = Column(BigInteger, default=0)
+    updated_at = Column(DateTime)
+
+
+class ReceiptImports(Base):
+    __tablename__ = "receipt_imports"
+
+    name = Column(String(255), primary_key=True)
+    owner_id = Column(Integer)
+    position = Column(BigInteger, default=0)
+    imported = Column(BigInteger, default=0)
+    rejected = Column(BigInteger, default=0)
+    updated_at = Column(DateTime)
+
+
+class ExportJobs(Base):
+    __tablename__ = "export_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
+    status = Column(String(20))
+    format = Column(String(10))
+    filters = Column(JSON)
+    # line width of the rendered formats
+    width = Column(Integer, nullable=True)
+    rows_total = Column(BigInteger, nullable=True)
+    rows_written = Column(BigInteger, default=0)
+    path = Column(String, nullable=True)
+    size = Column(BigInteger, nullable=True)
+    error = Column(String, nullable=True)
+    created_by = Column(Integer)
+    created_at = Column(DateTime)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
@@ -0,0 +1,47 @@
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Iterable, List, Tuple
+
+
+CENT = Decimal("0.01")
+
+
+def to_decimal(value) -> Decimal:
+    if isinstance(value, Decimal):
+        return value
+    # str() keeps the value the client sent, Decimal(float) would keep
+    # the binary approximation instead
+    return Decimal(str(value))
+
+
+def quantize(value: Decimal) -> Decimal:
+    return value.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def line_total(price, quantity) -> Decimal:
+    return quantize(to_decimal(price) * to_decimal(quantity))
+
+
+def line_totals(prices: Iterable, quantities: Iterable) -> List[Decimal]:
+    return [quantize(price * quantity) for price, quantity
+            in zip(map(to_decimal, prices), map(to_decimal, quantities))]
+
+
+def receipt_totals(products: List[dict],
+                   payment_amount) -> Tuple[List[Decimal], Decimal, Decimal]:
+    totals = line_totals([product["price"] for product in products],
+                         [product["quantity"] for product in products])
+    total = sum(totals, Decimal("0.00"))
+    rest = quantize(to_decimal(payment_amount) - total)
+    return totals, total, rest
+
+
+def compute_receipt(receipt: dict) -> dict:
+    totals, total, rest = receipt_totals(receipt["products"],
+                                         receipt["payment"]["amount"])
+
+    # products are stored as JSON, so line totals are kept as floats there
+    for product, product_total in zip(receipt["products"], totals):
+        product.update({"total": float(product_total)})
+
+    receipt.update({"total": total, "rest": rest})
+    return receipt
@@ -0,0 +1,72 @@
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, func, insert, literal, or_, select, tuple_
+
+from models import ReceiptEvents, Receipts
+
+
+def receipt_event(event_type: str, receipt: dict) -> dict:
+    return {
+        "event_type": event_type,
+        "receipt_id": receipt["id"],
+        "owner_id": receipt["owner_id"],
+        "payload": jsonable_encoder(receipt),
+    }
+
+
+def delete_receipts_statement(*criteria):
+    # Deleting the receipts and recording their "deleted" events is one
+    # statement, so both are always part of the same transaction.
+    deleted_receipts = delete(Receipts).where(*criteria)\
+        .returning(Receipts.id, Receipts.owner_id).cte("deleted_receipts")
+
+    return insert(ReceiptEvents).from_select(
+        ["event_type", "receipt_id", "owner_id", "payload"],
+        select(literal("deleted"),
+               deleted_receipts.c.id,
+               deleted_receipts.c.owner_id,
+               func.json_build_object("id", deleted_receipts.c.id)),
+    )
+
+
+def delete_receipts_batch(db, *criteria, batch_size: int) -> int:
+    batch_ids = select(Receipts.id).where(*criteria).limit(batch_size)
+    result = db.execute(delete_receipts_statement(Receipts.id.in_(batch_ids)))
+    return result.rowcount
+
+
+def readable_events(owner_id: int = None, event_type: str = None):
+    # Writers take sequence numbers concurrently, so an event can commit
+    # after one with a larger seq. Events are read by the transaction that
+    # wrote them instead, and only those of transactions older than every
+    # one still running: a transaction committing later has a larger txid
+    # and comes after them, so a consumer never skips its events.
+    criteria = [or_(
+        ReceiptEvents.txid < func.txid_snapshot_xmin(
+            func.txid_current_snapshot()),
+        ReceiptEvents.txid == func.txid_current_if_assigned(),
+    )]
+    if owner_id is not None:
+        criteria.append(ReceiptEvents.owner_id == owner_id)
+    if event_type is not None:
+        criteria.append(ReceiptEvents.event_type == event_type)
+    return criteria
+
+
+def read_events(db, after: int, limit: int, owner_id: int = None,
+                event_type: str = None):
+    # an offset is the seq of the last event read, 0 reads from the start
+    after_txid = select(ReceiptEvents.txid)\
+        .where(ReceiptEvents.seq == after).correlate(None).scalar_subquery()
+    return db.query(ReceiptEvents)\
+        .filter(*readable_events(owner_id, event_type))\
+        .filter(tuple_(ReceiptEvents.txid, ReceiptEvents.seq) >
+                tuple_(func.coalesce(after_txid, 0), after))\
+        .order_by(ReceiptEvents.txid, ReceiptEvents.seq).limit(limit).all()
+
+
+def last_event_seq(db, owner_id: int = None, event_type: str = None) -> int:
+    last_seq = db.query(ReceiptEvents.seq)\
+        .filter(*readable_events(owner_id, event_type))\
+        .order_by(ReceiptEvents.txid.desc(), ReceiptEvents.seq.desc())\
+        .limit(1).scalar()
+    return last_seq or 0
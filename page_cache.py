@@ -0,0 +1,185 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from dotenv import load_dotenv
+
+from database import READ_YOUR_WRITES_SECONDS
+
+
+load_dotenv()
+
+PAGE_CACHE_ENABLED = os.getenv("PAGE_CACHE_ENABLED", "true").lower() == "true"
+PAGE_CACHE_BACKEND = os.getenv("PAGE_CACHE_BACKEND", "memory")
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", 64 * 2 ** 20))
+PAGE_CACHE_TTL_SECONDS = int(os.getenv("PAGE_CACHE_TTL_SECONDS", 300))
+PAGE_CACHE_PATH = os.getenv("PAGE_CACHE_PATH", "page_cache.sqlite3")
+
+ALL_OWNERS = "*"
+
+
+class MemoryCacheBackend:
+    # Entries and generations live in one process, so with several workers
+    # the others keep serving pages a write replaced until they expire.
+
+    def __init__(self, max_bytes: int = PAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        # counters are never evicted, a reset one could revive stale entries
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                self.remove(key)
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: int):
+        if len(value) > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.size += len(value)
+
+            # least recently used entries go first
+            while self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, key: str):
+        value, _ = self.entries.pop(key)
+        self.size -= len(value)
+
+    def counter(self, name: str) -> int:
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    def incr(self, name: str):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+
+class SqliteCacheBackend:
+    # A local stand-in for a shared cache such as Redis: every process
+    # using the same file sees the same entries and counters.
+
+    def __init__(self, path: str = PAGE_CACHE_PATH,
+                 max_bytes: int = PAGE_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.created = False
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=5,
+                                     isolation_level=None)
+        if not self.created:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, "
+                "value TEXT, expires_at REAL, used_at REAL)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, "
+                "value INTEGER)")
+            self.created = True
+        return connection
+
+    def get(self, key: str):
+        now = time.time()
+        with closing(self.connect()) as connection:
+            row = connection.execute(
+                "SELECT value FROM entries WHERE key = ? AND expires_at > ?",
+                (key, now)).fetchone()
+            if row is None:
+                return None
+
+            connection.execute("UPDATE entries SET used_at = ? WHERE key = ?",
+                               (now, key))
+            return row[0]
+
+    def set(self, key: str, value: str, ttl: int):
+        if len(value) > self.max_bytes:
+            return
+
+        now = time.time()
+        with closing(self.connect()) as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now))
+            # drop expired entries, then the least recently used ones
+            # until the rest fits into max_bytes
+            connection.execute("DELETE FROM entries WHERE expires_at <= ?",
+                               (now,))
+            connection.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM ("
+                "SELECT key, SUM(length(value)) OVER (ORDER BY used_at DESC)"
+                " AS kept FROM entries) WHERE kept > ?)", (self.max_bytes,))
+
+    def counter(self, name: str) -> int:
+        with closing(self.connect()) as connection:
+            row = connection.execute(
+                "SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+            return row[0] if row else 0
+
+    def incr(self, name: str):
+        with closing(self.connect()) as connection:
+            connection.execute(
+                "INSERT INTO counters VALUES (?, 1) ON CONFLICT(name) "
+                "DO UPDATE SET value = value + 1", (name,))
+
+
+CACHE_BACKENDS = {
+    "memory": MemoryCacheBackend,
+    "sqlite": SqliteCacheBackend,
+}
+
+
+class PageCache:
+    def __init__(self, backend, ttl: int = PAGE_CACHE_TTL_SECONDS,
+                 write_window: float = READ_YOUR_WRITES_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self.write_window = write_window
+
+    def key(self, owner_id, params) -> str:
+        # Keys carry the generations of the owner and of all owners, so a
+        # write makes the old entries unreachable without looking for them.
+        generations = [self.backend.counter(f"generation:{ALL_OWNERS}"),
+                       self.backend.counter(f"generation:{owner_id}")]
+        return json.dumps([owner_id, generations, params], default=str)
+
+    def get(self, key: str):
+        return self.backend.get(key)
+
+    def set(self, key: str, value: str):
+        self.backend.set(key, value, self.ttl)
+
+    def invalidate(self, owner_id):
+        self.backend.incr(f"generation:{owner_id}")
+        self.backend.set(f"written:{owner_id}", "1", self.write_window)
+
+    def invalidate_all(self):
+        self.backend.incr(f"generation:{ALL_OWNERS}")
+        self.backend.set(f"written:{ALL_OWNERS}", "1", self.write_window)
+
+    def recently_written(self, owner_id) -> bool:
+        # Replicas may not have replayed a write this recent yet
+        return any(self.backend.get(f"written:{name}") is not None
+                   for name in (ALL_OWNERS, owner_id))
+
+
+page_cache = PageCache(CACHE_BACKENDS[PAGE_CACHE_BACKEND]())
@@ -1,11 +1,27 @@
+import json
 import math
+import os
 from typing import Generic, List, TypeVar
+from dotenv import load_dotenv
+from fastapi import Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
 
+load_dotenv()
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", 50))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 500))
+STREAM_OVERSIZED_PAGES = os.getenv(
+    "STREAM_OVERSIZED_PAGES", "false").lower() == "true"
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 100))
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
 class PageParams(BaseModel):
     page: int = Field(default=1, ge=1)
-    size: int = Field(default=50, ge=1)
+    size: int = Field(default=DEFAULT_PAGE_SIZE, ge=1)
+    max_size: int = Field(default=MAX_PAGE_SIZE, ge=1)
 
 
 T = TypeVar("T")
@@ -19,15 +35,93 @@ class PagedResponseSchema(BaseModel, Generic[T]):
     results: List[T]
 
 
-def paginate(page_params: PageParams, query, ResponseSchema: BaseModel):
+class PagedStreamingResponse(StreamingResponse):
+    def __init__(self, total_results: int, page: int, pages: int, size: int,
+                 results, ResponseSchema: BaseModel):
+        self.total_results = total_results
+        self.page = page
+        self.pages = pages
+        self.size = size
+        self.results = results
+        self.chunks = self.serialize(ResponseSchema)
+        super().__init__(self.chunks, media_type="application/json")
+
+    def serialize(self, ResponseSchema: BaseModel):
+        header = json.dumps({
+            "total_results": self.total_results,
+            "page": self.page,
+            "pages": self.pages,
+            "size": self.size,
+        }, separators=(",", ":"))
+        yield header[:-1] + ',"results":['
+
+        chunk = []
+        chunk_size = 0
+        first = True
+        for item in self.results:
+            row = ResponseSchema.model_validate(item).model_dump_json()
+            chunk.append(row if first else "," + row)
+            chunk_size += len(row) + 1
+            first = False
+            # chunks are cut by size, so how many rows they hold doesn't
+            # depend on how large the rows are
+            if chunk_size >= STREAM_CHUNK_SIZE:
+                yield "".join(chunk)
+                chunk = []
+                chunk_size = 0
+
+        chunk.append("]}")
+        yield "".join(chunk)
+
+
+def get_page_params(default_size: int = DEFAULT_PAGE_SIZE,
+                    max_size: int = MAX_PAGE_SIZE):
+    # With streaming enabled oversized pages are served as a stream
+    # instead of being rejected by validation.
+    size_limit = None if STREAM_OVERSIZED_PAGES else max_size
+
+    def page_params_dependency(page: int = Query(default=1, ge=1),
+                               size: int = Query(default=default_size, ge=1,
+                                                 le=size_limit)):
+        return PageParams(page=page, size=size, max_size=max_size)
+
+    return page_params_dependency
+
+
+def stream_rows(query, offset: int, limit: int):
+    try:
+        yield from query.offset(offset).limit(limit)\
+            .yield_per(STREAM_BATCH_SIZE)
+    finally:
+        query.session.close()
+
+
+def paginate(page_params: PageParams, query, ResponseSchema: BaseModel,
+             stream: bool = False):
+    total_results = query.count()
+    pages = math.ceil(total_results / page_params.size)
+    offset = (page_params.page - 1) * page_params.size
+
+    # A streamed page is serialized row by row as it is read from the cursor,
+    # so it never holds more than STREAM_BATCH_SIZE rows, where a built page
+    # holds the rows, their models and the JSON document all at once.
+    if (stream or page_params.size > page_params.max_size) and \
+            offset < total_results:
+        return PagedStreamingResponse(
+            total_results=total_results,
+            page=page_params.page,
+            pages=pages,
+            size=page_params.size,
+            results=stream_rows(query, offset, page_params.size),
+            ResponseSchema=ResponseSchema,
+        )
 
-    paginated_query = query.offset(
-        (page_params.page - 1) * page_params.size).limit(page_params.size).all()
+    paginated_query = query.offset(offset).limit(page_params.size).all()
 
     return PagedResponseSchema(
-        total_results=query.count(),
+        total_results=total_results,
         page=page_params.page,
-        pages=math.ceil(query.count() / page_params.size),
+        pages=pages,
         size=page_params.size,
         results=[ResponseSchema.model_validate(
             item) for item in paginated_query],
@@ -0,0 +1,172 @@
+import argparse
+import asyncio
+import logging
+import os
+from datetime import date, datetime
+from dotenv import load_dotenv
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+from database import engine
+
+
+load_dotenv()
+
+PARTITIONED_TABLE = "receipts"
+DEFAULT_PARTITION = f"{PARTITIONED_TABLE}_default"
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", 3))
+PARTITION_MAINTENANCE_INTERVAL = int(
+    os.getenv("PARTITION_MAINTENANCE_INTERVAL", 24 * 60 * 60))
+
+logger = logging.getLogger(__name__)
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    month_index = value.year * 12 + value.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARTITIONED_TABLE}_{month:%Y_%m}"
+
+
+def partition_month(name: str):
+    try:
+        return datetime.strptime(
+            name[len(PARTITIONED_TABLE) + 1:], "%Y_%m").date()
+    except ValueError:
+        return None
+
+
+def list_partitions(connection):
+    return connection.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :table ORDER BY child.relname"
+    ), {"table": PARTITIONED_TABLE}).scalars().all()
+
+
+def create_default_partition(connection):
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} "
+        f"PARTITION OF {PARTITIONED_TABLE} DEFAULT"
+    ))
+
+
+def create_partition(connection, month: date):
+    start = month_start(month)
+    end = add_months(start, 1)
+    name = partition_name(start)
+
+    if name in list_partitions(connection):
+        return name
+
+    bounds = {"start": start, "end": end}
+    rows_in_default = connection.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} "
+        "WHERE created_at >= :start AND created_at < :end)"
+    ), bounds).scalar()
+
+    if not rows_in_default:
+        connection.execute(text(
+            f"CREATE TABLE {name} PARTITION OF {PARTITIONED_TABLE} "
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+        ))
+        return name
+
+    # Rows for this month already landed in the default partition, so they
+    # are moved into a standalone table which is attached afterwards.
+    connection.execute(text(
+        f"CREATE TABLE {name} (LIKE {PARTITIONED_TABLE} "
+        "INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    ))
+    connection.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+        "WHERE created_at >= :start AND created_at < :end RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ), bounds)
+    connection.execute(text(
+        f"ALTER TABLE {PARTITIONED_TABLE} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start}') TO ('{end}')"
+    ))
+    return name
+
+
+def ensure_partitions(connection, months_ahead: int = PARTITION_MONTHS_AHEAD,
+                      today: date = None):
+    current_month = month_start(today or date.today())
+    create_default_partition(connection)
+    return [create_partition(connection, add_months(current_month, offset))
+            for offset in range(months_ahead + 1)]
+
+
+def create_initial_partitions(target, connection, **kw):
+    if connection.dialect.name == "postgresql":
+        ensure_partitions(connection)
+
+
+def detach_partition(connection, month: date, drop: bool = False):
+    name = partition_name(month_start(month))
+    connection.execute(text(
+        f"ALTER TABLE {PARTITIONED_TABLE} DETACH PARTITION {name}"))
+    if drop:
+        connection.execute(text(f"DROP TABLE {name}"))
+    return name
+
+
+def detach_partitions_before(connection, cutoff: date, drop: bool = False):
+    months = [partition_month(name) for name in list_partitions(connection)]
+    return [detach_partition(connection, month, drop) for month in months
+            if month is not None and month < month_start(cutoff)]
+
+
+def run_partition_maintenance():
+    with engine.begin() as connection:
+        ensure_partitions(connection)
+
+
+async def maintain_partitions(interval: int = PARTITION_MAINTENANCE_INTERVAL):
+    while True:
+        # A failed run, e.g. while the database is unreachable, is retried
+        # on the next one instead of ending the maintenance for good.
+        try:
+            await run_in_threadpool(run_partition_maintenance)
+        except Exception:
+            logger.exception("Partition maintenance failed")
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Manage monthly partitions of the receipts table")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ensure_parser = subparsers.add_parser(
+        "ensure", help="create partitions for the coming months")
+    ensure_parser.add_argument("--months-ahead", type=int,
+                               default=PARTITION_MONTHS_AHEAD)
+
+    detach_parser = subparsers.add_parser(
+        "detach", help="detach partitions older than a month")
+    detach_parser.add_argument("--before", required=True,
+                               type=date.fromisoformat,
+                               help="first month to keep, e.g. 2024-01-01")
+    detach_parser.add_argument("--drop", action="store_true",
+                               help="drop the detached tables")
+
+    args = parser.parse_args()
+
+    with engine.begin() as connection:
+        if args.command == "ensure":
+            names = ensure_partitions(connection, args.months_ahead)
+        else:
+            names = detach_partitions_before(connection, args.before,
+                                             args.drop)
+
+    for name in names:
+        print(name)
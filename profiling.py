@@ -0,0 +1,224 @@
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from dotenv import load_dotenv
+from starlette.datastructures import Headers, QueryParams
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from rate_limit import token_claims
+from routers.auth import ALGORITHM, SECRET_KEY
+
+
+load_dotenv()
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_FLUSH_SECONDS = int(os.getenv("PROFILE_FLUSH_SECONDS", 60))
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_MODES = ("return", "store")
+AGGREGATE_FILE = "aggregate.folded"
+
+current_profile = ContextVar("current_profile", default=None)
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_qualname}"
+
+
+def folded_stack(frame, marker) -> str:
+    # Frames from the marker of the request up to the running one, in the
+    # root first order of the folded stack format of flamegraph tools.
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        if frame is marker:
+            return ";".join(reversed(labels))
+        frame = frame.f_back
+    # the thread is busy with something other than the request
+    return None
+
+
+class RequestProfile:
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self.samples = 0
+        # thread id -> the frame the request's work starts from there
+        self.threads = {}
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.run, daemon=True,
+                                        name="profile-sampler")
+
+    def start(self):
+        self.sampler.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.sampler.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        frames = sys._current_frames()
+        self.samples += 1
+        for thread_id, marker in list(self.threads.items()):
+            frame = frames.get(thread_id)
+            stack = folded_stack(frame, marker) if frame else None
+            if stack:
+                self.stacks[stack] += 1
+
+    def folded(self, root: str) -> str:
+        return "".join(f"{root};{stack} {count}\n"
+                       for stack, count in self.stacks.most_common())
+
+
+def profiled(func):
+    # Work handed to the threadpool by a profiled request is sampled on the
+    # worker thread too. Without a profile the function is left as it is.
+    profile = current_profile.get()
+    if profile is None:
+        return func
+
+    def run_profiled(*args, **kwargs):
+        thread_id = threading.get_ident()
+        profile.threads[thread_id] = sys._getframe()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.threads.pop(thread_id, None)
+
+    return run_profiled
+
+
+class ProfileAggregate:
+    def __init__(self, profile_dir: str = PROFILE_DIR,
+                 flush_seconds: int = PROFILE_FLUSH_SECONDS):
+        self.path = os.path.join(profile_dir, AGGREGATE_FILE)
+        self.flush_seconds = flush_seconds
+        self.stacks = Counter()
+        self.flushed_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, profile: RequestProfile, root: str):
+        with self.lock:
+            self.stacks.update({f"{root};{stack}": count
+                                for stack, count in profile.stacks.items()})
+            if time.monotonic() - self.flushed_at >= self.flush_seconds:
+                self.flush()
+
+    def flush(self):
+        self.flushed_at = time.monotonic()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        partial_path = f"{self.path}.part"
+        with open(partial_path, "w", encoding="utf-8") as profile_file:
+            profile_file.writelines(f"{stack} {count}\n" for stack, count
+                                    in self.stacks.most_common())
+        os.replace(partial_path, self.path)
+
+
+# shared by the middleware and the lifespan, which flushes it on shutdown
+profile_aggregate = ProfileAggregate()
+
+
+class ProfilingMiddleware:
+    def __init__(self, app: ASGIApp,
+                 interval_ms: float = PROFILE_INTERVAL_MS,
+                 sample_rate: float = PROFILE_SAMPLE_RATE,
+                 profile_dir: str = PROFILE_DIR,
+                 aggregate: ProfileAggregate = profile_aggregate,
+                 secret_key: str = SECRET_KEY,
+                 algorithm: str = ALGORITHM):
+        self.app = app
+        self.interval_ms = interval_ms
+        self.sample_rate = sample_rate
+        self.profile_dir = profile_dir
+        self.aggregate = aggregate
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+
+    def requested_mode(self, scope: Scope):
+        headers = Headers(scope=scope)
+        mode = headers.get(PROFILE_HEADER) or \
+            QueryParams(scope.get("query_string", b"")).get("profile")
+        if mode not in PROFILE_MODES:
+            return None
+
+        claims = token_claims(headers, self.secret_key, self.algorithm)
+        return mode if claims.get("is_admin") == True else None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        mode = self.requested_mode(scope)
+        if mode is None and self.sample_rate and \
+                random.random() < self.sample_rate:
+            mode = "aggregate"
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(self.interval_ms)
+        path = os.path.join(self.profile_dir, f"{uuid.uuid4()}.folded")
+        response_start = {}
+
+        async def send_with_profile(message: Message):
+            if mode == "return":
+                # the response is replaced with the profile
+                if message["type"] == "http.response.start":
+                    response_start.update(message)
+                return
+            if mode == "store" and message["type"] == "http.response.start":
+                message["headers"] = list(message["headers"]) + [
+                    (b"x-profile-path", path.encode())]
+            await send(message)
+
+        # While it runs on the event loop, the request is the part of the
+        # loop thread's stack above this frame.
+        profile.threads[threading.get_ident()] = sys._getframe()
+        context_token = current_profile.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            profile.stop()
+            current_profile.reset(context_token)
+
+        # Stacks start from the endpoint the router matched, so samples of
+        # e.g. /receipt/{receipt_id} add up whatever the id.
+        endpoint = scope.get("endpoint")
+        root = f"{scope['method']} " \
+            f"{endpoint.__name__ if endpoint else scope['path']}"
+
+        if mode == "aggregate":
+            self.aggregate.add(profile, root)
+        elif mode == "store":
+            os.makedirs(self.profile_dir, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as profile_file:
+                profile_file.write(profile.folded(root))
+        else:
+            body = profile.folded(root).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/plain; charset=utf-8"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"x-profile-samples", str(profile.samples).encode()),
+                    (b"x-profiled-status",
+                     str(response_start.get("status", "")).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,169 @@
+import asyncio
+import math
+import os
+import time
+from dotenv import load_dotenv
+from jose import jwt, JWTError
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from routers.auth import ALGORITHM, SECRET_KEY
+
+
+load_dotenv()
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", 10))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", 50))
+AUTH_RATE_LIMIT_PER_SECOND = float(os.getenv("AUTH_RATE_LIMIT_PER_SECOND",
+                                             0.2))
+AUTH_RATE_LIMIT_BURST = int(os.getenv("AUTH_RATE_LIMIT_BURST", 10))
+LOAD_SHED_MAX_IN_FLIGHT = int(os.getenv("LOAD_SHED_MAX_IN_FLIGHT", 100))
+LOAD_SHED_MAX_LOOP_LAG_MS = int(os.getenv("LOAD_SHED_MAX_LOOP_LAG_MS", 250))
+LOAD_SHED_RETRY_AFTER_SECONDS = int(os.getenv("LOAD_SHED_RETRY_AFTER_SECONDS",
+                                              1))
+LOOP_LAG_INTERVAL_MS = int(os.getenv("LOOP_LAG_INTERVAL_MS", 100))
+
+# paths limited by client address, their callers have no token yet
+IP_LIMITED_PATHS = ("/auth/token",)
+UNLIMITED_PATHS = ("/healthy",)
+
+
+class TokenBuckets:
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = {}
+
+    def take(self, key, now: float = None) -> float:
+        # Returns 0 when a token was taken, otherwise the seconds until the
+        # next token is available.
+        now = time.monotonic() if now is None else now
+        tokens, updated_at = self.buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+
+        if tokens < 1:
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+
+        self.buckets[key] = (tokens - 1, now)
+        if len(self.buckets) > self.max_keys:
+            self.prune(now)
+        return 0
+
+    def prune(self, now: float):
+        # a bucket that has refilled is the same as no bucket at all
+        refill_time = self.burst / self.rate
+        for key, (_, updated_at) in list(self.buckets.items()):
+            if now - updated_at >= refill_time:
+                del self.buckets[key]
+
+
+class LoopLagMonitor:
+    def __init__(self, interval_ms: int = LOOP_LAG_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.lag = 0.0
+
+    async def run(self):
+        # A sleep that returns late means the loop was busy with other work
+        # for that long, which every queued request has to wait for too.
+        loop = asyncio.get_running_loop()
+        while True:
+            started_at = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - started_at - self.interval)
+
+
+loop_lag = LoopLagMonitor()
+
+
+def token_claims(headers: Headers, secret_key: str = SECRET_KEY,
+                 algorithm: str = ALGORITHM) -> dict:
+    scheme, _, token = headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return {}
+    try:
+        return jwt.decode(token, secret_key, algorithms=[algorithm])
+    except JWTError:
+        return {}
+
+
+class RateLimitMiddleware:
+    def __init__(self, app: ASGIApp,
+                 rate: float = RATE_LIMIT_PER_SECOND,
+                 burst: int = RATE_LIMIT_BURST,
+                 auth_rate: float = AUTH_RATE_LIMIT_PER_SECOND,
+                 auth_burst: int = AUTH_RATE_LIMIT_BURST,
+                 max_in_flight: int = LOAD_SHED_MAX_IN_FLIGHT,
+                 max_loop_lag_ms: int = LOAD_SHED_MAX_LOOP_LAG_MS,
+                 lag_monitor: LoopLagMonitor = loop_lag,
+                 secret_key: str = SECRET_KEY,
+                 algorithm: str = ALGORITHM,
+                 enabled: bool = RATE_LIMIT_ENABLED):
+        self.app = app
+        self.user_buckets = TokenBuckets(rate, burst)
+        self.ip_buckets = TokenBuckets(auth_rate, auth_burst)
+        self.max_in_flight = max_in_flight
+        self.max_loop_lag = max_loop_lag_ms / 1000
+        self.lag_monitor = lag_monitor
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+        self.enabled = enabled
+        self.in_flight = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self.enabled or \
+                scope["path"] in UNLIMITED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        # Shedding comes first, so an overloaded server rejects requests
+        # before spending any more work on them.
+        if self.in_flight >= self.max_in_flight or \
+                self.lag_monitor.lag > self.max_loop_lag:
+            response = JSONResponse(
+                {"detail": "Service overloaded"}, status_code=503,
+                headers={"Retry-After": str(LOAD_SHED_RETRY_AFTER_SECONDS)})
+            await response(scope, receive, send)
+            return
+
+        retry_after = self.take_token(scope)
+        if retry_after:
+            response = JSONResponse(
+                {"detail": "Too many requests"}, status_code=429,
+                headers={"Retry-After": str(math.ceil(retry_after))})
+            await response(scope, receive, send)
+            return
+
+        # A request counts as in flight until its response starts, so
+        # long-lived streams don't hold on to the limit.
+        self.in_flight += 1
+        started = False
+
+        async def send_and_count(message: Message):
+            nonlocal started
+            if message["type"] == "http.response.start" and not started:
+                started = True
+                self.in_flight -= 1
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_count)
+        finally:
+            if not started:
+                self.in_flight -= 1
+
+    def take_token(self, scope: Scope) -> float:
+        if scope["path"] in IP_LIMITED_PATHS:
+            client = scope.get("client")
+            return self.ip_buckets.take(client[0] if client else None)
+
+        # Requests without a valid token are rejected by the endpoints
+        # before doing any real work, so they only count towards shedding.
+        user_id = token_claims(Headers(scope=scope), self.secret_key,
+                               self.algorithm).get("id")
+        if user_id is None:
+            return 0
+        return self.user_buckets.take(user_id)
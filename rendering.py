@@ -0,0 +1,205 @@
+import html
+import os
+from functools import lru_cache
+from dotenv import load_dotenv
+
+from money import line_total
+
+
+load_dotenv()
+
+ESCPOS_ENCODING = os.getenv("ESCPOS_ENCODING", "cp1125")
+ESCPOS_CODE_PAGE = int(os.getenv("ESCPOS_CODE_PAGE", 44))
+RENDER_LAYOUT_CACHE_SIZE = int(os.getenv("RENDER_LAYOUT_CACHE_SIZE", 128))
+
+FORMATS = ("text", "escpos", "html")
+MEDIA_TYPES = {
+    "text": "text/plain",
+    "escpos": "application/octet-stream",
+    "html": "text/html",
+}
+# put between receipts rendered one after another
+RECEIPT_SEPARATORS = {
+    "text": "\n",
+    "escpos": b"",
+    "html": "",
+}
+
+DATE_FORMAT = "%d.%m.%Y %H:%M:%S"
+TOTAL_LABEL = "СУМА"
+REST_LABEL = "Решта"
+THANKS = "Дякуємо за покупку!"
+
+ESC = b"\x1b"
+GS = b"\x1d"
+
+
+def issuer_name(first_name: str, last_name: str) -> str:
+    return f"ФОП {first_name.upper()} {last_name.upper()}"
+
+
+def receipt_to_render_dict(receipt, owner) -> dict:
+    return {
+        "issuer": issuer_name(owner.first_name, owner.last_name),
+        "products": receipt.products,
+        "payment": receipt.payment,
+        "total": receipt.total,
+        "rest": receipt.rest,
+        "created_at": receipt.created_at,
+    }
+
+
+def payment_label(payment: dict) -> str:
+    return "Картка" if payment["type"] == "cashless" else "Готівка"
+
+
+def wrap_words(words, limit: int):
+    lines = []
+    start = 0
+    while True:
+        end, length = start, 0
+        while end < len(words) and length + len(words[end]) + 1 < limit:
+            length += len(words[end]) + 1
+            end += 1
+
+        if end == len(words):
+            # nothing is left after a word that had a line of its own
+            if end > start:
+                lines.append(" ".join(words[start:end]))
+            return lines
+
+        # A word longer than the line gets a line of its own
+        end = max(end, start + 1)
+        lines.append(" ".join(words[start:end]))
+        start = end
+
+
+class TextLayout:
+    def __init__(self, width: int):
+        self.width = width
+        self.double_rule = "=" * width
+        self.rule = "-" * width
+        self.thanks = THANKS.center(width)
+
+    def line(self, label: str, value: str) -> str:
+        return f"{label: <{self.width - len(value)}}{value}"
+
+    def product_lines(self, product: dict):
+        total = f"{line_total(product['price'], product['quantity']):.2f}"
+        lines = [f"{product['quantity']:.2f} x {product['price']:.2f}"]
+
+        name = product["name"]
+        if len(name) < self.width - len(total):
+            lines.append(self.line(name, total))
+        else:
+            *name_lines, last_line = wrap_words(
+                name.split(" "), self.width - len(total) - 5)
+            lines.extend(name_lines)
+            if len(last_line) < self.width - len(total):
+                lines.append(self.line(last_line, total))
+            else:
+                # a word longer than the line leaves no room for the total
+                lines.extend([last_line, self.line("", total)])
+
+        lines.append(self.rule)
+        return lines
+
+    def lines(self, receipt: dict):
+        lines = ["", receipt["issuer"].center(self.width), self.double_rule]
+        for product in receipt["products"]:
+            lines.extend(self.product_lines(product))
+        lines.extend([
+            self.double_rule,
+            self.line(TOTAL_LABEL, f"{receipt['total']:.2f}"),
+            self.line(payment_label(receipt["payment"]),
+                      f"{receipt['payment']['amount']:.2f}"),
+            self.line(REST_LABEL, f"{receipt['rest']:.2f}"),
+            self.double_rule,
+            receipt["created_at"].strftime(DATE_FORMAT).center(self.width),
+            self.thanks,
+        ])
+        return lines
+
+    def render(self, receipt: dict) -> str:
+        return "\n".join(self.lines(receipt)) + "\n"
+
+
+class EscPosLayout:
+    def __init__(self, width: int):
+        self.text = TextLayout(width)
+        # initialize the printer and select the code page of ESCPOS_ENCODING
+        self.start = ESC + b"@" + ESC + b"t" + bytes([ESCPOS_CODE_PAGE])
+        self.bold_on = ESC + b"E\x01"
+        self.bold_off = ESC + b"E\x00"
+        # feed a few lines and make a partial cut
+        self.end = ESC + b"d\x04" + GS + b"V\x42\x00"
+
+    def render(self, receipt: dict) -> bytes:
+        empty, issuer, *lines = self.text.lines(receipt)
+        # the charmap codec is slow per call, so the body is encoded at once
+        return b"".join([
+            self.start,
+            empty.encode(ESCPOS_ENCODING), b"\n",
+            self.bold_on, issuer.encode(ESCPOS_ENCODING, errors="replace"),
+            self.bold_off, b"\n",
+            "\n".join(lines).encode(ESCPOS_ENCODING, errors="replace"), b"\n",
+            self.end,
+        ])
+
+
+class HtmlLayout:
+    def __init__(self, width: int):
+        self.start = f'<div class="receipt" style="max-width: {width}ch">\n'
+        self.issuer = '<h1 class="issuer">{}</h1>\n<table class="products">\n'
+        self.product = ('<tr><td class="quantity" colspan="2">{} x {}</td></tr>\n'
+                        '<tr><td class="name">{}</td>'
+                        '<td class="amount">{}</td></tr>\n')
+        self.totals = ('</table>\n<table class="totals">\n'
+                       f'<tr><th>{TOTAL_LABEL}</th><td>{{}}</td></tr>\n'
+                       '<tr><th>{}</th><td>{}</td></tr>\n'
+                       f'<tr><th>{REST_LABEL}</th><td>{{}}</td></tr>\n'
+                       '</table>\n')
+        self.end = (f'<p class="date">{{}}</p>\n<p class="thanks">{THANKS}</p>\n'
+                    '</div>\n')
+
+    def render(self, receipt: dict) -> str:
+        parts = [self.start, self.issuer.format(html.escape(receipt["issuer"]))]
+        for product in receipt["products"]:
+            parts.append(self.product.format(
+                f"{product['quantity']:.2f}", f"{product['price']:.2f}",
+                html.escape(str(product["name"])),
+                f"{line_total(product['price'], product['quantity']):.2f}"))
+        parts.append(self.totals.format(
+            f"{receipt['total']:.2f}",
+            payment_label(receipt["payment"]),
+            f"{receipt['payment']['amount']:.2f}",
+            f"{receipt['rest']:.2f}"))
+        parts.append(self.end.format(
+            receipt["created_at"].strftime(DATE_FORMAT)))
+        return "".join(parts)
+
+
+LAYOUTS = {
+    "text": TextLayout,
+    "escpos": EscPosLayout,
+    "html": HtmlLayout,
+}
+
+
+@lru_cache(maxsize=RENDER_LAYOUT_CACHE_SIZE)
+def get_layout(output_format: str, width: int):
+    return LAYOUTS[output_format](width)
+
+
+def render_receipt(receipt: dict, output_format: str = "text",
+                   width: int = 50):
+    return get_layout(output_format, width).render(receipt)
+
+
+def render_batch(receipts, output_format: str = "text", width: int = 50):
+    # Runs in the worker processes of bulk rendering, so it only gets plain
+    # dicts and returns the whole batch as one chunk.
+    layout = get_layout(output_format, width)
+    separator = RECEIPT_SEPARATORS[output_format]
+    return separator.join(layout.render(receipt) for receipt in receipts) \
+        + separator
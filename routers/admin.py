@@ -1,12 +1,65 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Path
-from typing import Annotated
-from sqlalchemy.orm import Session
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    Header,
+    HTTPException,
+    status,
+    Path,
+    Query,
+)
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    computed_field,
+    model_validator,
+)
+from typing import Annotated, List, Optional
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session, sessionmaker
 
-from .auth import get_current_user
-from .receipts import ReceiptSchema
+from .auth import get_current_user, record_write
+from .receipts import (
+    PagedReceiptsSchema,
+    newest_first,
+    read_db_dependency,
+    receipts_query,
+    view_parameter,
+)
+from bulk_render import receipt_batches, render_chunks
 from database import SessionLocal
-from models import Receipts
-from pagination import PagedResponseSchema, PageParams, paginate
+from exports import (
+    RangeNotSatisfiableError,
+    export_criteria,
+    parse_range,
+    read_file_range,
+    submit_export,
+)
+from models import (
+    DeleteJobs,
+    EventConsumers,
+    ExportJobs,
+    ReceiptEvents,
+    Receipts,
+)
+from outbox import (
+    delete_receipts_batch,
+    delete_receipts_statement,
+    read_events,
+)
+from page_cache import page_cache
+from rendering import MEDIA_TYPES
+from pagination import (
+    PageParams,
+    get_page_params,
+    paginate,
+)
 
 
 router = APIRouter(
@@ -14,6 +67,16 @@ router = APIRouter(
     tags=["admin"]
 )
 
+ADMIN_MAX_PAGE_SIZE = int(os.getenv("ADMIN_MAX_PAGE_SIZE", 1000))
+ADMIN_DELETE_BATCH_SIZE = int(os.getenv("ADMIN_DELETE_BATCH_SIZE", 1000))
+ADMIN_DELETE_LEASE_SECONDS = int(os.getenv("ADMIN_DELETE_LEASE_SECONDS", 300))
+ADMIN_EVENTS_MAX_LIMIT = int(os.getenv("ADMIN_EVENTS_MAX_LIMIT", 1000))
+
+# delete jobs that still have to run, a failed one is retried
+UNFINISHED_DELETE_JOBS = ("pending", "running", "failed")
+
+logger = logging.getLogger(__name__)
+
 
 def get_db():
     db = SessionLocal()
@@ -27,17 +90,240 @@ db_dependency = Annotated[Session, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
 
+class BulkDeleteRequest(BaseModel):
+    ids: Optional[List[uuid.UUID]] = None
+    owner_id: Optional[int] = None
+    payment_type: Optional[str] = Field(default=None, pattern="^cash(less)?$")
+    created_before: Optional[datetime] = None
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "owner_id": 1,
+                "payment_type": "cash",
+                "created_before": "2024-01-01T00:00:00"
+            }
+        }
+    )
+
+    @model_validator(mode="after")
+    def check_criteria(self):
+        if self.ids is None and self.owner_id is None and \
+                self.payment_type is None and self.created_before is None:
+            raise ValueError("At least one filter is required")
+        return self
+
+
+class DeleteJobSchema(BaseModel):
+    id: uuid.UUID
+    status: str
+    filters: dict
+    receipts_deleted: int
+    created_at: Optional[datetime]
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class BulkRenderRequest(BaseModel):
+    ids: Optional[List[uuid.UUID]] = None
+    owner_id: Optional[int] = None
+    created_from: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+    format: str = Field(default="text", pattern="^(text|escpos|html)$")
+    width: int = Field(default=50, gt=0, le=200)
+    output: str = Field(default="stream", pattern="^(stream|file)$")
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "owner_id": 1,
+                "created_from": "2024-01-01T00:00:00Z",
+                "created_before": "2024-02-01T00:00:00Z",
+                "format": "escpos",
+                "width": 32,
+                "output": "file"
+            }
+        }
+    )
+
+    @model_validator(mode="after")
+    def check_criteria(self):
+        if self.ids is None and self.owner_id is None and \
+                self.created_from is None and self.created_before is None:
+            raise ValueError("At least one filter is required")
+        return self
+
+
+class ExportRequest(BaseModel):
+    format: str = Field(default="ndjson", pattern="^(ndjson|csv)$")
+    owner_id: Optional[int] = None
+    payment_type: Optional[str] = Field(default=None, pattern="^cash(less)?$")
+    created_from: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "format": "csv",
+                "owner_id": 1,
+                "created_from": "2023-01-01T00:00:00Z",
+                "created_before": "2024-01-01T00:00:00Z"
+            }
+        }
+    )
+
+
+class ExportJobSchema(BaseModel):
+    id: uuid.UUID
+    status: str
+    format: str
+    filters: dict
+    width: Optional[int]
+    rows_total: Optional[int]
+    rows_written: Optional[int]
+    size: Optional[int]
+    error: Optional[str]
+    created_at: Optional[datetime]
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+
+    model_config = ConfigDict(from_attributes=True)
+
+    @computed_field
+    @property
+    def progress(self) -> Optional[float]:
+        if self.status == "completed":
+            return 1.0
+        if not self.rows_total:
+            return None
+        return round(self.rows_written / self.rows_total, 4)
+
+
+class ReceiptEventSchema(BaseModel):
+    seq: int
+    event_type: str
+    receipt_id: uuid.UUID
+    owner_id: Optional[int]
+    payload: dict
+    created_at: Optional[datetime]
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ReceiptEventsSchema(BaseModel):
+    events: List[ReceiptEventSchema]
+    last_seq: int
+
+
+class ConsumerOffsetRequest(BaseModel):
+    last_seq: int = Field(ge=0)
+
+
+class ConsumerOffsetSchema(BaseModel):
+    name: str
+    last_seq: int
+    updated_at: Optional[datetime]
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+def claim_delete_job(db, job_id,
+                     lease_seconds: int = ADMIN_DELETE_LEASE_SECONDS):
+    # Claiming the job keeps two processes from running it both. A running
+    # job whose heartbeat stopped was cut short by a crash or a restart and
+    # is taken over.
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=lease_seconds)
+    claimed = db.query(DeleteJobs).filter(
+        DeleteJobs.id == job_id,
+        or_(DeleteJobs.status.in_(("pending", "failed")),
+            and_(DeleteJobs.status == "running",
+                 or_(DeleteJobs.heartbeat_at.is_(None),
+                     DeleteJobs.heartbeat_at < stale))))\
+        .update({"status": "running", "started_at": now,
+                 "heartbeat_at": now}, synchronize_session=False)
+    db.commit()
+    return bool(claimed)
+
+
+def run_delete_job(job_id, session_factory,
+                   batch_size: int = ADMIN_DELETE_BATCH_SIZE):
+    db = session_factory()
+    try:
+        if not claim_delete_job(db, job_id):
+            return
+
+        job = db.get(DeleteJobs, job_id)
+
+        # a long list of ids is matched a slice at a time
+        ids = job.filters.get("ids")
+        slices = [job.filters] if ids is None else [
+            {**job.filters, "ids": ids[start:start + batch_size]}
+            for start in range(0, len(ids), batch_size)]
+
+        # Every batch is its own short transaction so no lock on the
+        # receipts table is held for longer than one batch.
+        for filters in slices:
+            criteria = export_criteria(filters)
+            while True:
+                deleted = delete_receipts_batch(db, *criteria,
+                                                batch_size=batch_size)
+                job.receipts_deleted += deleted
+                job.heartbeat_at = datetime.utcnow()
+                db.commit()
+                if deleted < batch_size:
+                    break
+
+        job.status = "completed"
+        job.finished_at = datetime.utcnow()
+        db.commit()
+    except Exception:
+        db.rollback()
+        db.query(DeleteJobs).filter(DeleteJobs.id == job_id)\
+            .update({"status": "failed"})
+        db.commit()
+        raise
+    finally:
+        db.close()
+        # the owners of the deleted receipts aren't known here
+        page_cache.invalidate_all()
+
+
+def resume_delete_jobs(session_factory):
+    # Jobs left unfinished when a process stopped are picked up again
+    db = session_factory()
+    try:
+        job_ids = [job_id for job_id, in db.query(DeleteJobs.id)
+                   .filter(DeleteJobs.status.in_(UNFINISHED_DELETE_JOBS))]
+    finally:
+        db.close()
+
+    for job_id in job_ids:
+        try:
+            run_delete_job(job_id, session_factory)
+        except Exception:
+            logger.exception("Delete job %s failed", job_id)
+    return job_ids
+
+
 @router.get("/receipts", status_code=status.HTTP_200_OK,
-            response_model=PagedResponseSchema[ReceiptSchema])
-async def get_all_receipts(user: user_dependency, db: db_dependency,
-                           page_params: PageParams = Depends()):
+            response_model=PagedReceiptsSchema)
+async def get_all_receipts(user: user_dependency, db: read_db_dependency,
+                           page_params: PageParams = Depends(
+                               get_page_params(max_size=ADMIN_MAX_PAGE_SIZE)),
+                           view: view_parameter = "full"):
     if user is None or user.get("is_admin") != True:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Authentication failed")
 
-    receipts_model = db.query(Receipts).order_by(Receipts.created_at.desc())
+    receipts_model, ResponseSchema = receipts_query(db, view)
+    receipts_model = receipts_model.order_by(*newest_first())
 
-    response = paginate(page_params, receipts_model, ReceiptSchema)
+    # admin pages span all owners and go up to ADMIN_MAX_PAGE_SIZE rows
+    response = paginate(page_params, receipts_model, ResponseSchema,
+                        stream=True)
 
     if not response.results:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -48,17 +334,279 @@ async def get_all_receipts(user: user_dependency, db: db_dependency,
 
 @router.delete("/receipt/{receipt_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_receipt(user: user_dependency, db: db_dependency,
+                         response: Response,
                          receipt_id: str = Path(pattern="^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")):
     if user is None or user.get("is_admin") != True:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Authentication failed")
 
-    receipt_model = db.query(Receipts).filter(
-        Receipts.id == receipt_id).first()
+    deleted_receipt = db.execute(
+        delete_receipts_statement(Receipts.id == receipt_id)
+        .returning(ReceiptEvents.owner_id)
+    ).first()
+    db.commit()
+    record_write(response, user.get("id"))
 
-    if not receipt_model:
+    if not deleted_receipt:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"Receipt not found")
 
-    db.query(Receipts).filter(Receipts.id == receipt_id).delete()
+    page_cache.invalidate(deleted_receipt.owner_id)
+
+
+@router.post("/receipts/delete", status_code=status.HTTP_202_ACCEPTED,
+             response_model=DeleteJobSchema)
+async def bulk_delete_receipts(user: user_dependency, db: db_dependency,
+                               bulk_delete_request: BulkDeleteRequest,
+                               background_tasks: BackgroundTasks):
+    if user is None or user.get("is_admin") != True:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Authentication failed")
+
+    delete_job = DeleteJobs(
+        status="pending",
+        filters=bulk_delete_request.model_dump(mode="json",
+                                               exclude_none=True),
+        receipts_deleted=0,
+        created_by=user.get("id"),
+        created_at=datetime.utcnow(),
+    )
+    db.add(delete_job)
     db.commit()
+
+    # The batches run on the threadpool after the response is sent, with
+    # their own session, the request only waits for the job to be recorded.
+    session_factory = sessionmaker(autocommit=False, autoflush=False,
+                                   bind=db.get_bind())
+    background_tasks.add_task(run_delete_job, delete_job.id, session_factory)
+
+    return delete_job
+
+
+@router.get("/receipts/delete/{job_id}", status_code=status.HTTP_200_OK,
+            response_model=DeleteJobSchema)
+async def get_delete_job(user: user_dependency, db: db_dependency,
+                         job_id: str = Path(pattern="^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")):
+    if user is None or user.get("is_admin") != True:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Authentication failed")
+
+    delete_job = db.get(DeleteJobs, uuid.UUID(job_id))
+
+    if not delete_job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Delete job not found")
+
+    return delete_job
+
+
+@router.post("/receipts/render", status_code=status.HTTP_200_OK)
+async def bulk_render_receipts(user: user_dependency, db: db_dependency,
+                               bulk_render_request: BulkRenderRequest):
+    if user is None or user.get("is_admin") != True:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Authentication failed")
+
+    criteria = []
+    if bulk_render_request.ids is not None:
+        criteria.append(Receipts.id.in_(bulk_render_request.ids))
+    if bulk_render_request.owner_id is not None:
+        criteria.append(Receipts.owner_id == bulk_render_request.owner_id)
+    if bulk_render_request.created_from is not None:
+        criteria.append(
+            Receipts.created_at >= bulk_render_request.created_from)
+    if bulk_render_request.created_before is not None:
+        criteria.append(
+            Receipts.created_at < bulk_render_request.created_before)
+
+    output_format = bulk_render_request.format
+    width = bulk_render_request.width
+
+    if bulk_render_request.output == "stream":
+        # receipt_batches closes the session once the last batch is read
+        return StreamingResponse(
+            render_chunks(receipt_batches(db, criteria), output_format, width),
+            media_type=MEDIA_TYPES[output_format])
+
+    # A file is rendered by an export job, so it has the same status,
+    # download and retention as the exports.
+    export_job = ExportJobs(
+        status="pending",
+        format=output_format,
+        filters=bulk_render_request.model_dump(
+            mode="json", exclude={"format", "width", "output"},
+            exclude_none=True),
+        width=width,
+        rows_written=0,
+        created_by=user.get("id"),
+        created_at=datetime.utcnow(),
+    )
+    db.add(export_job)
+    db.commit()
+
+    session_factory = sessionmaker(autocommit=False, autoflush=False,
+                                   bind=db.get_bind())
+    submit_export(export_job.id, session_factory)
+
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=ExportJobSchema.model_validate(export_job)
+        .model_dump(mode="json"))
+
+
+@router.post("/exports", status_code=status.HTTP_202_ACCEPTED,
+             response_model=ExportJobSchema)
+async def create_export(user: user_dependency, db: db_dependency,
+                        export_request: ExportRequest):
+    if user is None or user.get("is_admin") != True:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Authentication failed")
+
+    export_job = ExportJobs(
+        status="pending",
+        format=export_request.format,
+        filters=export_request.model_dump(mode="json", exclude={"format"},
+                                          exclude_none=True),
+        rows_written=0,
+        created_by=user.get("id"),
+        created_at=datetime.utcnow(),
+    )
+    db.add(export_job)
+    db.commit()
+
+    # The export runs in the export pool with its own session, the request
+    # only waits for the job to be recorded.
+    session_factory = sessionmaker(autocommit=False, autoflush=False,
+                                   bind=db.get_bind())
+    submit_export(export_job.id, session_factory)
+
+    return export_job
+
+
+@router.get("/exports/{job_id}", status_code=status.HTTP_200_OK,
+            response_model=ExportJobSchema)
+async def get_export(user: user_dependency, db: db_dependency,
+                     job_id: str = Path(pattern="^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")):
+    if user is None or user.get("is_admin") != True:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Authentication failed")
+
+    export_job = db.get(ExportJobs, uuid.UUID(job_id))
+
+    if not export_job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Export not found")
+
+    return export_job
+
+
+@router.get("/exports/{job_id}/download", status_code=status.HTTP_200_OK)
+async def download_export(user: user_dependency, db: db_dependency,
+                          job_id: str = Path(pattern="^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$"),
+                          range_header: Optional[str] = Header(default=None,
+                                                               alias="Range")):
+    if user is None or user.get("is_admin") != True:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Authentication failed")
+
+    export_job = db.get(ExportJobs, uuid.UUID(job_id))
+
+    if not export_job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Export not found")
+
+    if export_job.status == "expired":
+        raise HTTPException(status_code=status.HTTP_410_GONE,
+                            detail="Export expired")
+
+    if export_job.status != "completed":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="Export not completed")
+
+    if not os.path.exists(export_job.path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Export file not found")
+
+    size = os.path.getsize(export_job.path)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": "attachment; "
+                               f'filename="{os.path.basename(export_job.path)}"',
+    }
+
+    byte_range = None
+    if range_header:
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiableError:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, status.HTTP_200_OK
+    else:
+        start, end = byte_range
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    return StreamingResponse(read_file_range(export_job.path, start, end),
+                             status_code=status_code,
+                             media_type="application/gzip", headers=headers)
+
+
+@router.get("/events", status_code=status.HTTP_200_OK,
+            response_model=ReceiptEventsSchema)
+async def get_receipt_events(user: user_dependency, db: db_dependency,
+                             after: Optional[int] = Query(default=None, ge=0),
+                             consumer: Optional[str] = Query(default=None,
+                                                             max_length=100),
+                             limit: int = Query(default=100, gt=0,
+                                                le=ADMIN_EVENTS_MAX_LIMIT)):
+    if user is None or user.get("is_admin") != True:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Authentication failed")
+
+    if after is None:
+        offset = db.get(EventConsumers, consumer) if consumer else None
+        after = offset.last_seq if offset else 0
+
+    events = read_events(db, after, limit)
+
+    return {"events": events,
+            "last_seq": events[-1].seq if events else after}
+
+
+@router.get("/events/consumers/{name}", status_code=status.HTTP_200_OK,
+            response_model=ConsumerOffsetSchema)
+async def get_consumer_offset(user: user_dependency, db: db_dependency,
+                              name: str = Path(max_length=100)):
+    if user is None or user.get("is_admin") != True:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Authentication failed")
+
+    offset = db.get(EventConsumers, name)
+
+    if not offset:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Consumer not found")
+
+    return offset
+
+
+@router.put("/events/consumers/{name}", status_code=status.HTTP_200_OK,
+            response_model=ConsumerOffsetSchema)
+async def save_consumer_offset(user: user_dependency, db: db_dependency,
+                               offset_request: ConsumerOffsetRequest,
+                               name: str = Path(max_length=100)):
+    if user is None or user.get("is_admin") != True:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Authentication failed")
+
+    offset = db.merge(EventConsumers(name=name,
+                                     last_seq=offset_request.last_seq,
+                                     updated_at=datetime.utcnow()))
+    db.commit()
+
+    return offset
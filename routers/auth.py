@@ -1,16 +1,18 @@
 
+import math
 import os
 from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends, status, HTTPException
+from fastapi import APIRouter, Depends, Response, status, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from pydantic import BaseModel, Field, EmailStr, ConfigDict
 from passlib.context import CryptContext
 from sqlalchemy.orm import Session
-from typing import Annotated
+from starlette.concurrency import run_in_threadpool
+from typing import Annotated, Optional
 from jose import jwt, JWTError
 
 
-from database import SessionLocal
+from database import READ_YOUR_WRITES_SECONDS, SessionLocal
 from models import Users
 
 
@@ -21,6 +23,7 @@ router = APIRouter(
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
+LAST_WRITE_COOKIE = "last_write"
 
 bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl="auth/token")
@@ -65,7 +68,8 @@ db_dependency = Annotated[Session, Depends(get_db)]
 
 
 def authenticate_user(username: str, password: str, db):
-    user = db.query(Users).filter(Users.username == username).first()
+    user = db.query(Users).filter(Users.username == username)\
+        .filter(Users.deleted_at.is_(None)).first()
 
     if not user:
         return False
@@ -88,7 +92,28 @@ def create_access_token(username: str, user_id: int,
     return jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)]):
+def record_write(response: Response, user_id: int):
+    # The write travels with the client in a signed cookie, so whichever
+    # worker serves its next reads sends them to the primary.
+    expires = datetime.utcnow() + timedelta(seconds=READ_YOUR_WRITES_SECONDS)
+    marker = jwt.encode({"last_write": user_id, "exp": expires}, SECRET_KEY,
+                        algorithm=ALGORITHM)
+    response.set_cookie(LAST_WRITE_COOKIE, marker,
+                        max_age=math.ceil(READ_YOUR_WRITES_SECONDS),
+                        httponly=True, samesite="strict")
+
+
+def wrote_recently(marker: Optional[str], user_id) -> bool:
+    if marker is None or user_id is None:
+        return False
+    try:
+        payload = jwt.decode(marker, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return False
+    return payload.get("last_write") == user_id
+
+
+def decode_token(token: str):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -105,6 +130,31 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)]):
                             detail="Could not validate the user")
 
 
+async def get_token_user(token: Annotated[str, Depends(oauth2_bearer)]):
+    # Only checks the token, so a user who is being deleted can still follow
+    # the progress of their deletion.
+    return decode_token(token)
+
+
+async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)],
+                           db: db_dependency):
+    user = decode_token(token)
+
+    def load_active_user():
+        return db.query(Users.id).filter(Users.id == user["id"])\
+            .filter(Users.deleted_at.is_(None)).first()
+
+    # Tokens outlive the user they were issued to, so a deleted user is
+    # turned away even with a token that hasn't expired yet. The lookup
+    # runs for every request and is kept off the event loop.
+    active_user = await run_in_threadpool(load_active_user)
+    if active_user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Could not validate the user")
+
+    return user
+
+
 @router.post("/create_user", status_code=status.HTTP_201_CREATED)
 async def create_user(db: db_dependency,
                       create_user_request: CreateUserRequest):
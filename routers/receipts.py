@@ -1,23 +1,64 @@
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from fastapi import (
     APIRouter,
+    Cookie,
     Depends,
+    Header,
     HTTPException,
     status,
     Path,
     Query,
 )
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, ConfigDict
-from typing import Annotated, List, Dict, Union
-from sqlalchemy import String, func
+from typing import Annotated, List, Dict, Optional, Union
+from sqlalchemy import String, func, insert
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from .auth import get_current_user
-from database import SessionLocal
-from models import Receipts, Users
-from pagination import PagedResponseSchema, PageParams, paginate
+from .auth import (
+    LAST_WRITE_COOKIE,
+    get_current_user,
+    record_write,
+    wrote_recently,
+)
+from archive import load_archived_receipt
+from database import ReplicaSessionLocals, SessionLocal, get_read_session
+from group_commit import GROUP_COMMIT_ENABLED, GroupCommitBuffer
+from ids import ORDER_RECEIPTS_BY_ID, uuid7
+from live_feed import (
+    LIVE_FEED_REPLAY_BATCH_SIZE,
+    ReceiptFeed,
+    stream_events,
+)
+from models import ReceiptEvents, Receipts, Users
+from money import compute_receipt
+from outbox import (
+    delete_receipts_statement,
+    last_event_seq,
+    read_events,
+    receipt_event,
+)
+from page_cache import PAGE_CACHE_ENABLED, page_cache
+from pagination import (
+    PagedResponseSchema,
+    PageParams,
+    get_page_params,
+    paginate,
+)
+from profiling import profiled
+from rendering import MEDIA_TYPES, receipt_to_render_dict, render_receipt
+from search import (
+    SEARCH_DEFAULT_SIZE,
+    SEARCH_MAX_SIZE,
+    InvalidCursorError,
+    after_cursor,
+    encode_cursor,
+    matches,
+    rank,
+)
+from singleflight import SingleFlight
 
 
 router = APIRouter(
@@ -37,6 +78,102 @@ db_dependency = Annotated[Session, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
 
+def get_read_db(user: user_dependency,
+                last_write: Optional[str] = Cookie(default=None,
+                                                   alias=LAST_WRITE_COOKIE)):
+    recently_written = wrote_recently(last_write,
+                                      user.get("id") if user else None)
+    db = get_read_session(recently_written)
+    # read by cached_page, pages cached by other requests may predate it
+    db.info["recently_written"] = recently_written
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_replica_db():
+    db = get_read_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+read_db_dependency = Annotated[Session, Depends(get_read_db)]
+replica_db_dependency = Annotated[Session, Depends(get_replica_db)]
+view_parameter = Annotated[str, Query(pattern="^(full|summary)$")]
+
+
+def insert_receipts(db: Session, rows: List[dict]) -> List[tuple]:
+    created_ats = db.scalars(
+        insert(Receipts).returning(Receipts.created_at,
+                                   sort_by_parameter_order=True),
+        rows).all()
+    rows = [{**row, "created_at": created_at}
+            for row, created_at in zip(rows, created_ats)]
+    seqs = db.scalars(
+        insert(ReceiptEvents).returning(ReceiptEvents.seq,
+                                        sort_by_parameter_order=True),
+        [receipt_event("created", row) for row in rows]).all()
+    return list(zip(created_ats, seqs))
+
+
+receipt_buffer = GroupCommitBuffer(insert_receipts, SessionLocal)
+receipt_feed = ReceiptFeed()
+# the queries of a profiled request are sampled on the threadpool too
+receipt_reads = SingleFlight(wrap=profiled)
+
+
+def newest_first():
+    # UUIDv7 ids grow with time, so they can order receipts on their own
+    if ORDER_RECEIPTS_BY_ID:
+        return (Receipts.id.desc(),)
+    # now() is the start of the transaction, so the receipts of one group
+    # commit share their created_at and the id keeps the order stable
+    return (Receipts.created_at.desc(), Receipts.id.desc())
+
+
+def page_key(route: str, user: dict, page_params: PageParams, *params):
+    # A streamed page is read from its session once, so it can't be shared
+    if page_params.size > page_params.max_size:
+        return None
+    return (route, user.get("id"), page_params.page, page_params.size,
+            *params)
+
+
+async def cached_page(user: dict, db: Session, key, load_page):
+    if not PAGE_CACHE_ENABLED or key is None:
+        return await receipt_reads.run(key, load_page)
+
+    # Right after its own write a client reads its page fresh from the
+    # primary, neither from the cache nor shared with a concurrent load
+    # that may have started before the write.
+    if db.info.get("recently_written"):
+        return await receipt_reads.run(None, load_page)
+
+    def lookup_page():
+        cache_key = page_cache.key(user.get("id"), key)
+        return cache_key, page_cache.get(cache_key)
+
+    def load_and_cache_page():
+        content = load_page().model_dump_json()
+        # A page read from a replica right after a write may predate it, and
+        # would be cached under the generation the write started.
+        if not db.info.get("replica") or \
+                not page_cache.recently_written(user.get("id")):
+            page_cache.set(cache_key, content)
+        return content
+
+    # The key is taken before the page is read, so a page that raced with a
+    # write is stored under the generation the write has already replaced.
+    cache_key, content = await run_in_threadpool(lookup_page)
+    if content is None:
+        content = await receipt_reads.run(cache_key, load_and_cache_page)
+
+    return Response(content=content, media_type="application/json")
+
+
 class ReceiptRequest(BaseModel):
     products: List[Dict[str, Union[int, str, float]]]
     payment: Dict[str, Union[int, str, float]]
@@ -77,224 +214,367 @@ class ReceiptSchema(BaseModel):
     owner_id: int
 
 
+class ReceiptSummarySchema(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: uuid.UUID
+    total: float
+    created_at: datetime
+    payment_type: str
+    items_count: int
+    owner_id: int
+
+
+PagedReceiptsSchema = Union[PagedResponseSchema[ReceiptSchema],
+                            PagedResponseSchema[ReceiptSummarySchema]]
+
+
+class ReceiptSearchSchema(BaseModel):
+    results: List[ReceiptSchema]
+    next_cursor: Optional[str]
+
+
+def receipts_query(db: Session, view: str):
+    # The summary view selects plain columns, so neither the products JSON
+    # nor ORM instances are loaded.
+    if view == "summary":
+        return db.query(
+            Receipts.id,
+            Receipts.total,
+            Receipts.created_at,
+            Receipts.payment.op("->>")("type").cast(
+                String).label("payment_type"),
+            func.json_array_length(Receipts.products).label("items_count"),
+            Receipts.owner_id,
+        ), ReceiptSummarySchema
+
+    return db.query(Receipts), ReceiptSchema
+
+
 @router.get("/receipts", status_code=status.HTTP_200_OK,
-            response_model=PagedResponseSchema[ReceiptSchema])
-async def get_all_receipts(user: user_dependency, db: db_dependency,
-                           page_params: PageParams = Depends()):
+            response_model=PagedReceiptsSchema)
+async def get_all_receipts(user: user_dependency, db: read_db_dependency,
+                           page_params: PageParams = Depends(get_page_params()),
+                           view: view_parameter = "full"):
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Authentication failed")
 
-    receipts_model = db.query(Receipts).filter(
-        Receipts.owner_id == user.get("id")).order_by(Receipts.created_at.desc())
+    def load_page():
+        receipts_model, ResponseSchema = receipts_query(db, view)
+        receipts_model = receipts_model.filter(
+            Receipts.owner_id == user.get("id")).order_by(*newest_first())
 
-    response = paginate(page_params, receipts_model, ReceiptSchema)
+        response = paginate(page_params, receipts_model, ResponseSchema)
 
-    if not response.results:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail="Receipts not found")
+        if not response.results:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail="Receipts not found")
+
+        return response
 
-    return response
+    return await cached_page(
+        user, db, page_key("/receipts", user, page_params, view), load_page)
 
 
 @router.get("/receipts/", status_code=status.HTTP_200_OK,
-            response_model=PagedResponseSchema[ReceiptSchema])
-async def get_receipts_by_payment_type(user: user_dependency, db: db_dependency,
+            response_model=PagedReceiptsSchema)
+async def get_receipts_by_payment_type(user: user_dependency, db: read_db_dependency,
                                        payment_type: str = Query(
                                            pattern="^cash(less)?$"),
-                                       page_params: PageParams = Depends()):
+                                       page_params: PageParams = Depends(get_page_params()),
+                                       view: view_parameter = "full"):
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Authentication failed")
 
-    receipts_model = db.query(Receipts).filter(Receipts.payment.op("->>")("type").cast(String) == payment_type)\
-        .filter(Receipts.owner_id == user.get("id")).order_by(Receipts.created_at.desc())
+    def load_page():
+        receipts_model, ResponseSchema = receipts_query(db, view)
+        receipts_model = receipts_model.filter(Receipts.payment.op("->>")("type").cast(String) == payment_type)\
+            .filter(Receipts.owner_id == user.get("id")).order_by(*newest_first())
 
-    response = paginate(page_params, receipts_model, ReceiptSchema)
+        response = paginate(page_params, receipts_model, ResponseSchema)
 
-    if not response.results:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail="Receipts not found")
+        if not response.results:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail="Receipts not found")
+
+        return response
 
-    return response
+    return await cached_page(
+        user, db,
+        page_key("/receipts/", user, page_params, view, payment_type),
+        load_page)
 
 
 @router.get("/receipts/last_month/", status_code=status.HTTP_200_OK,
-            response_model=PagedResponseSchema[ReceiptSchema])
+            response_model=PagedReceiptsSchema)
 async def get_receipts_created_within_last_month(user: user_dependency,
-                                                 db: db_dependency,
-                                                 page_params: PageParams = Depends()):
+                                                 db: read_db_dependency,
+                                                 page_params: PageParams = Depends(get_page_params()),
+                                                 view: view_parameter = "full"):
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Authentication failed")
 
-    last_month = datetime.now().month - 1
-    current_year = datetime.now().year
+    # A plain range on created_at lets Postgres prune the monthly partitions
+    current_month = datetime.now(timezone.utc).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0)
+    last_month = (current_month - timedelta(days=1)).replace(day=1)
 
-    receipts_model = db.query(Receipts).filter(
-        func.extract('month', Receipts.created_at) == last_month,
-        func.extract('year', Receipts.created_at) == current_year)\
-        .filter(Receipts.owner_id == user.get("id"))\
-        .order_by(Receipts.created_at.desc())
+    def load_page():
+        receipts_model, ResponseSchema = receipts_query(db, view)
+        receipts_model = receipts_model.filter(
+            Receipts.created_at >= last_month,
+            Receipts.created_at < current_month)\
+            .filter(Receipts.owner_id == user.get("id"))\
+            .order_by(*newest_first())
 
-    response = paginate(page_params, receipts_model, ReceiptSchema)
+        response = paginate(page_params, receipts_model, ResponseSchema)
 
-    if not response.results:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail="Receipts not found")
+        if not response.results:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail="Receipts not found")
+
+        return response
 
-    return response
+    return await cached_page(
+        user, db, page_key("/receipts/last_month/", user, page_params, view,
+                           current_month), load_page)
 
 
 @router.get("/receipts/{total_amount}/", status_code=status.HTTP_200_OK,
-            response_model=PagedResponseSchema[ReceiptSchema])
-async def get_receipts_by_total_amount(user: user_dependency, db: db_dependency,
+            response_model=PagedReceiptsSchema)
+async def get_receipts_by_total_amount(user: user_dependency, db: read_db_dependency,
                                        total_amount: float = Path(gt=0),
-                                       page_params: PageParams = Depends()):
+                                       page_params: PageParams = Depends(get_page_params()),
+                                       view: view_parameter = "full"):
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Authentication failed")
 
-    receipts_model = db.query(Receipts).filter(Receipts.total >= total_amount)\
-        .filter(Receipts.owner_id == user.get("id"))\
-        .order_by(Receipts.created_at.desc())
+    def load_page():
+        receipts_model, ResponseSchema = receipts_query(db, view)
+        receipts_model = receipts_model.filter(Receipts.total >= total_amount)\
+            .filter(Receipts.owner_id == user.get("id"))\
+            .order_by(*newest_first())
 
-    response = paginate(page_params, receipts_model, ReceiptSchema)
+        response = paginate(page_params, receipts_model, ResponseSchema)
 
-    if not response.results:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail="Receipts not found")
+        if not response.results:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail="Receipts not found")
 
-    return response
+        return response
 
+    return await cached_page(
+        user, db, page_key("/receipts/{total_amount}/", user, page_params,
+                           view, total_amount), load_page)
 
-@router.get("/receipt/{receipt_id}", status_code=status.HTTP_200_OK)
-async def get_receipt_by_id(user: user_dependency, db: db_dependency,
+
+@router.get("/receipt/{receipt_id}", status_code=status.HTTP_200_OK,
+            response_model=ReceiptSchema)
+async def get_receipt_by_id(user: user_dependency, db: read_db_dependency,
                             receipt_id: str = Path(pattern="^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")):
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Authentication failed")
 
-    receipt_model = db.query(Receipts).filter(Receipts.id == receipt_id)\
-        .filter(Receipts.owner_id == user.get("id")).first()
+    def load_receipt():
+        receipt_model = db.query(Receipts).filter(Receipts.id == receipt_id)\
+            .filter(Receipts.owner_id == user.get("id")).first()
 
-    if not receipt_model:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail="Receipt not found")
+        if not receipt_model:
+            receipt_model = load_archived_receipt(db, receipt_id,
+                                                  user.get("id"))
+
+        if not receipt_model:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail="Receipt not found")
+
+        return receipt_model
 
-    return receipt_model
+    return await receipt_reads.run(
+        ("/receipt/{receipt_id}", user.get("id"), receipt_id), load_receipt)
 
 
-@router.post("/receipt", status_code=status.HTTP_201_CREATED)
+@router.get("/receipts/search", status_code=status.HTTP_200_OK,
+            response_model=ReceiptSearchSchema)
+async def search_receipts(user: user_dependency, db: read_db_dependency,
+                          q: str = Query(min_length=3, max_length=100),
+                          size: int = Query(default=SEARCH_DEFAULT_SIZE, ge=1,
+                                            le=SEARCH_MAX_SIZE),
+                          cursor: Optional[str] = None):
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Authentication failed")
+
+    def load_results():
+        receipt_rank = rank(q, Receipts.products)
+        receipts_model = db.query(Receipts, receipt_rank.label("rank"))\
+            .filter(Receipts.owner_id == user.get("id"))\
+            .filter(matches(q, Receipts.products))
+
+        if cursor is not None:
+            try:
+                receipts_model = receipts_model.filter(
+                    after_cursor(cursor, receipt_rank, Receipts.id))
+            except InvalidCursorError:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail="Invalid cursor")
+
+        # One extra row tells whether there is a next page without a count
+        rows = receipts_model.order_by(receipt_rank.desc(),
+                                       Receipts.id.desc())\
+            .limit(size + 1).all()
+
+        if not rows:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail="Receipts not found")
+
+        next_cursor = None
+        if len(rows) > size:
+            rows = rows[:size]
+            next_cursor = encode_cursor(rows[-1].rank, rows[-1].Receipts.id)
+
+        return {"results": [row.Receipts for row in rows],
+                "next_cursor": next_cursor}
+
+    return await receipt_reads.run(
+        ("/receipts/search", user.get("id"), q, size, cursor), load_results)
+
+
+@router.get("/receipts/stream", status_code=status.HTTP_200_OK)
+async def stream_receipts(user: user_dependency, db: db_dependency,
+                          last_event_id: Optional[int] = Header(default=None,
+                                                                ge=0)):
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Authentication failed")
+
+    def load_created_events(after: int):
+        try:
+            return [(event.seq, event.payload) for event in read_events(
+                db, after, LIVE_FEED_REPLAY_BATCH_SIZE,
+                owner_id=user.get("id"), event_type="created")]
+        finally:
+            db.close()
+
+    async def load_events(after: int):
+        return await run_in_threadpool(load_created_events, after)
+
+    def load_last_seq():
+        try:
+            return last_event_seq(db, owner_id=user.get("id"),
+                                  event_type="created")
+        finally:
+            db.close()
+
+    # without a Last-Event-ID the feed starts at the newest readable event
+    if last_event_id is None:
+        last_event_id = await run_in_threadpool(load_last_seq)
+
+    return StreamingResponse(
+        stream_events(receipt_feed, user.get("id"), last_event_id,
+                      load_events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/receipt", status_code=status.HTTP_201_CREATED,
+             response_model=ReceiptSchema)
 async def create_receipt(user: user_dependency, db: db_dependency,
-                         receipt_request: ReceiptRequest):
+                         receipt_request: ReceiptRequest, response: Response):
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Authentication failed")
 
-    receipt = receipt_request.model_dump()
-    total_per_receipt = 0
-    for product in receipt["products"]:
-        total_per_product = round(product["price"] * product["quantity"], 2)
-        total_per_receipt += total_per_product
-        product.update({"total": total_per_product})
-
-    receipt.update({
-        "total": round(total_per_receipt, 2),
-        "rest": round(receipt["payment"]["amount"] - total_per_receipt, 2),
-        "created_at": datetime.utcnow()
-    })
-
-    receipt_model = Receipts(**receipt, owner_id=user.get("id"))
-    db.add(receipt_model)
-    db.commit()
+    receipt = compute_receipt(receipt_request.model_dump())
+    receipt.update({"id": uuid7()})
 
-    receipt.update({"id": receipt_model.id})
+    # created_at is set by the database and read back from the INSERT
+    if GROUP_COMMIT_ENABLED:
+        receipt["created_at"], seq = await receipt_buffer.submit(
+            {**receipt, "owner_id": user.get("id")})
+        created_event = receipt_event("created",
+                                      {**receipt, "owner_id": user.get("id")})
+    else:
+        receipt_model = Receipts(**receipt, owner_id=user.get("id"))
+        db.add(receipt_model)
+        db.flush()
+        receipt["created_at"] = receipt_model.created_at
 
-    return receipt
+        created_event = receipt_event("created",
+                                      {**receipt, "owner_id": user.get("id")})
+        receipt_event_model = ReceiptEvents(**created_event)
+        db.add(receipt_event_model)
+        db.flush()
+        seq = receipt_event_model.seq
+        db.commit()
+    record_write(response, user.get("id"))
+    page_cache.invalidate(user.get("id"))
+
+    receipt_feed.publish(user.get("id"), seq, created_event["payload"])
+
+    return {**receipt, "owner_id": user.get("id")}
 
 
 @router.delete("/receipt/{receipt_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_receipt(user: user_dependency, db: db_dependency,
+                         response: Response,
                          receipt_id: str = Path(pattern="^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")):
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Authentication failed")
 
-    receipt_model = db.query(Receipts).filter(Receipts.id == receipt_id)\
-        .filter(Receipts.owner_id == user.get("id")).first()
+    deleted_receipt = db.execute(
+        delete_receipts_statement(Receipts.id == receipt_id,
+                                  Receipts.owner_id == user.get("id"))
+        .returning(ReceiptEvents.receipt_id)
+    ).first()
+    db.commit()
+    record_write(response, user.get("id"))
+    page_cache.invalidate(user.get("id"))
 
-    if not receipt_model:
+    if not deleted_receipt:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Receipt not found")
 
-    db.query(Receipts).filter(Receipts.id == receipt_id)\
-        .filter(Receipts.owner_id == user.get("id")).delete()
-    db.commit()
-
 
 @router.get("/receipt/{receipt_id}/text", status_code=status.HTTP_200_OK)
-async def get_receipt_text(db: db_dependency,
+async def get_receipt_text(db: replica_db_dependency, primary_db: db_dependency,
                            receipt_id: str = Path(
                                pattern="^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$"),
-                           max_characters_per_line: int = Query(default=50, gt=0)):
-
-    receipt_model = db.query(Receipts).filter(
-        Receipts.id == receipt_id).first()
-
-    if not receipt_model:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail="Receipt not found")
-
-    user_model = db.query(Users).filter(
-        Users.id == receipt_model.owner_id).first()
-
-    receipt_issuer_name = f"ФОП {user_model.first_name.upper()} {user_model.last_name.upper()}"
-    total = f"{receipt_model.total:.2f}"
-    payment_amount = f"{receipt_model.payment['amount']:.2f}"
-    payment_type = "Картка" if receipt_model.payment['type'] == "cashless" else "Готівка"
-    rest = f"{receipt_model.rest:.2f}"
-    receipt_date = receipt_model.created_at.strftime("%d.%m.%Y %H:%M:%S")
-
-    receipt_content = ""
-    receipt_content += f"\n{receipt_issuer_name.center(max_characters_per_line)}\n"
-    receipt_content += f"{'=' * max_characters_per_line}\n"
-
-    for product in receipt_model.products:
-        receipt_content += f"{product['quantity']:.2f} x {product['price']:.2f}\n"
-
-        total_per_product = f"{product['quantity'] * product['price']:.2f}"
-        product_name = product['name']
-        if len(product_name) >= max_characters_per_line-len(total_per_product):
-            product_name_in_words = product_name.split(" ")
-            while product_name_in_words:
-                name_part = []
-                length_of_name_part = 0
-                i = 0
-                for i in range(len(product_name_in_words)):
-                    length_of_name_part += len(product_name_in_words[i])+1
-                    if length_of_name_part >= max_characters_per_line-len(total_per_product)-5:
-                        receipt_content += f"{(' ').join(name_part)}\n"
-                        break
-
-                    name_part.append(product_name_in_words[i])
-
-                    if i == len(product_name_in_words)-1:
-                        receipt_content += f"{(' ').join(name_part): <{max_characters_per_line-len(total_per_product)}}{total_per_product}\n"
-
-                product_name_in_words = [
-                    word for word in product_name_in_words if word not in name_part]
-        else:
-            receipt_content += f"{product_name: <{max_characters_per_line-len(total_per_product)}}{total_per_product}\n"
-
-        receipt_content += f"{'-' * max_characters_per_line}\n"
-
-    receipt_content += f"{'=' * max_characters_per_line}\n"
-    receipt_content += f"{'СУМА': <{max_characters_per_line-len(total)}}{total}\n"
-    receipt_content += f"{payment_type: <{max_characters_per_line - len(payment_amount)}}{payment_amount}\n"
-    receipt_content += f"{'Решта': <{max_characters_per_line - len(rest)}}{rest}\n"
-    receipt_content += f"{'=' * max_characters_per_line}\n"
-    receipt_content += f"{receipt_date.center(max_characters_per_line)}\n"
-    receipt_content += f"{'Дякуємо за покупку!'.center(max_characters_per_line)}\n"
-
-    return PlainTextResponse(content=receipt_content)
+                           max_characters_per_line: int = Query(default=50, gt=0,
+                                                                le=200),
+                           output_format: str = Query(
+                               default="text", alias="format",
+                               pattern="^(text|escpos|html)$")):
+
+    def load_content(db: Session):
+        receipt_model = db.query(Receipts).filter(
+            Receipts.id == receipt_id).first()
+
+        # A receipt created moments ago may not have reached the replica yet
+        if not receipt_model and ReplicaSessionLocals:
+            db = primary_db
+            receipt_model = db.query(Receipts).filter(
+                Receipts.id == receipt_id).first()
+
+        if not receipt_model:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail="Receipt not found")
+
+        user_model = db.query(Users).filter(
+            Users.id == receipt_model.owner_id).first()
+
+        return render_receipt(
+            receipt_to_render_dict(receipt_model, user_model),
+            output_format, max_characters_per_line)
+
+    content = await receipt_reads.run(
+        ("/receipt/{receipt_id}/text", receipt_id, max_characters_per_line,
+         output_format), load_content, db)
+
+    return Response(content=content, media_type=MEDIA_TYPES[output_format])
@@ -1,12 +1,25 @@
-from fastapi import APIRouter, Depends, status, HTTPException, Path
+import logging
+import os
+from datetime import datetime, timedelta
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    status,
+    HTTPException,
+    Path,
+)
 from passlib.context import CryptContext
-from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
-from typing import Annotated
+from pydantic import BaseModel, ConfigDict, Field
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session, sessionmaker
+from typing import Annotated, Optional
 
-from .auth import get_current_user
+from .auth import get_current_user, get_token_user
 from database import SessionLocal
-from models import Users
+from models import ArchivedReceipts, Receipts, UserDeletions, Users
+from outbox import delete_receipts_batch, delete_receipts_statement
+from page_cache import page_cache
 
 
 router = APIRouter(
@@ -14,6 +27,15 @@ router = APIRouter(
     tags=["user"]
 )
 
+USER_DELETION_BATCH_SIZE = int(os.getenv("USER_DELETION_BATCH_SIZE", 1000))
+USER_DELETION_LEASE_SECONDS = int(os.getenv("USER_DELETION_LEASE_SECONDS",
+                                            300))
+
+# deletions that still have to run, a failed one is retried
+UNFINISHED_DELETIONS = ("pending", "running", "failed")
+
+logger = logging.getLogger(__name__)
+
 
 def get_db():
     db = SessionLocal()
@@ -25,6 +47,7 @@ def get_db():
 
 db_dependency = Annotated[Session, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
+token_user_dependency = Annotated[dict, Depends(get_token_user)]
 bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
@@ -33,6 +56,94 @@ class UserVerification(BaseModel):
     new_password: str = Field(min_length=10)
 
 
+class UserDeletionSchema(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    user_id: int
+    status: str
+    receipts_deleted: int
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+
+
+def claim_user_deletion(db, user_id: int,
+                        lease_seconds: int = USER_DELETION_LEASE_SECONDS):
+    # Claiming the deletion keeps two processes from running it both. A
+    # running deletion whose heartbeat stopped was cut short by a crash or a
+    # restart and is taken over.
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=lease_seconds)
+    claimed = db.query(UserDeletions).filter(
+        UserDeletions.user_id == user_id,
+        or_(UserDeletions.status.in_(("pending", "failed")),
+            and_(UserDeletions.status == "running",
+                 or_(UserDeletions.heartbeat_at.is_(None),
+                     UserDeletions.heartbeat_at < stale))))\
+        .update({"status": "running", "heartbeat_at": now},
+                synchronize_session=False)
+    db.commit()
+    return bool(claimed)
+
+
+def delete_user_data(user_id: int, session_factory,
+                     batch_size: int = USER_DELETION_BATCH_SIZE):
+    db = session_factory()
+    try:
+        if not claim_user_deletion(db, user_id):
+            return
+
+        deletion = db.get(UserDeletions, user_id)
+
+        # Every batch is its own short transaction so no lock on the
+        # receipts table is held for longer than one batch.
+        while True:
+            deleted = delete_receipts_batch(db, Receipts.owner_id == user_id,
+                                            batch_size=batch_size)
+            deletion.receipts_deleted += deleted
+            deletion.heartbeat_at = datetime.utcnow()
+            db.commit()
+            if deleted < batch_size:
+                break
+
+        # receipts written by requests that were authenticated just before
+        # deleted_at was set go together with the user
+        deletion.receipts_deleted += db.execute(delete_receipts_statement(
+            Receipts.owner_id == user_id)).rowcount
+        db.query(ArchivedReceipts).filter(
+            ArchivedReceipts.owner_id == user_id).delete()
+        db.query(Users).filter(Users.id == user_id).delete()
+        deletion.status = "completed"
+        deletion.finished_at = datetime.utcnow()
+        db.commit()
+    except Exception:
+        db.rollback()
+        db.query(UserDeletions).filter(UserDeletions.user_id == user_id)\
+            .update({"status": "failed"})
+        db.commit()
+        raise
+    finally:
+        db.close()
+        page_cache.invalidate(user_id)
+
+
+def resume_user_deletions(session_factory):
+    # Deletions left unfinished when a process stopped are picked up again,
+    # their users can't sign in or use their tokens to start them anew.
+    db = session_factory()
+    try:
+        user_ids = [user_id for user_id, in db.query(UserDeletions.user_id)
+                    .filter(UserDeletions.status.in_(UNFINISHED_DELETIONS))]
+    finally:
+        db.close()
+
+    for user_id in user_ids:
+        try:
+            delete_user_data(user_id, session_factory)
+        except Exception:
+            logger.exception("Deletion of user %s failed", user_id)
+    return user_ids
+
+
 @router.get("", status_code=status.HTTP_200_OK)
 async def get_user(user: user_dependency, db: db_dependency):
     if user is None:
@@ -64,10 +175,45 @@ async def change_password(user: user_dependency,
 
 
 @router.delete("/delete", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_user(user: user_dependency, db: db_dependency):
+async def delete_user(user: user_dependency, db: db_dependency,
+                      background_tasks: BackgroundTasks):
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Authentication failed")
 
-    db.query(Users).filter(Users.id == user.get("id")).delete()
+    user_model = db.query(Users).filter(Users.id == user.get("id")).first()
+
+    deletion_model = db.query(UserDeletions).filter(
+        UserDeletions.user_id == user.get("id")).first()
+
+    if not user_model or (deletion_model and
+                          deletion_model.status in ("pending", "running")):
+        return
+
+    user_model.deleted_at = datetime.utcnow()
+    db.merge(UserDeletions(user_id=user_model.id, status="pending",
+                           receipts_deleted=0, started_at=datetime.utcnow(),
+                           finished_at=None))
     db.commit()
+
+    session_factory = sessionmaker(autocommit=False, autoflush=False,
+                                   bind=db.get_bind())
+    background_tasks.add_task(delete_user_data, user_model.id,
+                              session_factory)
+
+
+@router.get("/delete", status_code=status.HTTP_200_OK,
+            response_model=UserDeletionSchema)
+async def get_user_deletion(user: token_user_dependency, db: db_dependency):
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Authentication failed")
+
+    deletion_model = db.query(UserDeletions).filter(
+        UserDeletions.user_id == user.get("id")).first()
+
+    if not deletion_model:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="User deletion not found")
+
+    return deletion_model
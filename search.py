@@ -0,0 +1,74 @@
+import base64
+import binascii
+import json
+import os
+import uuid
+from dotenv import load_dotenv
+from sqlalchemy import REAL, cast, func, literal, text, tuple_
+
+
+load_dotenv()
+
+SEARCH_DEFAULT_SIZE = int(os.getenv("SEARCH_DEFAULT_SIZE", 20))
+SEARCH_MAX_SIZE = int(os.getenv("SEARCH_MAX_SIZE", 100))
+
+SEARCH_INDEX = "ix_receipts_product_names_trgm"
+
+# Index expressions must be immutable, so the product names are pulled out
+# of the JSON column by a function declared as such instead of inline.
+PRODUCT_NAMES_FUNCTION = """
+CREATE OR REPLACE FUNCTION receipt_product_names(products json) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT coalesce(string_agg(product ->> 'name', ' '), '')
+    FROM json_array_elements(products) AS product
+$$
+"""
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def create_search_index(target, connection, **kw):
+    if connection.dialect.name != "postgresql":
+        return
+
+    connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    connection.execute(text(PRODUCT_NAMES_FUNCTION))
+    connection.execute(text(
+        f"CREATE INDEX IF NOT EXISTS {SEARCH_INDEX} ON {target.name} "
+        "USING gin (receipt_product_names(products) gin_trgm_ops)"))
+
+
+def product_names(products_column):
+    return func.receipt_product_names(products_column)
+
+
+def matches(query: str, products_column):
+    # "<%" is the word similarity operator, it is answered by the trigram
+    # index and also matches a word inside a longer list of product names.
+    return literal(query).op("<%")(product_names(products_column))
+
+
+def rank(query: str, products_column):
+    return func.word_similarity(query, product_names(products_column))
+
+
+def after_cursor(cursor: str, rank_column, id_column):
+    rank_value, receipt_id = decode_cursor(cursor)
+    # The rank is a real, comparing it as a double would never be equal
+    return tuple_(rank_column, id_column) < tuple_(
+        cast(rank_value, REAL), receipt_id)
+
+
+def encode_cursor(rank_value: float, receipt_id) -> str:
+    data = json.dumps([rank_value, str(receipt_id)]).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        rank_value, receipt_id = json.loads(base64.urlsafe_b64decode(cursor))
+        return float(rank_value), uuid.UUID(str(receipt_id))
+    except (binascii.Error, TypeError, ValueError) as error:
+        raise InvalidCursorError(cursor) from error
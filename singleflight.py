@@ -0,0 +1,42 @@
+import asyncio
+import os
+from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+
+
+load_dotenv()
+
+SINGLE_FLIGHT_ENABLED = os.getenv(
+    "SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+
+class SingleFlight:
+    def __init__(self, enabled: bool = SINGLE_FLIGHT_ENABLED, wrap=None):
+        self.enabled = enabled
+        # applied to every function before it runs in the threadpool
+        self.wrap = wrap
+        self.calls = {}
+
+    async def run(self, key, func, *args):
+        if self.wrap is not None:
+            func = self.wrap(func)
+
+        # Without a key the call can't be shared, e.g. a streamed page whose
+        # rows can only be read once.
+        if not self.enabled or key is None:
+            return await run_in_threadpool(func, *args)
+
+        # Concurrent calls with the same key wait for the first one and get
+        # its result or exception, and the next call after it runs again.
+        call = self.calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(run_in_threadpool(func, *args))
+            self.calls[key] = call
+            call.add_done_callback(lambda _: self.forget(key, call))
+
+        # a waiter that goes away doesn't cancel the call for the others
+        return await asyncio.shield(call)
+
+    def forget(self, key, call):
+        if self.calls.get(key) is call:
+            del self.calls[key]
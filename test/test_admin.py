@@ -1,11 +1,32 @@
 from fastapi import status
 
+import gzip
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from exports import (
+    expire_exports,
+    export_path,
+    requeue_exports,
+    run_export,
+)
+from models import DeleteJobs, ExportJobs, ReceiptEvents
 from pagination import PageParams
-from routers.admin import get_db, get_current_user
+from routers.admin import (
+    ADMIN_EVENTS_MAX_LIMIT,
+    ADMIN_MAX_PAGE_SIZE,
+    get_db,
+    get_current_user,
+    resume_delete_jobs,
+)
+from routers.receipts import get_read_db
 from .utils import *
 
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
 app.dependency_overrides[get_current_user] = override_get_current_user
 
 page_params = PageParams(page=1, size=10)
@@ -42,12 +63,53 @@ def test_admin_get_all_receipts_authenticated(test_receipt):
              "payment": {"type": "cash", "amount": 40.00},
              "total": 37.71,
              "rest": 2.29,
-             "created_at": "2024-03-06T17:29:59.073344",
+             "created_at": "2024-03-06T17:29:59.073344Z",
              "owner_id": 1}
         ]
     }
 
 
+def test_admin_get_all_receipts_summary_view(test_receipt):
+    query_params = {
+        "page": page_params.page,
+        "size": page_params.size,
+        "view": "summary"
+    }
+    response = client.get("/admin/receipts", params=query_params)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["results"] == [{
+        "id": "daafa0dc-06bb-40fd-8472-c8fa6ed47a43",
+        "total": 37.71,
+        "created_at": "2024-03-06T17:29:59.073344Z",
+        "payment_type": "cash",
+        "items_count": 2,
+        "owner_id": 1
+    }]
+
+
+def test_admin_get_all_receipts_streamed(test_receipt):
+    response = client.get("/admin/receipts", params={"size": 1000})
+    assert response.status_code == status.HTTP_200_OK
+    # serialized from the cursor, so the length isn't known up front
+    assert "content-length" not in response.headers
+    assert response.json()["total_results"] == 1
+    assert len(response.json()["results"]) == 1
+
+
+def test_admin_get_all_receipts_page_out_of_range(test_receipt):
+    response = client.get("/admin/receipts", params={"page": 2, "size": 10})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_admin_get_all_receipts_page_size_above_maximum(test_receipt):
+    query_params = {
+        "page": page_params.page,
+        "size": ADMIN_MAX_PAGE_SIZE + 1
+    }
+    response = client.get("/admin/receipts", params=query_params)
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
 def test_admin_delete_receipt(test_receipt):
     response = client.delete(
         "/admin/receipt/daafa0dc-06bb-40fd-8472-c8fa6ed47a43")
@@ -65,3 +127,313 @@ def test_admin_delete_receipt_not_found(test_receipt):
     assert response.status_code == status.HTTP_404_NOT_FOUND
     assert response.json() == {
         "detail": "Receipt not found"}
+
+
+def bulk_delete(filters: dict) -> dict:
+    response = client.post("/admin/receipts/delete", json=filters)
+    assert response.status_code == status.HTTP_202_ACCEPTED
+
+    # the job has run as a background task once the response is received
+    response = client.get(f"/admin/receipts/delete/{response.json()['id']}")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["status"] == "completed"
+    return response.json()
+
+
+def test_admin_bulk_delete_receipts_by_ids(test_receipt):
+    delete_job = bulk_delete({
+        "ids": ["daafa0dc-06bb-40fd-8472-c8fa6ed47a43",
+                "11111111-1111-1111-1111-111111111111"]
+    })
+    assert delete_job["receipts_deleted"] == 1
+
+    db = TestingSessionLocal()
+    assert db.query(Receipts).count() == 0
+
+
+def test_admin_bulk_delete_receipts_by_filter(test_receipt):
+    delete_job = bulk_delete({"owner_id": 1, "payment_type": "cashless"})
+    assert delete_job["receipts_deleted"] == 0
+    assert delete_job["filters"] == {"owner_id": 1,
+                                     "payment_type": "cashless"}
+
+    delete_job = bulk_delete({"owner_id": 1,
+                              "created_before": "2024-03-07T00:00:00"})
+    assert delete_job["receipts_deleted"] == 1
+
+
+def test_admin_resume_delete_jobs_after_crash(test_receipt):
+    db = TestingSessionLocal()
+    stale = datetime.utcnow() - timedelta(hours=1)
+    delete_job = DeleteJobs(status="running", filters={"owner_id": 1},
+                            receipts_deleted=0, created_at=stale,
+                            started_at=stale, heartbeat_at=stale)
+    db.add(delete_job)
+    db.commit()
+
+    assert resume_delete_jobs(TestingSessionLocal) == [delete_job.id]
+
+    db = TestingSessionLocal()
+    delete_job = db.get(DeleteJobs, delete_job.id)
+    assert delete_job.status == "completed"
+    assert delete_job.receipts_deleted == 1
+    assert db.query(Receipts).count() == 0
+
+
+def test_admin_get_delete_job_not_found():
+    response = client.get(
+        "/admin/receipts/delete/11111111-1111-1111-1111-111111111111")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json() == {"detail": "Delete job not found"}
+
+
+def test_admin_bulk_delete_receipts_without_filters(test_receipt):
+    response = client.post("/admin/receipts/delete", json={})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_admin_get_receipt_events(test_receipt):
+    response = client.delete(
+        "/admin/receipt/daafa0dc-06bb-40fd-8472-c8fa6ed47a43")
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+
+    response = client.get("/admin/events", params={"after": 0})
+    assert response.status_code == status.HTTP_200_OK
+    events = response.json()["events"]
+    assert len(events) == 1
+    assert events[0]["event_type"] == "deleted"
+    assert events[0]["receipt_id"] == "daafa0dc-06bb-40fd-8472-c8fa6ed47a43"
+    assert response.json()["last_seq"] == events[0]["seq"]
+
+    last_seq = response.json()["last_seq"]
+    response = client.get("/admin/events", params={"after": last_seq})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"events": [], "last_seq": last_seq}
+
+
+def test_admin_consumer_offsets(test_receipt):
+    response = client.get("/admin/events/consumers/test-consumer")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json() == {"detail": "Consumer not found"}
+
+    client.delete("/admin/receipt/daafa0dc-06bb-40fd-8472-c8fa6ed47a43")
+    response = client.get("/admin/events",
+                          params={"consumer": "test-consumer"})
+    assert len(response.json()["events"]) == 1
+    last_seq = response.json()["last_seq"]
+
+    response = client.put("/admin/events/consumers/test-consumer",
+                          json={"last_seq": last_seq})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["last_seq"] == last_seq
+
+    response = client.get("/admin/events",
+                          params={"consumer": "test-consumer"})
+    assert response.json() == {"events": [], "last_seq": last_seq}
+
+
+def add_receipt_event(txid: int) -> int:
+    db = TestingSessionLocal()
+    receipt_event = ReceiptEvents(event_type="created", receipt_id=uuid.uuid4(),
+                                  owner_id=1, payload={}, txid=txid)
+    db.add(receipt_event)
+    db.commit()
+    return receipt_event.seq
+
+
+def test_admin_get_receipt_events_committed_out_of_seq_order():
+    # the first event belongs to a transaction that is still running
+    running_seq = add_receipt_event(2 ** 62)
+    committed_seq = add_receipt_event(3)
+    assert running_seq < committed_seq
+
+    response = client.get("/admin/events", params={"after": 0})
+    assert [event["seq"] for event in response.json()["events"]] == \
+        [committed_seq]
+    last_seq = response.json()["last_seq"]
+
+    # it commits after the consumer has read past its seq
+    db = TestingSessionLocal()
+    db.query(ReceiptEvents).filter(ReceiptEvents.seq == running_seq)\
+        .update({"txid": 4})
+    db.commit()
+
+    response = client.get("/admin/events", params={"after": last_seq})
+    assert [event["seq"] for event in response.json()["events"]] == \
+        [running_seq]
+
+
+def test_admin_get_receipt_events_limit_above_maximum():
+    response = client.get("/admin/events",
+                          params={"limit": ADMIN_EVENTS_MAX_LIMIT + 1})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_admin_bulk_render_receipts_stream(test_receipt):
+    response = client.post("/admin/receipts/render", json={
+        "owner_id": 1, "format": "text", "width": 30})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "ФОП TEST USER" in response.text
+    assert "sparkling water          16.95" in response.text
+
+
+@pytest.fixture()
+def export_dir(tmp_path, monkeypatch):
+    # runs the export right away instead of in the export pool
+    monkeypatch.setattr(
+        "routers.admin.submit_export",
+        lambda job_id, session_factory: run_export(job_id, session_factory,
+                                                   str(tmp_path)))
+    return tmp_path
+
+
+def test_admin_bulk_render_receipts_to_file(test_receipt, export_dir):
+    response = client.post("/admin/receipts/render", json={
+        "ids": ["daafa0dc-06bb-40fd-8472-c8fa6ed47a43"],
+        "format": "escpos", "width": 32, "output": "file"})
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.json()["format"] == "escpos"
+    assert response.json()["width"] == 32
+    job_id = response.json()["id"]
+
+    response = client.get(f"/admin/exports/{job_id}")
+    assert response.json()["status"] == "completed"
+    assert response.json()["rows_written"] == 1
+
+    response = client.get(f"/admin/exports/{job_id}/download")
+    assert response.status_code == status.HTTP_200_OK
+    assert gzip.decompress(response.content).startswith(b"\x1b@\x1bt")
+
+
+def test_admin_bulk_render_receipts_without_filters():
+    response = client.post("/admin/receipts/render", json={"format": "text"})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_admin_export_receipts(test_receipt, export_dir):
+    response = client.post("/admin/exports", json={"format": "ndjson",
+                                                   "owner_id": 1})
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    job_id = response.json()["id"]
+
+    response = client.get(f"/admin/exports/{job_id}")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["status"] == "completed"
+    assert response.json()["rows_written"] == 1
+    assert response.json()["progress"] == 1.0
+    assert response.json()["filters"] == {"owner_id": 1}
+
+    response = client.get(f"/admin/exports/{job_id}/download")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["accept-ranges"] == "bytes"
+    content = response.content
+    receipt = json.loads(gzip.decompress(content))
+    assert receipt["id"] == "daafa0dc-06bb-40fd-8472-c8fa6ed47a43"
+    assert receipt["total"] == 37.71
+
+    response = client.get(f"/admin/exports/{job_id}/download",
+                          headers={"Range": "bytes=10-"})
+    assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+    assert response.headers["content-range"] == \
+        f"bytes 10-{len(content) - 1}/{len(content)}"
+    assert response.content == content[10:]
+
+    response = client.get(f"/admin/exports/{job_id}/download",
+                          headers={"Range": f"bytes={len(content)}-"})
+    assert response.status_code == \
+        status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+
+
+def test_admin_export_receipts_csv(test_receipt, export_dir):
+    response = client.post("/admin/exports", json={
+        "format": "csv", "created_before": "2024-01-01T00:00:00Z"})
+    job_id = response.json()["id"]
+
+    response = client.get(f"/admin/exports/{job_id}")
+    assert response.json()["rows_total"] == 0
+
+    response = client.get(f"/admin/exports/{job_id}/download")
+    assert gzip.decompress(response.content).decode().splitlines() == [
+        "id,created_at,payment_type,payment_amount,products,total,rest,"
+        "owner_id"]
+
+
+def test_admin_export_not_completed(export_dir, monkeypatch):
+    monkeypatch.setattr("routers.admin.submit_export",
+                        lambda job_id, session_factory: None)
+    response = client.post("/admin/exports", json={"format": "csv"})
+    job_id = response.json()["id"]
+    assert response.json()["status"] == "pending"
+    assert response.json()["progress"] is None
+
+    response = client.get(f"/admin/exports/{job_id}/download")
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert response.json() == {"detail": "Export not completed"}
+
+
+def test_admin_export_not_found():
+    response = client.get(
+        "/admin/exports/11111111-1111-1111-1111-111111111111")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json() == {"detail": "Export not found"}
+
+
+def test_admin_export_stale_running_job_requeued(test_receipt, tmp_path,
+                                                  monkeypatch):
+    monkeypatch.setattr(
+        "exports.submit_export",
+        lambda job_id, session_factory: run_export(job_id, session_factory,
+                                                   str(tmp_path)))
+    stale = datetime.utcnow() - timedelta(hours=1)
+    job_id = uuid.uuid4()
+    db = TestingSessionLocal()
+    db.add(ExportJobs(id=job_id, status="running", format="ndjson",
+                      filters={}, rows_written=1, created_by=1,
+                      created_at=stale, started_at=stale, heartbeat_at=stale))
+    db.commit()
+    # left behind by the interrupted run
+    partial_path = export_path(job_id, "ndjson", str(tmp_path)) + ".part"
+    with open(partial_path, "wb") as partial_file:
+        partial_file.write(b"truncated")
+
+    assert requeue_exports(TestingSessionLocal) == [job_id]
+
+    response = client.get(f"/admin/exports/{job_id}")
+    assert response.json()["status"] == "completed"
+    assert response.json()["rows_written"] == 1
+    assert not os.path.exists(partial_path)
+    response = client.get(f"/admin/exports/{job_id}/download")
+    assert json.loads(gzip.decompress(response.content))["id"] == \
+        "daafa0dc-06bb-40fd-8472-c8fa6ed47a43"
+
+
+def test_admin_export_running_job_not_requeued(monkeypatch):
+    monkeypatch.setattr("exports.submit_export",
+                        lambda job_id, session_factory: None)
+    db = TestingSessionLocal()
+    db.add(ExportJobs(status="running", format="csv", filters={},
+                      rows_written=0, created_by=1,
+                      heartbeat_at=datetime.utcnow()))
+    db.commit()
+    assert requeue_exports(TestingSessionLocal) == []
+
+
+def test_admin_export_expired(test_receipt, export_dir):
+    response = client.post("/admin/exports", json={"format": "csv"})
+    job_id = response.json()["id"]
+    assert expire_exports(TestingSessionLocal) == []
+
+    db = TestingSessionLocal()
+    export_job = db.get(ExportJobs, uuid.UUID(job_id))
+    path = export_job.path
+    export_job.finished_at = datetime.utcnow() - timedelta(days=2)
+    db.commit()
+    assert expire_exports(TestingSessionLocal) == [uuid.UUID(job_id)]
+    assert not os.path.exists(path)
+
+    response = client.get(f"/admin/exports/{job_id}")
+    assert response.json()["status"] == "expired"
+    response = client.get(f"/admin/exports/{job_id}/download")
+    assert response.status_code == status.HTTP_410_GONE
+    assert response.json() == {"detail": "Export expired"}
@@ -1,5 +1,5 @@
 import pytest
-from datetime import timedelta
+from datetime import datetime, timedelta
 from fastapi import HTTPException, status
 from jose import jwt
 
@@ -77,10 +77,26 @@ async def test_get_current_user_valid_token():
         "is_admin": True
     }
     token = jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
-    user = await get_current_user(token=token)
+    user = await get_current_user(token=token, db=TestingSessionLocal())
     assert user == {"username": "testuser", "id": 1, "is_admin": True}
 
 
+@pytest.mark.asyncio
+async def test_get_current_user_deleted_user(test_user):
+    db = TestingSessionLocal()
+    db.query(Users).filter(Users.id == 1).update(
+        {"deleted_at": datetime.utcnow()})
+    db.commit()
+
+    token = jwt.encode({"sub": "testuser", "id": 1, "is_admin": True},
+                       SECRET_KEY, algorithm=ALGORITHM)
+    with pytest.raises(HTTPException) as excinfo:
+        await get_current_user(token=token, db=TestingSessionLocal())
+
+    assert excinfo.value.status_code == status.HTTP_401_UNAUTHORIZED
+    assert excinfo.value.detail == "Could not validate the user"
+
+
 @pytest.mark.asyncio
 async def test_get_current_user_missing_username_in_payload():
     encode = {
@@ -90,7 +106,7 @@ async def test_get_current_user_missing_username_in_payload():
     token = jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
     with pytest.raises(HTTPException) as excinfo:
-        await get_current_user(token=token)
+        await get_current_user(token=token, db=TestingSessionLocal())
 
     assert excinfo.value.status_code == status.HTTP_401_UNAUTHORIZED
     assert excinfo.value.detail == "Could not validate the user"
@@ -105,7 +121,7 @@ async def test_get_current_user_missing_user_id_in_payload():
     token = jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
     with pytest.raises(HTTPException) as excinfo:
-        await get_current_user(token=token)
+        await get_current_user(token=token, db=TestingSessionLocal())
 
     assert excinfo.value.status_code == status.HTTP_401_UNAUTHORIZED
     assert excinfo.value.detail == "Could not validate the user"
@@ -119,7 +135,7 @@ async def test_get_current_user_missing_payload():
     token = jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
     with pytest.raises(HTTPException) as excinfo:
-        await get_current_user(token=token)
+        await get_current_user(token=token, db=TestingSessionLocal())
 
     assert excinfo.value.status_code == status.HTTP_401_UNAUTHORIZED
     assert excinfo.value.detail == "Could not validate the user"
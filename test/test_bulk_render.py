@@ -0,0 +1,29 @@
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+
+from bulk_render import render_chunks, render_in_pool
+from rendering import render_receipt
+from .test_rendering import receipt
+
+
+@pytest.fixture(scope="module")
+def pool():
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        yield pool
+
+
+@pytest.mark.asyncio
+async def test_render_chunks_keeps_batch_order(pool):
+    batches = [[{**receipt, "issuer": f"ФОП USER {i}"}] for i in range(5)]
+    chunks = [chunk async for chunk in render_chunks(
+        batches, "text", 30, pool, max_pending=2)]
+    assert chunks == [render_receipt(batch[0], "text", 30) + "\n"
+                      for batch in batches]
+
+
+def test_render_in_pool_keeps_batch_order(pool):
+    batches = [[{**receipt, "issuer": f"ФОП USER {i}"}] * (i + 1)
+               for i in range(5)]
+    chunks = list(render_in_pool(batches, "escpos", 30, pool, max_pending=2))
+    assert chunks == [(len(batch), render_receipt(batch[0], "escpos", 30)
+                       * len(batch)) for batch in batches]
@@ -0,0 +1,119 @@
+import asyncio
+import gzip
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+from compression import CompressionMiddleware, brotli, select_encoding
+
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware, minimum_size=500)
+
+large_body = "receipt " * 1000
+
+
+@app.get("/small")
+def small():
+    return PlainTextResponse("small")
+
+
+@app.get("/large")
+def large():
+    return PlainTextResponse(large_body)
+
+
+@app.get("/archive")
+def archive():
+    return Response(gzip.compress(large_body.encode()),
+                    media_type="application/gzip")
+
+
+@app.get("/stream")
+def stream():
+    return StreamingResponse(iter([large_body, large_body]),
+                             media_type="text/plain")
+
+
+client = TestClient(app)
+
+
+def test_compression_skips_small_responses():
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.text == "small"
+
+
+def test_compression_gzip_large_response():
+    response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) < len(large_body)
+    assert response.text == large_body
+
+
+@pytest.mark.asyncio
+async def test_compression_sends_event_stream_headers_at_once():
+    messages = []
+    started_before_body = asyncio.Event()
+
+    async def send(message):
+        messages.append(message)
+
+    async def event_stream(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream")]})
+        if messages:
+            started_before_body.set()
+        await send({"type": "http.response.body", "body": b": keepalive\n\n",
+                    "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    middleware = CompressionMiddleware(event_stream, minimum_size=0)
+    await middleware({"type": "http", "headers": [(b"accept-encoding",
+                                                   b"gzip")]},
+                     None, send)
+
+    assert started_before_body.is_set()
+    assert b"content-encoding" not in dict(messages[0]["headers"])
+    assert messages[1]["body"] == b": keepalive\n\n"
+
+
+def test_compression_streaming_response():
+    response = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert response.text == large_body * 2
+
+
+def test_compression_skips_compressed_media_types():
+    response = client.get("/archive", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert gzip.decompress(response.content).decode() == large_body
+
+
+def test_compression_not_accepted():
+    response = client.get("/large", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.text == large_body
+
+
+def test_compression_streamed_chunks_form_one_gzip_stream():
+    with client.stream("GET", "/stream",
+                       headers={"Accept-Encoding": "gzip"}) as response:
+        raw = b"".join(response.iter_raw())
+    assert gzip.decompress(raw).decode() == large_body * 2
+
+
+def test_select_encoding():
+    assert select_encoding("gzip, deflate") == "gzip"
+    assert select_encoding("gzip;q=0") is None
+    assert select_encoding("") is None
+
+
+@pytest.mark.skipif(brotli is None, reason="brotli is not installed")
+def test_compression_brotli_preferred():
+    response = client.get("/large", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["content-encoding"] == "br"
+    assert response.text == large_body
@@ -0,0 +1,56 @@
+from fastapi import Response
+from sqlalchemy.orm import sessionmaker
+
+import database
+from routers import auth
+
+
+replica_session_local = sessionmaker(info={"replica": True})
+
+
+def test_get_read_session_without_replicas(monkeypatch):
+    monkeypatch.setattr(database, "ReplicaSessionLocals", [])
+    db = database.get_read_session()
+    assert not db.info.get("replica")
+    db.close()
+
+
+def test_get_read_session_uses_replica(monkeypatch):
+    monkeypatch.setattr(database, "ReplicaSessionLocals",
+                        [replica_session_local])
+    db = database.get_read_session()
+    assert db.info.get("replica")
+    db.close()
+
+
+def test_get_read_session_reads_own_writes_from_primary(monkeypatch):
+    monkeypatch.setattr(database, "ReplicaSessionLocals",
+                        [replica_session_local])
+    db = database.get_read_session(recently_written=True)
+    assert not db.info.get("replica")
+    db.close()
+
+
+def last_write_marker(user_id: int) -> str:
+    response = Response()
+    auth.record_write(response, user_id)
+    cookie = response.headers["set-cookie"]
+    assert cookie.startswith(f"{auth.LAST_WRITE_COOKIE}=")
+    return cookie.split(";")[0].split("=", 1)[1]
+
+
+def test_last_write_cookie(monkeypatch):
+    monkeypatch.setattr(auth, "SECRET_KEY", "test-secret")
+    monkeypatch.setattr(auth, "ALGORITHM", "HS256")
+    marker = last_write_marker(1)
+    assert auth.wrote_recently(marker, 1)
+    assert not auth.wrote_recently(marker, 2)
+    assert not auth.wrote_recently(None, 1)
+    assert not auth.wrote_recently(marker[:-2], 1)
+
+
+def test_last_write_cookie_after_stickiness_window(monkeypatch):
+    monkeypatch.setattr(auth, "SECRET_KEY", "test-secret")
+    monkeypatch.setattr(auth, "ALGORITHM", "HS256")
+    monkeypatch.setattr(auth, "READ_YOUR_WRITES_SECONDS", -1)
+    assert not auth.wrote_recently(last_write_marker(1), 1)
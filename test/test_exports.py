@@ -0,0 +1,29 @@
+import pytest
+
+from exports import RangeNotSatisfiableError, parse_range, read_file_range
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=50-500", 100) == (50, 99)
+    # unsupported ranges get the whole file
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    assert parse_range("items=0-1", 100) is None
+    assert parse_range("bytes=a-b", 100) is None
+    assert parse_range("bytes=5", 100) is None
+
+
+def test_parse_range_not_satisfiable():
+    with pytest.raises(RangeNotSatisfiableError):
+        parse_range("bytes=100-", 100)
+    with pytest.raises(RangeNotSatisfiableError):
+        parse_range("bytes=9-3", 100)
+
+
+def test_read_file_range(tmp_path):
+    path = tmp_path / "export.gz"
+    path.write_bytes(bytes(range(200)))
+    assert b"".join(read_file_range(str(path), 10, 149, chunk_size=16)) == \
+        bytes(range(10, 150))
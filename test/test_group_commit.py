@@ -0,0 +1,76 @@
+import asyncio
+import pytest
+
+from group_commit import GroupCommitBuffer
+
+
+class FakeSession:
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def buffer_writing(written: list, **options):
+    def write_rows(db, rows):
+        if any(row.get("bad") for row in rows):
+            raise ValueError("bad row")
+        written.extend(rows)
+        return [row["n"] for row in rows]
+
+    return GroupCommitBuffer(write_rows, FakeSession, **options)
+
+
+@pytest.mark.asyncio
+async def test_group_commit_batches_rows():
+    written = []
+    buffer = buffer_writing(written, max_rows=10, max_delay_ms=20)
+    results = await asyncio.gather(*(buffer.submit({"n": n})
+                                     for n in range(3)))
+    assert results == [0, 1, 2]
+    assert written == [{"n": 0}, {"n": 1}, {"n": 2}]
+    await buffer.close()
+
+
+@pytest.mark.asyncio
+async def test_group_commit_failing_row_only_fails_its_caller():
+    buffer = buffer_writing([], max_rows=10, max_delay_ms=20)
+    results = await asyncio.gather(buffer.submit({"n": 1}),
+                                   buffer.submit({"n": 2, "bad": True}),
+                                   return_exceptions=True)
+    assert results[0] == 1
+    assert isinstance(results[1], ValueError)
+    await buffer.close()
+
+
+@pytest.mark.asyncio
+async def test_group_commit_cancelled_caller_keeps_flusher_running():
+    written = []
+    buffer = buffer_writing(written, max_rows=10, max_delay_ms=50)
+    cancelled = asyncio.ensure_future(buffer.submit({"n": 1}))
+    waiting = asyncio.ensure_future(buffer.submit({"n": 2}))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+
+    assert await waiting == 2
+    assert not buffer.flusher.done()
+    assert await buffer.submit({"n": 3}) == 3
+    assert [row["n"] for row in written] == [1, 2, 3]
+    await buffer.close()
+
+
+@pytest.mark.asyncio
+async def test_group_commit_restarted_flusher_keeps_queued_rows():
+    buffer = buffer_writing([], max_rows=10, max_delay_ms=20)
+    assert await buffer.submit({"n": 1}) == 1
+    buffer.flusher.cancel()
+    await asyncio.sleep(0)
+
+    # a row left behind by the stopped flusher is written by the next one
+    loop = asyncio.get_running_loop()
+    stranded = loop.create_future()
+    buffer.queue.append(({"n": 2}, stranded))
+    assert await buffer.submit({"n": 3}) == 3
+    assert await stranded == 2
+    await buffer.close()
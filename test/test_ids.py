@@ -0,0 +1,37 @@
+import time
+
+import ids
+from ids import uuid7
+
+
+def test_uuid7_version_and_timestamp():
+    before = time.time_ns() // 1_000_000
+    receipt_id = uuid7()
+    after = time.time_ns() // 1_000_000
+
+    assert receipt_id.version == 7
+    assert before <= receipt_id.int >> 80 <= after
+
+
+def test_uuid7_is_strictly_increasing():
+    receipt_ids = [uuid7() for _ in range(10000)]
+    assert receipt_ids == sorted(receipt_ids)
+    assert len(set(receipt_ids)) == len(receipt_ids)
+    # Postgres compares UUIDs byte by byte, which is the text order
+    assert [str(receipt_id) for receipt_id in receipt_ids] == \
+        sorted(str(receipt_id) for receipt_id in receipt_ids)
+
+
+def test_uuid7_when_clock_goes_back(monkeypatch):
+    first = uuid7()
+    monkeypatch.setattr(ids.time, "time_ns", lambda: 0)
+    assert uuid7() > first
+
+
+def test_uuid7_for_given_time():
+    latest = uuid7()
+    receipt_id = uuid7(timestamp_ns=1_700_000_000_123_456_789)
+    assert receipt_id.version == 7
+    assert receipt_id.int >> 80 == 1_700_000_000_123
+    # ids for a given time don't move the sequence of the process
+    assert uuid7() > latest
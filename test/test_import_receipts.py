@@ -0,0 +1,116 @@
+import json
+
+from import_receipts import (
+    import_name,
+    import_receipts,
+    parse_record,
+    receipt_from_record,
+)
+from models import ReceiptEvents, ReceiptImports
+from .utils import *
+
+
+csv_content = (
+    "id,created_at,payment_type,payment_amount,products\n"
+    "adde4288-e187-42ef-8819-ec07def03ddf,2023-05-01T10:00:00,cash,40,"
+    "\"[{\"\"name\"\": \"\"Bar of chocolate\"\", \"\"price\"\": 10.38, "
+    "\"\"quantity\"\": 2}]\"\n"
+    ",2023-06-15T12:30:00+03:00,cashless,3.5,"
+    "\"[{\"\"name\"\": \"\"Milk\"\", \"\"price\"\": 1.75, "
+    "\"\"quantity\"\": 2}]\"\n"
+    ",,cash,1,\"[]\"\n"
+)
+
+
+@pytest.fixture()
+def receipts_file(tmp_path):
+    path = tmp_path / "receipts.csv"
+    path.write_text(csv_content, encoding="utf-8")
+    return path
+
+
+def test_receipt_from_record_computes_totals():
+    receipt = receipt_from_record(parse_record(json.dumps({
+        "created_at": "2023-05-01T10:00:00Z",
+        "products": [{"name": "Milk", "price": 1.75, "quantity": 3}],
+        "payment": {"type": "cash", "amount": 10},
+    }), "ndjson"), 1)
+    assert str(receipt["total"]) == "5.25"
+    assert str(receipt["rest"]) == "4.75"
+    assert receipt["products"][0]["total"] == 5.25
+    assert receipt["id"].version == 7
+
+
+def test_import_receipts(test_receipt, receipts_file):
+    imported, rejected = import_receipts(str(receipts_file), 1, chunk_size=2,
+                                         bind=engine)
+    assert (imported, rejected) == (2, 1)
+
+    db = TestingSessionLocal()
+    receipt = db.query(Receipts).filter(
+        Receipts.id == "adde4288-e187-42ef-8819-ec07def03ddf").first()
+    assert float(receipt.total) == 20.76
+    assert float(receipt.rest) == 19.24
+    assert db.query(Receipts).filter(Receipts.total == 3.5).count() == 1
+    assert db.query(ReceiptEvents).count() == 2
+
+    checkpoint = db.query(ReceiptImports).filter(
+        ReceiptImports.name == import_name(str(receipts_file))).first()
+    assert (checkpoint.position, checkpoint.imported, checkpoint.rejected) \
+        == (3, 2, 1)
+
+    with open(f"{receipts_file}.errors.ndjson", encoding="utf-8") as errors:
+        error = json.loads(errors.readline())
+    assert error["row"] == 3
+    assert error["error"] == "created_at is required"
+
+
+def test_import_receipts_resumes_from_checkpoint(test_receipt, receipts_file):
+    import_receipts(str(receipts_file), 1, chunk_size=2, bind=engine)
+    # a finished import has nothing left to load
+    assert import_receipts(str(receipts_file), 1, bind=engine) == (2, 1)
+
+    db = TestingSessionLocal()
+    assert db.query(Receipts).count() == 3
+
+
+def test_receipt_from_record_converts_created_at_to_utc():
+    receipt = receipt_from_record(parse_record(json.dumps({
+        "created_at": "2023-06-30T23:30:00-02:00",
+        "products": [{"name": "Milk", "price": 1.75, "quantity": 1}],
+        "payment": {"type": "cash", "amount": 2},
+    }), "ndjson"), 1)
+    assert receipt["created_at"].isoformat() == "2023-07-01T01:30:00+00:00"
+
+
+def test_import_receipts_rejects_existing_ids(test_receipt, tmp_path):
+    path = tmp_path / "receipts.csv"
+    row = ",cash,1,\"[{\"\"name\"\": \"\"Milk\"\", \"\"price\"\": 1, " \
+          "\"\"quantity\"\": 1}]\"\n"
+    path.write_text(
+        "id,created_at,payment_type,payment_amount,products\n"
+        # the id of test_receipt with another created_at
+        f"daafa0dc-06bb-40fd-8472-c8fa6ed47a43,2023-05-01T10:00:00{row}"
+        f"adde4288-e187-42ef-8819-ec07def03ddf,2023-05-01T10:00:00{row}"
+        f"adde4288-e187-42ef-8819-ec07def03ddf,2023-05-01T10:00:00{row}"
+        f"adde4288-e187-42ef-8819-ec07def03ddf,2023-05-02T10:00:00{row}",
+        encoding="utf-8")
+    assert import_receipts(str(path), 1, chunk_size=3, bind=engine) == (1, 3)
+
+    db = TestingSessionLocal()
+    assert db.query(Receipts).count() == 2
+    with open(f"{path}.errors.ndjson", encoding="utf-8") as errors:
+        assert [json.loads(error)["row"] for error in errors] == [1, 3, 4]
+
+
+def test_import_receipts_same_name_other_file(test_receipt, receipts_file,
+                                              tmp_path):
+    import_receipts(str(receipts_file), 1, bind=engine)
+
+    other_file = tmp_path / "other" / "receipts.csv"
+    other_file.parent.mkdir()
+    other_file.write_text(csv_content.replace(
+        "adde4288-e187-42ef-8819-ec07def03ddf",
+        "0b8f1f5e-3f0a-4a8e-9c7e-2b1d5f7e9a10"), encoding="utf-8")
+    # starts from the first row instead of the other file's checkpoint
+    assert import_receipts(str(other_file), 1, bind=engine) == (2, 1)
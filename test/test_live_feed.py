@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+
+from live_feed import ReceiptFeed, format_event, stream_events
+
+
+def test_format_event():
+    assert format_event(7, {"id": "a"}) == \
+        'id: 7\nevent: receipt\ndata: {"id": "a"}\n\n'
+
+
+@pytest.mark.asyncio
+async def test_receipt_feed_fans_out_per_owner():
+    feed = ReceiptFeed()
+    first = feed.subscribe(1)
+    second = feed.subscribe(1)
+    other = feed.subscribe(2)
+
+    feed.publish(1, 5, {"id": "a"})
+
+    assert first.get_nowait() == (5, {"id": "a"})
+    assert second.get_nowait() == (5, {"id": "a"})
+    assert other.empty()
+
+    feed.unsubscribe(1, first)
+    feed.unsubscribe(1, second)
+    assert 1 not in feed.subscribers
+
+
+@pytest.mark.asyncio
+async def test_receipt_feed_disconnects_slow_subscriber():
+    feed = ReceiptFeed(queue_size=2)
+    queue = feed.subscribe(1)
+
+    for seq in range(3):
+        feed.publish(1, seq, {})
+
+    assert queue.get_nowait() is None
+    assert 1 not in feed.subscribers
+
+
+def outbox(seqs):
+    # events in the order the outbox hands them out, not by seq
+    async def load_events(after):
+        start = seqs.index(after) + 1 if after in seqs else 0
+        return [(seq, {"seq": seq}) for seq in seqs[start:]]
+    return load_events
+
+
+@pytest.mark.asyncio
+async def test_stream_events_replays_then_follows_live_events():
+    feed = ReceiptFeed()
+    seqs = [3, 4]
+    stream = stream_events(feed, 1, 2, outbox(seqs), keepalive=1)
+
+    assert await anext(stream) == format_event(3, {"seq": 3})
+    assert await anext(stream) == format_event(4, {"seq": 4})
+
+    # already replayed events are not sent again
+    feed.publish(1, 4, {"seq": 4})
+    seqs.append(6)
+    feed.publish(1, 6, {"seq": 6})
+    assert await anext(stream) == format_event(6, {"seq": 6})
+
+    # an event with a smaller seq that committed later still follows
+    seqs.append(5)
+    feed.publish(1, 5, {"seq": 5})
+    assert await anext(stream) == format_event(5, {"seq": 5})
+
+    await stream.aclose()
+    assert feed.subscribers == {}
+
+
+@pytest.mark.asyncio
+async def test_stream_events_sends_events_once_readable():
+    feed = ReceiptFeed()
+    seqs = [3]
+    stream = stream_events(feed, 1, 3, outbox(seqs), keepalive=0.01)
+
+    # published while an older transaction was still running
+    feed.publish(1, 4, {"seq": 4})
+    assert await anext(stream) == ": keepalive\n\n"
+
+    seqs.append(4)
+    assert await anext(stream) == format_event(4, {"seq": 4})
+    await stream.aclose()
+
+
+@pytest.mark.asyncio
+async def test_stream_events_sends_keepalive():
+    feed = ReceiptFeed()
+    stream = stream_events(feed, 1, keepalive=0.01)
+
+    assert await anext(stream) == ": keepalive\n\n"
+    await stream.aclose()
@@ -0,0 +1,34 @@
+from decimal import Decimal
+
+from money import compute_receipt, line_total, line_totals, receipt_totals
+
+
+def test_line_total_rounds_half_up():
+    assert line_total(1.005, 1) == Decimal("1.01")
+    assert line_total(10.38, 2.0) == Decimal("20.76")
+
+
+def test_line_totals():
+    assert line_totals([10.38, 5.65], [2, 3]) == [Decimal("20.76"),
+                                                  Decimal("16.95")]
+
+
+def test_receipt_totals_without_float_drift():
+    products = [{"name": "Item", "price": 0.1, "quantity": 1}] * 3
+    totals, total, rest = receipt_totals(products, 1)
+    assert totals == [Decimal("0.10")] * 3
+    assert total == Decimal("0.30")
+    assert rest == Decimal("0.70")
+
+
+def test_compute_receipt():
+    receipt = compute_receipt({
+        "products": [
+            {"name": "Bar of chocolate", "price": 20.00, "quantity": 2},
+            {"name": "Bottle of sparkling water", "price": 5.00, "quantity": 3},
+        ],
+        "payment": {"type": "cash", "amount": 60.00},
+    })
+    assert [product["total"] for product in receipt["products"]] == [40.0, 15.0]
+    assert receipt["total"] == Decimal("55.00")
+    assert receipt["rest"] == Decimal("5.00")
@@ -0,0 +1,74 @@
+from page_cache import MemoryCacheBackend, PageCache, SqliteCacheBackend
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryCacheBackend(max_bytes=10)
+    backend.set("a", "aaaa", 60)
+    backend.set("b", "bbbb", 60)
+    assert backend.get("a") == "aaaa"
+    backend.set("c", "cccc", 60)
+    assert backend.get("b") is None
+    assert backend.get("a") == "aaaa"
+    assert backend.size == 8
+
+
+def test_memory_backend_expires_entries():
+    backend = MemoryCacheBackend()
+    backend.set("a", "aaaa", 0)
+    assert backend.get("a") is None
+    assert backend.size == 0
+
+
+def test_page_cache_write_changes_key():
+    cache = PageCache(MemoryCacheBackend())
+    key = cache.key(1, ["/receipts", 1, 50, "full"])
+    cache.set(key, "page")
+    assert cache.get(cache.key(1, ["/receipts", 1, 50, "full"])) == "page"
+
+    cache.invalidate(2)
+    assert cache.key(1, ["/receipts", 1, 50, "full"]) == key
+
+    cache.invalidate(1)
+    assert cache.get(cache.key(1, ["/receipts", 1, 50, "full"])) is None
+
+    key = cache.key(1, ["/receipts", 1, 50, "full"])
+    cache.invalidate_all()
+    assert cache.key(1, ["/receipts", 1, 50, "full"]) != key
+
+
+def test_sqlite_backend_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    first = PageCache(SqliteCacheBackend(path))
+    second = PageCache(SqliteCacheBackend(path))
+
+    key = first.key(1, ["/receipts"])
+    first.set(key, "page")
+    assert second.get(second.key(1, ["/receipts"])) == "page"
+
+    second.invalidate(1)
+    assert first.get(first.key(1, ["/receipts"])) is None
+
+
+def test_sqlite_backend_evicts_least_recently_used(tmp_path):
+    backend = SqliteCacheBackend(str(tmp_path / "cache.sqlite3"), max_bytes=10)
+    backend.set("a", "aaaa", 60)
+    backend.set("b", "bbbb", 60)
+    assert backend.get("a") == "aaaa"
+    backend.set("c", "cccc", 60)
+    assert backend.get("b") is None
+    assert backend.get("a") == "aaaa"
+    assert backend.get("c") == "cccc"
+
+
+def test_page_cache_remembers_recent_writes():
+    cache = PageCache(MemoryCacheBackend(), write_window=60)
+    assert not cache.recently_written(1)
+    cache.invalidate(1)
+    assert cache.recently_written(1)
+    assert not cache.recently_written(2)
+    cache.invalidate_all()
+    assert cache.recently_written(2)
+
+    cache = PageCache(MemoryCacheBackend(), write_window=0)
+    cache.invalidate(1)
+    assert not cache.recently_written(1)
@@ -0,0 +1,124 @@
+import json
+import tracemalloc
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+import pagination
+from pagination import (
+    PagedResponseSchema,
+    PagedStreamingResponse,
+    PageParams,
+    get_page_params,
+    paginate,
+)
+from routers.receipts import ReceiptSchema
+
+
+def receipt_row(number: int) -> dict:
+    return {
+        "id": uuid.UUID(int=number),
+        "products": [{"name": f"Product {number}", "price": 10.38,
+                      "quantity": 2.0, "total": 20.76}],
+        "payment": {"type": "cash", "amount": 40.0},
+        "total": 20.76,
+        "rest": 19.24,
+        "created_at": datetime(2024, 3, 6, tzinfo=timezone.utc),
+        "owner_id": 1,
+    }
+
+
+def streamed_page(size: int) -> PagedStreamingResponse:
+    return PagedStreamingResponse(
+        total_results=size, page=1, pages=1, size=size,
+        results=(receipt_row(number) for number in range(size)),
+        ResponseSchema=ReceiptSchema)
+
+
+def test_streamed_page_matches_built_page():
+    rows = [receipt_row(number) for number in range(3)]
+    built = PagedResponseSchema[ReceiptSchema](
+        total_results=3, page=1, pages=1, size=3, results=rows)
+
+    streamed = "".join(streamed_page(3).chunks)
+    assert json.loads(streamed) == json.loads(built.model_dump_json())
+
+
+class RowsQuery:
+    # the parts of a query paginate uses
+    def __init__(self, rows):
+        self.rows = rows
+        self.session = SimpleNamespace(close=lambda: None)
+
+    def count(self):
+        return len(self.rows)
+
+    def offset(self, offset: int):
+        return RowsQuery(self.rows[offset:])
+
+    def limit(self, limit: int):
+        return RowsQuery(self.rows[:limit])
+
+    def all(self):
+        return self.rows
+
+    def yield_per(self, count: int):
+        return iter(self.rows)
+
+
+def test_oversized_page_streamed_by_endpoint(monkeypatch):
+    monkeypatch.setattr(pagination, "STREAM_OVERSIZED_PAGES", True)
+    query = RowsQuery([receipt_row(number) for number in range(5)])
+    app = FastAPI()
+
+    @app.get("/streamed")
+    def streamed(page_params: PageParams = Depends(
+            get_page_params(max_size=2))):
+        return paginate(page_params, query, ReceiptSchema)
+
+    @app.get("/built")
+    def built(page_params: PageParams = Depends(
+            get_page_params(max_size=10))):
+        return paginate(page_params, query, ReceiptSchema)
+
+    client = TestClient(app)
+    for page in (1, 2):
+        params = {"page": page, "size": 3}
+        streamed_response = client.get("/streamed", params=params)
+        assert streamed_response.status_code == 200
+        assert "content-length" not in streamed_response.headers
+        built_response = client.get("/built", params=params)
+        assert "content-length" in built_response.headers
+        assert streamed_response.json() == built_response.json()
+    assert len(streamed_response.json()["results"]) == 2
+
+
+def test_streamed_page_of_no_rows():
+    assert json.loads("".join(streamed_page(0).chunks))["results"] == []
+
+
+def test_streamed_page_chunks_cut_by_size(monkeypatch):
+    monkeypatch.setattr(pagination, "STREAM_CHUNK_SIZE", 1000)
+    chunks = list(streamed_page(50).chunks)
+    assert len(chunks) > 2
+    assert all(len(chunk) < 2000 for chunk in chunks)
+
+
+def peak_streamed(size: int) -> int:
+    tracemalloc.start()
+    try:
+        for _ in streamed_page(size).chunks:
+            pass
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_streamed_page_memory_independent_of_size(monkeypatch):
+    monkeypatch.setattr(pagination, "STREAM_CHUNK_SIZE", 1000)
+    peak_streamed(10)
+
+    # ten times the rows, about the same peak
+    assert peak_streamed(5000) < 2 * peak_streamed(500)
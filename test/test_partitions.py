@@ -0,0 +1,77 @@
+import asyncio
+from datetime import date, datetime
+from sqlalchemy import text
+
+import partitions
+from partitions import (
+    DEFAULT_PARTITION,
+    create_partition,
+    detach_partition,
+    ensure_partitions,
+    list_partitions,
+    maintain_partitions,
+    partition_month,
+    partition_name,
+)
+from .utils import *
+
+
+def test_ensure_partitions_creates_upcoming_months():
+    with engine.begin() as connection:
+        names = ensure_partitions(connection, months_ahead=2,
+                                  today=date(2030, 11, 15))
+        partitions = list_partitions(connection)
+        for name in names:
+            detach_partition(connection, partition_month(name), drop=True)
+
+    assert names == ["receipts_2030_11", "receipts_2030_12", "receipts_2031_01"]
+    assert set(names) <= set(partitions)
+    assert DEFAULT_PARTITION in partitions
+
+
+def test_create_partition_moves_rows_from_default(test_receipt):
+    with engine.begin() as connection:
+        in_default = connection.execute(text(
+            f"SELECT count(*) FROM {DEFAULT_PARTITION}")).scalar()
+        name = create_partition(connection, date(2024, 3, 1))
+        in_partition = connection.execute(text(
+            f"SELECT count(*) FROM {name}")).scalar()
+        detach_partition(connection, date(2024, 3, 1), drop=True)
+
+    assert in_default == 1
+    assert name == partition_name(date(2024, 3, 1))
+    assert in_partition == 1
+
+
+def test_date_range_query_prunes_partitions():
+    with engine.begin() as connection:
+        ensure_partitions(connection, months_ahead=1, today=date(2030, 1, 1))
+        plan = connection.execute(text(
+            "EXPLAIN SELECT * FROM receipts "
+            "WHERE created_at >= :start AND created_at < :end"
+        ), {"start": datetime(2030, 1, 1), "end": datetime(2030, 2, 1)})\
+            .scalars().all()
+        detach_partition(connection, date(2030, 1, 1), drop=True)
+        detach_partition(connection, date(2030, 2, 1), drop=True)
+
+    plan = "\n".join(plan)
+    assert "receipts_2030_01" in plan
+    assert "receipts_2030_02" not in plan
+    assert DEFAULT_PARTITION not in plan
+
+
+@pytest.mark.asyncio
+async def test_maintain_partitions_survives_failed_runs(monkeypatch):
+    runs = []
+
+    def failing_maintenance():
+        runs.append(datetime.now())
+        raise RuntimeError("database unreachable")
+
+    monkeypatch.setattr(partitions, "run_partition_maintenance",
+                        failing_maintenance)
+    maintenance = asyncio.create_task(maintain_partitions(interval=0))
+    while len(runs) < 3:
+        await asyncio.sleep(0.01)
+    assert not maintenance.done()
+    maintenance.cancel()
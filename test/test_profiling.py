@@ -0,0 +1,118 @@
+import os
+import sys
+import time
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from profiling import (ProfileAggregate, ProfilingMiddleware, RequestProfile,
+                       folded_stack, profiled)
+from singleflight import SingleFlight
+
+
+SECRET_KEY = "test-secret"
+ALGORITHM = "HS256"
+
+
+def busy(seconds: float):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+    return "done"
+
+
+def profiled_app(**options):
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware, interval_ms=1,
+                       secret_key=SECRET_KEY, algorithm=ALGORITHM, **options)
+
+    @app.get("/receipts")
+    async def list_receipts():
+        busy(0.05)
+        return PlainTextResponse(
+            await SingleFlight(wrap=profiled).run(None, busy, 0.05))
+
+    return app
+
+
+def auth_headers(is_admin: bool):
+    token = jwt.encode({"sub": "testuser", "id": 1, "is_admin": is_admin},
+                       SECRET_KEY, algorithm=ALGORITHM)
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_folded_stack_stops_at_marker():
+    def inner():
+        return folded_stack(sys._getframe(), marker)
+
+    marker = sys._getframe()
+    stack = inner()
+    assert stack.split(";")[0].endswith("test_folded_stack_stops_at_marker")
+    assert stack.endswith("test_folded_stack_stops_at_marker.<locals>.inner")
+    assert folded_stack(sys._getframe(), None) is None
+
+
+def test_profile_returned_for_admin(tmp_path):
+    client = TestClient(profiled_app(profile_dir=str(tmp_path)))
+    response = client.get("/receipts",
+                          headers={**auth_headers(True), "X-Profile": "return"})
+    assert response.status_code == 200
+    assert response.headers["x-profiled-status"] == "200"
+    assert int(response.headers["x-profile-samples"]) > 0
+
+    stacks = response.text.splitlines()
+    assert all(stack.startswith("GET list_receipts;") for stack in stacks)
+    # samples from the event loop and from the threadpool worker
+    assert any("list_receipts" in stack.split(";", 1)[1] for stack in stacks)
+    assert any("run_profiled" in stack for stack in stacks)
+
+
+def test_profile_stored_for_admin(tmp_path):
+    client = TestClient(profiled_app(profile_dir=str(tmp_path)))
+    response = client.get("/receipts?profile=store",
+                          headers=auth_headers(True))
+    assert response.status_code == 200
+    assert response.text == "done"
+
+    path = response.headers["x-profile-path"]
+    assert os.path.dirname(path) == str(tmp_path)
+    with open(path) as profile_file:
+        assert "busy" in profile_file.read()
+
+
+def test_profile_ignored_for_non_admin(tmp_path):
+    client = TestClient(profiled_app(profile_dir=str(tmp_path)))
+    response = client.get("/receipts",
+                          headers={**auth_headers(False), "X-Profile": "store"})
+    assert response.status_code == 200
+    assert response.text == "done"
+    assert "x-profile-path" not in response.headers
+    assert os.listdir(tmp_path) == []
+
+
+def test_sampled_requests_aggregated(tmp_path):
+    aggregate = ProfileAggregate(str(tmp_path), flush_seconds=0)
+    client = TestClient(profiled_app(profile_dir=str(tmp_path), sample_rate=1,
+                                     aggregate=aggregate))
+    for _ in range(2):
+        assert client.get("/receipts").text == "done"
+
+    with open(aggregate.path) as profile_file:
+        stacks = profile_file.read().splitlines()
+    assert stacks
+    assert all(stack.startswith("GET list_receipts;") for stack in stacks)
+    assert sum(int(stack.rsplit(" ", 1)[1]) for stack in stacks) == \
+        sum(aggregate.stacks.values())
+
+
+def test_profile_aggregate_flushes_periodically(tmp_path):
+    aggregate = ProfileAggregate(str(tmp_path), flush_seconds=3600)
+    profile = RequestProfile()
+    profile.stacks["main.py:work"] = 3
+    aggregate.add(profile, "GET work")
+    assert not os.path.exists(aggregate.path)
+
+    aggregate.flush()
+    with open(aggregate.path) as profile_file:
+        assert profile_file.read() == "GET work;main.py:work 3\n"
@@ -0,0 +1,133 @@
+import asyncio
+import pytest
+import time
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from rate_limit import LoopLagMonitor, RateLimitMiddleware, TokenBuckets
+
+
+SECRET_KEY = "test-secret"
+ALGORITHM = "HS256"
+
+lag_monitor = LoopLagMonitor()
+app = FastAPI()
+app.add_middleware(RateLimitMiddleware, rate=1, burst=2, auth_rate=1,
+                   auth_burst=1, max_in_flight=1, max_loop_lag_ms=100,
+                   lag_monitor=lag_monitor, secret_key=SECRET_KEY,
+                   algorithm=ALGORITHM, enabled=True)
+
+
+@app.get("/receipts")
+def receipts():
+    return PlainTextResponse("receipts")
+
+
+@app.post("/auth/token")
+def token():
+    return PlainTextResponse("token")
+
+
+@app.get("/healthy")
+def healthy():
+    return PlainTextResponse("healthy")
+
+
+client = TestClient(app)
+
+
+def auth_headers(user_id: int):
+    token = jwt.encode({"sub": "testuser", "id": user_id}, SECRET_KEY,
+                       algorithm=ALGORITHM)
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_token_buckets_refill():
+    buckets = TokenBuckets(rate=2, burst=1)
+    assert buckets.take("user", now=0) == 0
+    assert buckets.take("user", now=0.25) == pytest.approx(0.25)
+    assert buckets.take("user", now=0.5) == 0
+
+
+def test_token_buckets_prune_full_buckets():
+    buckets = TokenBuckets(rate=1, burst=1, max_keys=1)
+    buckets.take("first", now=0)
+    buckets.take("second", now=5)
+    assert list(buckets.buckets) == ["second"]
+
+
+def test_rate_limit_per_user():
+    for _ in range(2):
+        assert client.get("/receipts", headers=auth_headers(101))\
+            .status_code == 200
+
+    response = client.get("/receipts", headers=auth_headers(101))
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+
+    # other users have their own buckets
+    assert client.get("/receipts", headers=auth_headers(102))\
+        .status_code == 200
+
+
+def test_rate_limit_token_by_ip():
+    assert client.post("/auth/token").status_code == 200
+    response = client.post("/auth/token")
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+
+
+def test_requests_without_token_are_not_limited():
+    for _ in range(5):
+        assert client.get("/receipts").status_code == 200
+
+
+def test_load_shedding_on_loop_lag(monkeypatch):
+    monkeypatch.setattr(lag_monitor, "lag", 0.5)
+    response = client.get("/receipts", headers=auth_headers(103))
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert client.get("/healthy").status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_load_shedding_on_in_flight_requests():
+    release = asyncio.Event()
+
+    async def slow_app(scope, receive, send):
+        await release.wait()
+        await PlainTextResponse("done")(scope, receive, send)
+
+    middleware = RateLimitMiddleware(slow_app, max_in_flight=1,
+                                     lag_monitor=LoopLagMonitor(),
+                                     enabled=True)
+    scope = {"type": "http", "path": "/receipts", "headers": [],
+             "client": ("127.0.0.1", 1)}
+    statuses = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    first = asyncio.create_task(middleware(scope, None, send))
+    await asyncio.sleep(0)
+    await middleware(scope, None, send)
+    release.set()
+    await first
+
+    assert statuses == [503, 200]
+    assert middleware.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_monitor():
+    monitor = LoopLagMonitor(interval_ms=10)
+    task = asyncio.create_task(monitor.run())
+    await asyncio.sleep(0.015)
+    # blocks the loop, as a slow synchronous handler would
+    time.sleep(0.1)
+    await asyncio.sleep(0.001)
+    task.cancel()
+    assert monitor.lag >= 0.05
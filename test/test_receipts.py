@@ -1,16 +1,26 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from dateutil.relativedelta import relativedelta
 from fastapi import status
 import copy
+import pytest
 import re
 
-from pagination import PageParams
-from models import Receipts
-from routers.receipts import get_db, get_current_user
+import archive
+from pagination import MAX_PAGE_SIZE, PageParams
+from models import ReceiptEvents, Receipts
+from routers import receipts as receipts_router
+from routers.receipts import (
+    get_db,
+    get_current_user,
+    get_read_db,
+    get_replica_db,
+)
 from .utils import *
 
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+app.dependency_overrides[get_replica_db] = override_get_db
 app.dependency_overrides[get_current_user] = override_get_current_user
 
 receipt_response = {
@@ -32,7 +42,7 @@ receipt_response = {
     "payment": {"type": "cash", "amount": 40.00},
     "total": 37.71,
     "rest": 2.29,
-    "created_at": "2024-03-06T17:29:59.073344",
+    "created_at": "2024-03-06T17:29:59.073344Z",
     "owner_id": 1
 }
 
@@ -57,6 +67,50 @@ def test_get_all_receipts_authenticated(test_receipt):
     assert response.json() == receipts_response
 
 
+def test_get_all_receipts_ordered_by_id(test_receipt, monkeypatch):
+    monkeypatch.setattr(receipts_router, "ORDER_RECEIPTS_BY_ID", True)
+    request_data = {
+        "products": [{"name": "Bar of chocolate", "price": 20.00,
+                      "quantity": 1}],
+        "payment": {"type": "cash", "amount": 20.00}
+    }
+    first_id = client.post("/receipt", json=request_data).json()["id"]
+    second_id = client.post("/receipt", json=request_data).json()["id"]
+
+    response = client.get("/receipts")
+    assert response.status_code == status.HTTP_200_OK
+    # The fixture receipt has a random v4 id that sorts above both v7 ids
+    assert [receipt["id"] for receipt in response.json()["results"]] == \
+        ["daafa0dc-06bb-40fd-8472-c8fa6ed47a43", second_id, first_id]
+
+
+def test_get_all_receipts_summary_view(test_receipt):
+    query_params = {
+        "page": page_params.page,
+        "size": page_params.size,
+        "view": "summary"
+    }
+    response = client.get("/receipts", params=query_params)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["results"] == [{
+        "id": "daafa0dc-06bb-40fd-8472-c8fa6ed47a43",
+        "total": 37.71,
+        "created_at": "2024-03-06T17:29:59.073344Z",
+        "payment_type": "cash",
+        "items_count": 2,
+        "owner_id": 1
+    }]
+
+
+def test_get_all_receipts_page_size_above_maximum(test_receipt):
+    query_params = {
+        "page": page_params.page,
+        "size": MAX_PAGE_SIZE + 1
+    }
+    response = client.get("/receipts", params=query_params)
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
 def test_get_receipts_by_payment_type_authenticated_success(test_receipt):
     query_params = {
         "payment_type": "cash",
@@ -81,14 +135,14 @@ def test_get_receipts_by_payment_type_authenticated_not_found(test_receipt):
 
 def test_get_receipts_created_within_last_month_authenticated_success(test_receipt):
     receipt_date = datetime.strptime(
-        receipts_response["results"][0]["created_at"], "%Y-%m-%dT%H:%M:%S.%f")
+        receipts_response["results"][0]["created_at"], "%Y-%m-%dT%H:%M:%S.%fZ")
 
     receipt_date_last_month = receipt_date - relativedelta(months=1)
 
     receipts_response_copy = copy.deepcopy(receipts_response)
     receipts_response_copy["results"][0]["id"] = "daafa0dc-1111-40fd-8472-c8fa6ed47a43"
     receipts_response_copy["results"][0]["created_at"] = receipt_date_last_month.strftime(
-        "%Y-%m-%dT%H:%M:%S.%f")
+        "%Y-%m-%dT%H:%M:%S.%fZ")
 
     db = TestingSessionLocal()
     new_receipt = Receipts(
@@ -110,7 +164,7 @@ def test_get_receipts_created_within_last_month_authenticated_success(test_recei
         payment={"type": "cash", "amount": 40.00},
         total=37.71,
         rest=2.29,
-        created_at=receipt_date_last_month.strftime("%Y-%m-%dT%H:%M:%S.%f"),
+        created_at=receipt_date_last_month.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
         owner_id=1
     )
     db.add(new_receipt)
@@ -167,6 +221,82 @@ def test_get_receipt_by_id_authenticated_not_found(test_receipt):
     assert response.json() == {"detail": "Receipt not found"}
 
 
+def test_get_receipt_by_id_archived(test_receipt, tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path))
+    archived = archive.archive_receipts(cutoff=datetime(2025, 1, 1),
+                                        archive_dir=str(tmp_path),
+                                        session_factory=TestingSessionLocal)
+    assert archived == 1
+
+    db = TestingSessionLocal()
+    assert db.query(Receipts).count() == 0
+
+    response = client.get("/receipt/daafa0dc-06bb-40fd-8472-c8fa6ed47a43")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == receipt_response
+
+
+def test_search_receipts(test_receipt):
+    response = client.get("/receipts/search", params={"q": "chocolate"})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"results": [receipt_response],
+                               "next_cursor": None}
+
+
+def test_search_receipts_not_found(test_receipt):
+    response = client.get("/receipts/search", params={"q": "pineapple"})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json() == {"detail": "Receipts not found"}
+
+
+def test_search_receipts_with_cursor(test_receipt):
+    response = client.post("/receipt", json={
+        "products": [{"name": "Chocolate milk", "price": 3.50, "quantity": 1}],
+        "payment": {"type": "cash", "amount": 5.00}
+    })
+    assert response.status_code == status.HTTP_201_CREATED
+
+    response = client.get("/receipts/search",
+                          params={"q": "chocolate", "size": 1})
+    assert response.status_code == status.HTTP_200_OK
+    first_page = response.json()
+    assert len(first_page["results"]) == 1
+    assert first_page["next_cursor"] is not None
+
+    response = client.get("/receipts/search", params={
+        "q": "chocolate", "size": 1, "cursor": first_page["next_cursor"]})
+    assert response.status_code == status.HTTP_200_OK
+    second_page = response.json()
+    assert len(second_page["results"]) == 1
+    assert second_page["next_cursor"] is None
+    assert second_page["results"][0]["id"] != first_page["results"][0]["id"]
+
+
+def test_search_receipts_invalid_cursor(test_receipt):
+    response = client.get("/receipts/search",
+                          params={"q": "chocolate", "cursor": "invalid"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json() == {"detail": "Invalid cursor"}
+
+
+def test_search_receipts_query_too_short(test_receipt):
+    response = client.get("/receipts/search", params={"q": "ch"})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_search_receipts_uses_trigram_index(test_receipt):
+    db = TestingSessionLocal()
+    # The table is tiny, so a sequential scan would always win on cost
+    db.execute(text("SET LOCAL enable_seqscan = off"))
+    plan = [row[0] for row in db.execute(text(
+        "EXPLAIN SELECT id FROM receipts "
+        "WHERE :q <% receipt_product_names(products)"), {"q": "chocolate"})]
+    db.rollback()
+
+    index_scans = [line for line in plan if "Index Scan on" in line]
+    assert any("product_names" in line for line in index_scans)
+
+
 def test_create_receipt(test_receipt):
     request_data = {
         "products": [
@@ -208,6 +338,10 @@ def test_create_receipt(test_receipt):
     assert re.match(id_pattern, response.json()["id"]) is not None
     assert response.json()["products"] == receipt_response_products
     assert response.json()["payment"] == receipt_response_payment
+    assert response.json()["created_at"].endswith("Z")
+    assert response.json()["owner_id"] == 1
+    # any worker reads the client's next requests from the primary
+    assert "last_write" in response.cookies
 
     db = TestingSessionLocal()
     model = db.query(Receipts).filter(Receipts.total == 55).first()
@@ -216,6 +350,70 @@ def test_create_receipt(test_receipt):
     assert model.payment == receipt_response_payment
     assert model.total == 55
     assert model.rest == 5
+    # set by the database when the row is inserted
+    assert abs(model.created_at - datetime.now(timezone.utc)) < \
+        timedelta(minutes=1)
+
+
+def test_create_receipt_group_commit(test_receipt, monkeypatch):
+    monkeypatch.setattr(receipts_router, "GROUP_COMMIT_ENABLED", True)
+    monkeypatch.setattr(receipts_router.receipt_buffer, "session_factory",
+                        TestingSessionLocal)
+    request_data = {
+        "products": [
+            {
+                "name": "Bar of chocolate",
+                "price": 20.00,
+                "quantity": 2,
+            }
+        ],
+        "payment": {
+            "type": "cash",
+            "amount": 60.00
+        }
+    }
+
+    response = client.post("/receipt", json=request_data)
+    assert response.status_code == status.HTTP_201_CREATED
+
+    db = TestingSessionLocal()
+    model = db.query(Receipts).filter(
+        Receipts.id == response.json()["id"]).first()
+    assert model.total == 40
+    assert model.rest == 20
+    assert model.owner_id == 1
+
+    event = db.query(ReceiptEvents).filter(
+        ReceiptEvents.receipt_id == response.json()["id"]).first()
+    assert event.event_type == "created"
+    assert event.payload["total"] == 40
+
+
+def test_create_receipt_writes_event(test_receipt):
+    request_data = {
+        "products": [
+            {
+                "name": "Bar of chocolate",
+                "price": 20.00,
+                "quantity": 2,
+            }
+        ],
+        "payment": {
+            "type": "cash",
+            "amount": 60.00
+        }
+    }
+
+    response = client.post("/receipt", json=request_data)
+    assert response.status_code == status.HTTP_201_CREATED
+
+    db = TestingSessionLocal()
+    event = db.query(ReceiptEvents).filter(
+        ReceiptEvents.receipt_id == response.json()["id"]).first()
+    assert event.event_type == "created"
+    assert event.owner_id == 1
+    assert event.payload["id"] == response.json()["id"]
+    assert event.payload["products"][0]["total"] == 40
 
 
 def test_delete_receipt_success(test_receipt):
@@ -227,6 +425,55 @@ def test_delete_receipt_success(test_receipt):
         Receipts.id == "daafa0dc-06bb-40fd-8472-c8fa6ed47a43").first()
     assert model is None
 
+    event = db.query(ReceiptEvents).filter(
+        ReceiptEvents.receipt_id == "daafa0dc-06bb-40fd-8472-c8fa6ed47a43"
+    ).first()
+    assert event.event_type == "deleted"
+    assert event.payload == {"id": "daafa0dc-06bb-40fd-8472-c8fa6ed47a43"}
+
+
+def test_get_all_receipts_cached_until_write(test_receipt):
+    response = client.get("/receipts", params={"page": 1, "size": 10})
+    assert response.json()["total_results"] == 1
+
+    # a row written around the API isn't seen while the page is cached
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM receipts;"))
+        connection.commit()
+    response = client.get("/receipts", params={"page": 1, "size": 10})
+    assert response.json()["total_results"] == 1
+
+    client.post("/receipt", json={
+        "products": [{"name": "Milk", "price": 1.5, "quantity": 2}],
+        "payment": {"type": "cash", "amount": 5}})
+    response = client.get("/receipts", params={"page": 1, "size": 10})
+    assert response.json()["total_results"] == 1
+    assert response.json()["results"][0]["products"][0]["name"] == "Milk"
+
+
+def test_replica_page_not_cached_right_after_write(test_receipt,
+                                                    monkeypatch):
+    def override_get_replica_read_db():
+        db = TestingSessionLocal(info={"replica": True})
+        try:
+            yield db
+        finally:
+            db.close()
+
+    monkeypatch.setitem(app.dependency_overrides, get_read_db,
+                        override_get_replica_read_db)
+    client.post("/receipt", json={
+        "products": [{"name": "Milk", "price": 1.5, "quantity": 2}],
+        "payment": {"type": "cash", "amount": 5}})
+    response = client.get("/receipts", params={"page": 1, "size": 10})
+    assert response.json()["total_results"] == 2
+
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM receipts;"))
+        connection.commit()
+    response = client.get("/receipts", params={"page": 1, "size": 10})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
 
 def test_delete_receipt_not_found(test_receipt):
     response = client.delete("/receipt/11111111-1111-1111-1111-111111111111")
@@ -234,6 +481,39 @@ def test_delete_receipt_not_found(test_receipt):
     assert response.json() == {"detail": "Receipt not found"}
 
 
+def test_get_all_receipts_with_same_created_at(test_receipt):
+    # the receipts of one group commit share their created_at
+    db = TestingSessionLocal()
+    db.add(Receipts(id=uuid.UUID("ffffffff-1111-40fd-8472-c8fa6ed47a43"),
+                    products=test_receipt.products,
+                    payment=test_receipt.payment, total=test_receipt.total,
+                    rest=test_receipt.rest,
+                    created_at=test_receipt.created_at, owner_id=1))
+    db.commit()
+
+    ids = [client.get("/receipts", params={"page": page, "size": 1})
+           .json()["results"][0]["id"] for page in (1, 2)]
+    assert ids == ["ffffffff-1111-40fd-8472-c8fa6ed47a43",
+                   "daafa0dc-06bb-40fd-8472-c8fa6ed47a43"]
+
+
+@pytest.mark.asyncio
+async def test_cached_page_skipped_after_own_write():
+    user = {"id": 1}
+    key = ("/receipts", 1, 1, 10, "full")
+    # cached by a worker that didn't see the client's write
+    page_cache.set(page_cache.key(1, key), '"stale"')
+
+    db = TestingSessionLocal()
+    response = await receipts_router.cached_page(user, db, key,
+                                                 lambda: "fresh")
+    assert response.body == b'"stale"'
+
+    db.info["recently_written"] = True
+    assert await receipts_router.cached_page(user, db, key,
+                                             lambda: "fresh") == "fresh"
+
+
 def test_get_receipt_text(test_receipt):
     query_params = {
         "max_characters_per_line": 50
@@ -245,6 +525,34 @@ def test_get_receipt_text(test_receipt):
     assert response.text.strip() != ""
 
 
+def test_get_receipt_text_too_wide(test_receipt):
+    response = client.get(
+        "/receipt/daafa0dc-06bb-40fd-8472-c8fa6ed47a43/text",
+        params={"max_characters_per_line": 201})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_get_receipt_text_formats(test_receipt):
+    response = client.get(
+        "/receipt/daafa0dc-06bb-40fd-8472-c8fa6ed47a43/text",
+        params={"format": "html"})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/html")
+    assert "Bar of chocolate" in response.text
+
+    response = client.get(
+        "/receipt/daafa0dc-06bb-40fd-8472-c8fa6ed47a43/text",
+        params={"format": "escpos"})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/octet-stream"
+    assert response.content.startswith(b"\x1b@")
+
+    response = client.get(
+        "/receipt/daafa0dc-06bb-40fd-8472-c8fa6ed47a43/text",
+        params={"format": "pdf"})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
 def test_get_receipt_text_not_found(test_receipt):
     query_params = {
         "max_characters_per_line": 50
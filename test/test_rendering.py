@@ -0,0 +1,93 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from rendering import get_layout, render_receipt, wrap_words
+
+
+receipt = {
+    "issuer": "ФОП TEST USER",
+    "products": [
+        {
+            "name": "Bar of chocolate",
+            "price": 10.38,
+            "quantity": 2.0,
+            "total": 20.76
+        },
+        {
+            "name": "Bottle of sparkling water",
+            "price": 5.65,
+            "quantity": 3.0,
+            "total": 16.95
+        }
+    ],
+    "payment": {"type": "cash", "amount": 40.00},
+    "total": Decimal("37.71"),
+    "rest": Decimal("2.29"),
+    "created_at": datetime(2024, 3, 6, 17, 29, 59, tzinfo=timezone.utc),
+}
+
+
+def test_render_text():
+    assert render_receipt(receipt, "text", 30) == "\n".join([
+        "",
+        "        ФОП TEST USER         ",
+        "==============================",
+        "2.00 x 10.38",
+        "Bar of chocolate         20.76",
+        "------------------------------",
+        "3.00 x 5.65",
+        "Bottle of",
+        "sparkling water          16.95",
+        "------------------------------",
+        "==============================",
+        "СУМА                     37.71",
+        "Готівка                  40.00",
+        "Решта                     2.29",
+        "==============================",
+        "     06.03.2024 17:29:59      ",
+        "     Дякуємо за покупку!      ",
+        "",
+    ])
+
+
+def test_wrap_words():
+    assert wrap_words("Bottle of sparkling water".split(" "), 20) == \
+        ["Bottle of", "sparkling water"]
+    # a word longer than the line no longer hangs the renderer
+    assert wrap_words(["Supercalifragilistic"], 10) == \
+        ["Supercalifragilistic"]
+    assert wrap_words(["Extra", "Supercalifragilistic"], 10) == \
+        ["Extra", "Supercalifragilistic"]
+
+
+def test_render_text_long_word():
+    long_word_receipt = {**receipt, "products": [
+        {"name": "Supercalifragilisticexpialidocious", "price": 1.0,
+         "quantity": 1.0, "total": 1.0}]}
+    lines = render_receipt(long_word_receipt, "text", 20).split("\n")
+    assert lines[3:7] == [
+        "1.00 x 1.00",
+        "Supercalifragilisticexpialidocious",
+        "                1.00",
+        "--------------------",
+    ]
+
+
+def test_render_escpos():
+    content = render_receipt(receipt, "escpos", 30)
+    assert content.startswith(b"\x1b@\x1bt")
+    assert content.endswith(b"\x1dV\x42\x00")
+    assert "Решта".encode("cp1125") in content
+
+
+def test_render_html_escapes_names():
+    content = render_receipt(
+        {**receipt, "products": [{"name": "<b>Milk</b>", "price": 1,
+                                  "quantity": 1}]}, "html", 30)
+    assert "&lt;b&gt;Milk&lt;/b&gt;" in content
+    assert 'style="max-width: 30ch"' in content
+
+
+def test_layouts_are_compiled_once():
+    assert get_layout("text", 42) is get_layout("text", 42)
+    assert get_layout("text", 42) is not get_layout("html", 42)
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import pytest
+
+from singleflight import SingleFlight
+
+
+def blocking_call(started: threading.Event, release: threading.Event,
+                  calls: list, result):
+    calls.append(result)
+    started.set()
+    release.wait(5)
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+async def start_flights(flight, key, count, *args):
+    tasks = [asyncio.create_task(flight.run(key, blocking_call, *args))
+             for _ in range(count)]
+    await asyncio.to_thread(args[0].wait, 5)
+    return tasks
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_result():
+    flight = SingleFlight(enabled=True)
+    started, release, calls = threading.Event(), threading.Event(), []
+    tasks = await start_flights(flight, "key", 5, started, release, calls,
+                                "page")
+    release.set()
+    assert await asyncio.gather(*tasks) == ["page"] * 5
+    assert calls == ["page"]
+    assert flight.calls == {}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_exception():
+    flight = SingleFlight(enabled=True)
+    started, release, calls = threading.Event(), threading.Event(), []
+    tasks = await start_flights(flight, "key", 3, started, release, calls,
+                                ValueError("not found"))
+    release.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_cancel_the_call():
+    flight = SingleFlight(enabled=True)
+    started, release, calls = threading.Event(), threading.Event(), []
+    first, second = await start_flights(flight, "key", 2, started, release,
+                                        calls, "page")
+    first.cancel()
+    release.set()
+    assert await second == "page"
+
+
+@pytest.mark.asyncio
+async def test_calls_without_key_are_not_shared():
+    flight = SingleFlight(enabled=True)
+    release = threading.Event()
+    release.set()
+    calls = []
+    await asyncio.gather(*[
+        flight.run(None, blocking_call, threading.Event(), release, calls,
+                   "page") for _ in range(3)])
+    assert calls == ["page"] * 3
+
+
+@pytest.mark.asyncio
+async def test_wrap_applied_to_calls():
+    def wrap(func):
+        return lambda *args: f"wrapped {func(*args)}"
+
+    flight = SingleFlight(enabled=True, wrap=wrap)
+    assert await flight.run("page", str.upper, "page") == "wrapped PAGE"
+    assert await flight.run(None, str.upper, "page") == "wrapped PAGE"
@@ -1,11 +1,20 @@
+from datetime import datetime, timedelta
 from fastapi import status
 
-from routers.users import get_db, get_current_user
+from models import UserDeletions
+from routers import auth
+from routers.users import (
+    get_db,
+    get_current_user,
+    get_token_user,
+    resume_user_deletions
+)
 from .utils import *
 
 
 app.dependency_overrides[get_db] = override_get_db
 app.dependency_overrides[get_current_user] = override_get_current_user
+app.dependency_overrides[get_token_user] = override_get_current_user
 
 
 def test_get_user(test_user):
@@ -39,3 +48,71 @@ def test_delete_user(test_user):
     db = TestingSessionLocal()
     model = db.query(Users).filter(Users.id == 1).first()
     assert model is None
+
+
+def test_delete_user_with_receipts(test_receipt):
+    response = client.delete("/user/delete")
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+
+    db = TestingSessionLocal()
+    assert db.query(Users).filter(Users.id == 1).first() is None
+    assert db.query(Receipts).filter(Receipts.owner_id == 1).count() == 0
+
+    response = client.get("/user/delete")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["status"] == "completed"
+    assert response.json()["receipts_deleted"] == 1
+
+
+def test_get_user_deletion_with_token_of_deleted_user(test_receipt):
+    token = auth.create_access_token("testuser", 1, True, timedelta(minutes=20))
+    headers = {"Authorization": f"Bearer {token}"}
+    overrides = {dependency: app.dependency_overrides.pop(dependency)
+                 for dependency in (get_current_user, get_token_user)}
+    app.dependency_overrides[auth.get_db] = override_get_db
+    try:
+        response = client.delete("/user/delete", headers=headers)
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+
+        response = client.get("/user", headers=headers)
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+        response = client.get("/user/delete", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["status"] == "completed"
+        assert response.json()["receipts_deleted"] == 1
+    finally:
+        app.dependency_overrides.update(overrides)
+
+
+def test_get_user_deletion_not_found(test_user):
+    response = client.get("/user/delete")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json() == {"detail": "User deletion not found"}
+
+
+def add_user_deletion(status: str, heartbeat_at: datetime):
+    db = TestingSessionLocal()
+    db.add(UserDeletions(user_id=1, status=status, receipts_deleted=0,
+                         started_at=heartbeat_at, heartbeat_at=heartbeat_at))
+    db.commit()
+
+
+def test_resume_user_deletions_after_crash(test_receipt):
+    add_user_deletion("running", datetime.utcnow() - timedelta(hours=1))
+    assert resume_user_deletions(TestingSessionLocal) == [1]
+
+    db = TestingSessionLocal()
+    assert db.query(Users).filter(Users.id == 1).first() is None
+    deletion = db.get(UserDeletions, 1)
+    assert deletion.status == "completed"
+    assert deletion.receipts_deleted == 1
+
+
+def test_resume_user_deletions_skips_running_deletion(test_receipt):
+    add_user_deletion("running", datetime.utcnow())
+    resume_user_deletions(TestingSessionLocal)
+
+    db = TestingSessionLocal()
+    assert db.query(Users).filter(Users.id == 1).first() is not None
+    assert db.get(UserDeletions, 1).status == "running"
@@ -1,32 +1,144 @@
+import hashlib
+import inspect
+import os
+import psycopg2.extensions
 import pytest
 import uuid
+from datetime import date
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine, text
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
+from sqlalchemy.schema import CreateIndex, CreateTable
 from dotenv import load_dotenv
 
-from database import Base
+from database import DB_CONNECT_ARGS, Base
 from main import app
 from models import Receipts, Users
+from page_cache import page_cache
 from routers.auth import bcrypt_context
 
 
-DB_USERNAME = "postgres"
-DB_PASSWORD = "password"
-DB_NAME = "TestCheckboxDatabase"
-DB_HOST = "localhost"
-DB_PORT = 5432
+load_dotenv()
+
+DB_USERNAME = os.getenv("TEST_DB_USERNAME", "postgres")
+DB_PASSWORD = os.getenv("TEST_DB_PASSWORD", "password")
+# the template every test database is cloned from
+DB_NAME = os.getenv("TEST_DB_NAME", "TestCheckboxDatabase")
+DB_HOST = os.getenv("TEST_DB_HOST", "localhost")
+DB_PORT = os.getenv("TEST_DB_PORT", 5432)
+DB_MAINTENANCE_NAME = os.getenv("TEST_DB_MAINTENANCE_NAME", "postgres")
+
+# one database per pytest-xdist worker, so parallel tests don't share rows
+WORKER_DB_NAME = f"{DB_NAME}_{os.getenv('PYTEST_XDIST_WORKER', 'main')}"
+TEMPLATE_LOCK_KEY = 20240306
+
+
+def database_url(name: str) -> str:
+    return f"postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{name}"
+
+
+SQLALCHEMY_DATABASE_URL = database_url(WORKER_DB_NAME)
+
+
+class SavepointConnection(psycopg2.extensions.connection):
+    # Commits and rollbacks of the code under test only release or roll back
+    # a savepoint, the transaction around it is rolled back after each test.
+    savepoint_open = False
+
+    def cursor(self, *args, **kwargs):
+        if not self.savepoint_open:
+            super().cursor().execute("SAVEPOINT test_savepoint")
+            self.savepoint_open = True
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        if self.savepoint_open:
+            self.savepoint_open = False
+            super().cursor().execute("RELEASE SAVEPOINT test_savepoint")
+
+    def rollback(self):
+        if self.savepoint_open:
+            self.savepoint_open = False
+            super().cursor().execute("ROLLBACK TO SAVEPOINT test_savepoint; "
+                                     "RELEASE SAVEPOINT test_savepoint")
+
+    def rollback_test(self):
+        self.savepoint_open = False
+        super().rollback()
+
+
+def schema_fingerprint() -> str:
+    # The initial partitions depend on the month, so the template is also
+    # built again once a month.
+    dialect = postgresql.dialect()
+    statements = [date.today().strftime("%Y-%m")]
+    listener_modules = []
+    for table in Base.metadata.sorted_tables:
+        statements.append(str(CreateTable(table).compile(dialect=dialect)))
+        statements.extend(str(CreateIndex(index).compile(dialect=dialect))
+                          for index in table.indexes)
+        # The after_create listeners run their own DDL, e.g. partitions,
+        # the search index and triggers. Their modules are hashed whole, as
+        # the SQL is often kept in constants next to the listener.
+        for listener in table.dispatch.after_create:
+            module = inspect.getmodule(listener)
+            if module not in listener_modules:
+                listener_modules.append(module)
+    statements.extend(inspect.getsource(module) for module in listener_modules)
+    return hashlib.sha256("\n".join(statements).encode()).hexdigest()
+
+
+def create_test_database():
+    maintenance_engine = create_engine(database_url(DB_MAINTENANCE_NAME),
+                                       isolation_level="AUTOCOMMIT")
+    fingerprint = schema_fingerprint()
+    try:
+        with maintenance_engine.connect() as connection:
+            # Workers starting together build the template once and clone it
+            # one after the other, a template can't be cloned while in use.
+            connection.execute(text("SELECT pg_advisory_lock(:key)"),
+                               {"key": TEMPLATE_LOCK_KEY})
+            template_fingerprint = connection.execute(text(
+                "SELECT shobj_description(oid, 'pg_database') "
+                "FROM pg_database WHERE datname = :name"),
+                {"name": DB_NAME}).scalar()
+
+            if template_fingerprint != fingerprint:
+                connection.execute(text(f'DROP DATABASE IF EXISTS "{DB_NAME}"'))
+                connection.execute(text(f'CREATE DATABASE "{DB_NAME}"'))
+                template_engine = create_engine(database_url(DB_NAME),
+                                                connect_args=DB_CONNECT_ARGS)
+                Base.metadata.create_all(bind=template_engine)
+                template_engine.dispose()
+                connection.execute(text(
+                    f"COMMENT ON DATABASE \"{DB_NAME}\" IS '{fingerprint}'"))
+
+            connection.execute(text(
+                f'DROP DATABASE IF EXISTS "{WORKER_DB_NAME}"'))
+            connection.execute(text(
+                f'CREATE DATABASE "{WORKER_DB_NAME}" TEMPLATE "{DB_NAME}"'))
+    finally:
+        maintenance_engine.dispose()
+
 
-SQLALCHEMY_DATABASE_URL = f"postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+create_test_database()
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=StaticPool)
+# Everything runs on one connection, which is what lets a single rollback
+# undo all of a test's writes. Returning the connection doesn't roll back,
+# as that would also undo the writes of other sessions still using it.
+engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=StaticPool,
+                       pool_reset_on_return=None,
+                       connect_args={**DB_CONNECT_ARGS,
+                                     "connection_factory": SavepointConnection})
 
 TestingSessionLocal = sessionmaker(autocommit=False,
                                    autoflush=False,
                                    bind=engine)
 
-Base.metadata.create_all(bind=engine)
+# hashed once, bcrypt is deliberately slow
+HASHED_PASSWORD = bcrypt_context.hash("testpassword")
 
 
 def override_get_db():
@@ -45,24 +157,32 @@ client = TestClient(app)
 
 
 @pytest.fixture(autouse=True)
-def test_user(request):
+def test_transaction():
+    yield
+    connection = engine.raw_connection()
+    try:
+        connection.dbapi_connection.rollback_test()
+    finally:
+        connection.close()
+    # rows written around the API leave cached pages behind
+    page_cache.invalidate_all()
+
+
+@pytest.fixture(autouse=True)
+def test_user(test_transaction):
     user = Users(
         id=1,
         username="testuser",
         email="testuser@gmail.com",
         first_name="test",
         last_name="user",
-        hashed_password=bcrypt_context.hash("testpassword"),
+        hashed_password=HASHED_PASSWORD,
         is_admin=True
     )
     db = TestingSessionLocal()
     db.add(user)
     db.commit()
-
-    yield user
-    with engine.connect() as connection:
-        connection.execute(text("DELETE FROM users;"))
-        connection.commit()
+    return user
 
 
 @pytest.fixture()
@@ -93,7 +213,4 @@ def test_receipt():
 
     db.add(receipt)
     db.commit()
-    yield receipt
-    with engine.connect() as connection:
-        connection.execute(text("DELETE FROM receipts;"))
-        connection.commit()
+    return receipt